@@ -3,3 +3,10 @@ __version__ = "0.3.0"
 from .wrapper import Shelly
 from .gen1 import ShellyGen1
 from .gen2 import ShellyGen2
+from .transport import ShellySession
+from .command import Command, CommandSet
+from .fleet import ShellyFleet
+from .detect import DetectionCache, detect_many
+from .discovery import discover
+from .metrics import MetricsAggregator, add_hook, remove_hook
+from .health import DeviceHealth
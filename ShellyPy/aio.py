@@ -0,0 +1,671 @@
+"""
+asyncio counterparts of the device classes
+
+requires aiohttp, every request method returns a coroutine
+"""
+import json
+from asyncio import FIRST_COMPLETED, Lock, Semaphore, ensure_future, gather, get_running_loop, wait
+from time import perf_counter
+
+import aiohttp
+
+from .codec import decode
+from .command import CommandSet
+from .config import RolloutSummary, applier, patch, stages
+from .detect import default_cache, device_class
+from .error import BadLogin, BadResponse, NotFound
+from .fleet import FleetResult, ShellyFleet, _attach_limit
+from .metrics import GLOBAL_HOOKS
+from .scheduler import FleetLimit, RequestScheduler
+from .gen1 import ShellyGen1
+from .gen2 import ShellyGen2, ShellyGen2Batch
+
+
+def create_session(limit = 100, limit_per_host = 2, keepalive = 30):
+    """
+    @brief      create a session that can be shared between async devices
+
+    @param      limit           maximum amount of concurrent connections over all devices
+    @param      limit_per_host  maximum amount of concurrent connections per device
+    @param      keepalive       drop kept-alive connections after being idle for this many seconds
+
+    @return     aiohttp.ClientSession
+    """
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive)
+
+    return aiohttp.ClientSession(connector=connector)
+
+
+class AsyncDeviceMixin:
+    """
+    session and concurrency handling shared by the async device classes
+
+    the attributes are slotted by the device classes, only one base may have slots
+    """
+
+    __slots__ = ()
+
+    def __init__(self, ip, port = "80", *args, **kwargs):
+        """
+        @param      session     aiohttp.ClientSession to share between devices, see create_session
+        @param      limit       maximum amount of concurrent requests to the device
+
+        `init` is handled by the AsyncShelly factory, as __init__ can not wait for update
+        """
+        kwargs.pop("init", None)
+
+        self.__owns_session__ = kwargs.get("session", None) is None
+        self.__pool_size__ = kwargs.get("pool_size", 2)
+        self.__limit__ = Semaphore(kwargs.get("limit", 2))
+
+        super().__init__(ip, port, *args, **kwargs)
+
+    def __new_session__(self, kwargs):
+        # aiohttp sessions have to be created inside of a running event loop
+        return None
+
+    def __new_coalescer__(self, window):
+        return AsyncCommandCoalescer(self, window)
+
+    async def flush(self):
+        """
+        @brief      async version of ShellyBase.flush
+        """
+        if self.__coalescer__ is not None:
+            await self.__coalescer__.flush()
+
+    def __get_session__(self):
+        if self.__session__ is None:
+            self.__session__ = create_session(limit_per_host=self.__pool_size__)
+
+        return self.__session__
+
+    async def __read_json__(self, response, event = None):
+        body = await response.read()
+
+        if event is not None:
+            event.status = response.status
+            event.bytes_in = len(body)
+
+        return self.__decode__(body)
+
+    async def post(self, page, values = None):
+        """
+        @brief      async version of ShellyBase.post
+        """
+        if not self.__hooks__ and not GLOBAL_HOOKS:
+            return await self.__cached_send__(page, values, None)
+
+        event = self.__event_start__(page)
+        try:
+            response = await self.__cached_send__(page, values, event)
+        except Exception as e:
+            self.__event_end__(event, e)
+            raise
+
+        self.__event_end__(event, None)
+        return response
+
+    async def __cached_send__(self, page, values, event):
+        if self.__cache__ is None:
+            return await self.__scheduled_send__(page, values, event)
+
+        found, response = self.__cache_get__(page, values)
+        if found:
+            if event is not None:
+                event.cached = True
+            return response
+
+        response = await self.__scheduled_send__(page, values, event)
+        self.__cache_put__(page, values, response)
+        return response
+
+    async def __scheduled_send__(self, page, values, event):
+        scheduler = self.__scheduler__
+        if scheduler is None:
+            return await self.__guarded_send__(page, values, event)
+
+        key = None
+        if self.__is_read__(page, values):
+            key = scheduler.key(page, values)
+
+        return await scheduler.arun(self.__priority__(page, values),
+                                    lambda: self.__guarded_send__(page, values, event),
+                                    key)
+
+    async def __guarded_send__(self, page, values, event):
+        if self.__health__ is None:
+            return await self.__send__(page, values, event)
+
+        return await self.__guarded__(lambda: self.__send__(page, values, event))
+
+    async def __guarded__(self, send):
+        """
+        @brief      async version of ShellyBase.__guarded__
+
+        @param      send    function returning the awaitable sending the request
+        """
+        health = self.__health__
+        if health is None:
+            return await send()
+
+        health.acquire()
+        start = perf_counter()
+        try:
+            response = await send()
+        except Exception as e:
+            health.record(perf_counter() - start, e)
+            raise
+        except BaseException:
+            # cancelled, says nothing about the device
+            health.release()
+            raise
+
+        health.success(perf_counter() - start)
+        return response
+
+    async def config_plan(self, desired):
+        """
+        @brief      async version of ShellyBase.config_plan
+        """
+        current = await self.__fresh__(*self.__config_source__(None))
+
+        plan = {}
+        for target, values in desired.items():
+            config = self.__config_of__(current, target)
+            if config is None:
+                config = await self.__fresh__(*self.__config_source__(target))
+
+            changed = patch(config, values)
+            if changed:
+                plan[target] = changed
+
+        return plan
+
+    async def apply_config(self, desired, dry_run = False):
+        """
+        @brief      async version of ShellyBase.apply_config
+        """
+        plan = await self.config_plan(desired)
+
+        if not dry_run:
+            for target, values in plan.items():
+                await self.post(*self.__config_request__(target, values))
+
+        return plan
+
+    async def close(self):
+        """
+        @brief      send queued commands and close the session if it is owned by the device
+        """
+        await self.flush()
+
+        if self.__owns_session__ and self.__session__ is not None:
+            await self.__session__.close()
+            self.__session__ = None
+
+
+class AsyncCommandCoalescer:
+    """
+    asyncio version of CommandCoalescer, submit returns an asyncio.Future
+    """
+
+    def __init__(self, device, window):
+        self.device = device
+        self.window = window
+
+        self.merged = 0
+        self.sent = 0
+
+        # channel to [page, values, futures]
+        self.__pending__ = {}
+        self.__tasks__ = set()
+        self.__lock__ = None
+
+    def submit(self, channel, page, values):
+        loop = get_running_loop()
+        future = loop.create_future()
+
+        entry = self.__pending__.get(channel)
+        if entry is None:
+            self.__pending__[channel] = [page, values, [future]]
+            loop.call_later(self.window, self.__schedule__, channel)
+        else:
+            entry[0], entry[1] = self.device.__coalesce__(entry[0], entry[1], page, values)
+            entry[2].append(future)
+            self.merged += 1
+
+        return future
+
+    def __schedule__(self, channel):
+        task = ensure_future(self.__send__(channel))
+        self.__tasks__.add(task)
+        task.add_done_callback(self.__tasks__.discard)
+
+    async def __send__(self, channel):
+        if self.__lock__ is None:
+            self.__lock__ = Lock()
+
+        # the command keeps merging later calls while the previous one is sent
+        async with self.__lock__:
+            entry = self.__pending__.pop(channel, None)
+            if entry is None:
+                return
+
+            page, values, futures = entry
+
+            try:
+                response = await self.device.post(page, values)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(response)
+
+            self.sent += 1
+
+    async def flush(self):
+        for channel in list(self.__pending__):
+            self.__schedule__(channel)
+
+        if self.__tasks__:
+            await gather(*self.__tasks__)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "pending": len(self.__pending__),
+        }
+
+
+class AsyncShellyGen1(AsyncDeviceMixin, ShellyGen1):
+
+    __slots__ = ("__owns_session__", "__pool_size__", "__limit__")
+
+    async def update(self):
+        """
+        @brief update the Shelly attributes
+        """
+        settings, status = await gather(self.settings(), self.status())
+
+        self.__parse_settings__(settings)
+        self.__parse_status__(status)
+
+    async def __send__(self, page, values = None, event = None):
+        url = self.__url__(page, values)
+
+        credentials = aiohttp.BasicAuth(*self.__credentials__)
+        timeout = aiohttp.ClientTimeout(total=self.__request_timeout__())
+
+        if event is not None:
+            event.bytes_out = len(url)
+
+        async with self.__limit__:
+            async with self.__get_session__().post(url, auth=credentials, timeout=timeout) as response:
+                self.__check_status__(response.status)
+                return await self.__read_json__(response, event)
+
+
+class AsyncShellyGen2(AsyncDeviceMixin, ShellyGen2):
+
+    __slots__ = ("__owns_session__", "__pool_size__", "__limit__")
+
+    async def update(self):
+        self.__parse_settings__(await self.settings())
+
+    async def __send__(self, page, values = None, event = None):
+        payload, payload_id = self.__request__(page, values)
+
+        return self.__result__(await self.__rpc__(payload, event), payload_id)
+
+    async def __batch_rpc__(self, payloads):
+        """
+        @brief      async version of ShellyGen2.__batch_rpc__
+        """
+        if not self.__hooks__ and not GLOBAL_HOOKS:
+            return await self.__scheduled_batch__(payloads, None)
+
+        event = self.__event_start__("batch")
+        try:
+            response = await self.__scheduled_batch__(payloads, event)
+        except Exception as e:
+            self.__event_end__(event, e)
+            raise
+
+        self.__event_end__(event, None)
+        return response
+
+    async def __scheduled_batch__(self, payloads, event):
+        if self.__scheduler__ is None:
+            return await self.__guarded__(lambda: self.__rpc__(payloads, event))
+
+        return await self.__scheduler__.arun(self.__batch_priority__(payloads),
+                                             lambda: self.__guarded__(lambda: self.__rpc__(payloads, event)))
+
+    async def __rpc__(self, payload, event = None):
+        url = "{}://{}:{}/rpc".format(self.__PROTOCOL__, self.__ip__, self.__port__)
+
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        timeout = aiohttp.ClientTimeout(total=self.__request_timeout__())
+        digest = self.__auth__.state
+
+        if event is not None:
+            event.bytes_out = len(data)
+
+        async with self.__limit__:
+            # the second attempt is only made after receiving a new challenge
+            for attempt in range(2):
+                headers = {"Content-Type": "application/json"}
+
+                authorization = digest.header("POST", "/rpc")
+                if authorization:
+                    headers["Authorization"] = authorization
+
+                async with self.__get_session__().post(url, data=data, headers=headers, timeout=timeout) as response:
+                    if response.status == 401 and not attempt:
+                        if digest.challenge(response.headers.get("WWW-Authenticate", "")):
+                            if event is not None:
+                                event.auth_retries += 1
+                            continue
+
+                    if authorization and not attempt and response.status != 401:
+                        # only headers sent before any challenge of this request avoided one
+                        digest.avoided += 1
+
+                    self.__check_status__(response.status)
+                    return await self.__read_json__(response, event)
+
+    async def components(self, include = ("status", "config"), keys = None):
+        """
+        @brief      async version of ShellyGen2.components
+
+        @return     async generator of component dicts
+        """
+        offset = 0
+        while offset is not None:
+            page = await self.post("Shelly.GetComponents", self.__components_request__(offset, include, keys))
+            for component in page.get("components", []):
+                yield component
+            offset = self.__next_offset__(page, offset)
+
+    async def snapshot(self, components = False):
+        if components:
+            return self.__assemble__([component async for component in self.components()])
+        return await self.full_status()
+
+    async def changes(self, components = False):
+        return self.__snapshot_of__(components).update(await self.snapshot(components))
+
+    def batch(self):
+        """
+        @brief      async version of ShellyGen2.batch, use with async with
+
+        @return     AsyncShellyGen2Batch
+        """
+        return AsyncShellyGen2Batch(self)
+
+
+ASYNC_CLASSES = {
+    ShellyGen1: AsyncShellyGen1,
+    ShellyGen2: AsyncShellyGen2,
+}
+
+
+class AsyncShellyGen2Batch(ShellyGen2Batch):
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *args):
+        if exc_type is None:
+            await self.send()
+
+    async def send(self):
+        """
+        @brief      send every queued call
+
+        @return     list of BatchCall
+        """
+        pending = self.__prepare__()
+        if not pending:
+            return self.calls
+
+        if self.device.__batching__ is not False:
+            try:
+                response_data = await self.device.__batch_rpc__([call.payload for call in pending])
+            except BadLogin as e:
+                for call in pending:
+                    call.__resolve__(error=e)
+                return self.calls
+            except (NotFound, BadResponse):
+                response_data = None
+
+            self.device.__batching__ = self.__dispatch__(pending, response_data)
+
+        if not self.device.__batching__:
+            for call in pending:
+                try:
+                    call.__resolve__(result=await self.device.post(call.method, call.values))
+                except (BadLogin, NotFound, BadResponse) as e:
+                    call.__resolve__(error=e)
+
+        return self.calls
+
+
+async def detect(ip, port = "80", session = None, timeout = 5, cache = default_cache):
+    """
+    @brief      /shelly response of a device, probing it without blocking if it is not cached
+
+    @param      ip          the target IP of the shelly device
+    @param      port        target port
+    @param      session     aiohttp.ClientSession to use, a temporary one is created otherwise
+    @param      timeout     specify the amount of time until the request is aborted
+    @param      cache       DetectionCache to use, None to always probe
+
+    @return     /shelly response as a dict
+    """
+    if cache is not None:
+        info = cache.get(ip, port)
+        if info is not None:
+            return info
+
+    url = "{}://{}:{}/shelly".format("http", ip, port)
+
+    owned = session is None
+    if owned:
+        session = aiohttp.ClientSession()
+
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            ShellyGen1.__check_status__(response.status)
+
+            info = decode(await response.read())
+    finally:
+        if owned:
+            await session.close()
+
+    if cache is not None:
+        cache.put(ip, port, info)
+
+    return info
+
+
+async def AsyncShelly(ip, port = "80", *args, **kwargs):
+    """
+    @brief      async counterpart of the Shelly wrapper
+
+    takes the same arguments as Shelly, the generation probe is done without blocking
+
+    @return     AsyncShellyGen1 or AsyncShellyGen2 instance
+    """
+    gen = kwargs.get("gen", None)
+    if gen is None:
+        kwargs["info"] = await detect(ip, port,
+                                      session=kwargs.get("session", None),
+                                      timeout=kwargs.get("timeout", 5),
+                                      cache=kwargs.get("detect_cache", default_cache))
+        gen = kwargs["info"]
+
+    cls = ASYNC_CLASSES[device_class(gen)]
+
+    device = cls(ip, port, *args, **kwargs)
+
+    if kwargs.get("init") and device.__needs_update__():
+        await device.update()
+
+    return device
+
+
+class AsyncShellyFleet:
+    """
+    async counterpart of ShellyFleet
+    """
+
+    def __init__(self, hosts, **kwargs):
+        """
+        @param      hosts       iterable of IPs, (IP, port) tuples or already created async device objects
+        @param      workers     maximum amount of devices addressed at the same time
+        @param      max_inflight    see ShellyFleet
+
+        every other argument is passed on to AsyncShelly when a device is first used
+        """
+
+        self.__workers__ = Semaphore(kwargs.pop("workers", 64))
+        self.__kwargs__ = kwargs
+
+        max_inflight = kwargs.pop("max_inflight", None)
+        self.limit = FleetLimit(max_inflight) if max_inflight else None
+
+        self.devices = {}
+        for host in hosts:
+            if isinstance(host, (str, tuple)):
+                self.devices[host] = None
+            else:
+                _attach_limit(host, self.limit)
+                self.devices[(host.__ip__, host.__port__)] = host
+
+    def __len__(self):
+        return len(self.devices)
+
+    async def __device__(self, host):
+        device = self.devices.get(host)
+        if device is None:
+            kwargs = self.__kwargs__
+            if self.limit is not None:
+                kwargs = dict(kwargs, scheduler=RequestScheduler(limit=self.limit))
+
+            created = await AsyncShelly(*ShellyFleet.__address__(host), **kwargs)
+            device = self.devices.get(host) or created
+            self.devices[host] = device
+
+            if device is not created:
+                # another call created the device first, this one is not used
+                await created.close()
+
+        return device
+
+    async def __run__(self, host, func):
+        device = None
+        async with self.__workers__:
+            try:
+                device = await self.__device__(host)
+                return FleetResult(host, device, result=await func(device))
+            except Exception as e:
+                return FleetResult(host, device, error=e)
+
+    async def map(self, func, deadline = None, hosts = None):
+        """
+        @brief      call a coroutine function with every device concurrently
+
+        @param      func        coroutine function taking a device
+        @param      deadline    seconds until unfinished devices are cancelled
+        @param      hosts       only call it for these hosts
+
+        @return     async generator of FleetResult in the order they finish
+        """
+        tasks = {
+            ensure_future(self.__run__(host, func)): host
+            for host in (self.devices if hosts is None else hosts)
+        }
+        end = None if deadline is None else get_running_loop().time() + deadline
+
+        pending = set(tasks)
+        try:
+            while pending:
+                timeout = None if end is None else max(end - get_running_loop().time(), 0)
+                done, pending = await wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    for task in pending:
+                        task.cancel()
+                        yield FleetResult(tasks[task], self.devices.get(tasks[task]), error=TimeoutError("deadline exceeded"))
+                    return
+
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def call(self, name, *args, **kwargs):
+        """
+        @brief      call a device method on every device
+
+        @param      name        method name, e.g. "status"
+        @param      deadline    seconds until unfinished devices are cancelled
+
+        @return     async generator of FleetResult in the order they finish
+        """
+        deadline = kwargs.pop("deadline", None)
+        return self.map(lambda device: getattr(device, name)(*args, **kwargs), deadline)
+
+    def post(self, page, values = None, deadline = None):
+        return self.call("post", page, values, deadline=deadline)
+
+    def status(self, deadline = None):
+        return self.call("status", deadline=deadline)
+
+    def relay(self, index, *args, **kwargs):
+        return self.call("relay", index, *args, **kwargs)
+
+    def prepare(self, *args, **kwargs):
+        """see ShellyFleet.prepare"""
+        return CommandSet(*args, **kwargs)
+
+    def send(self, command, deadline = None, hosts = None):
+        """
+        @brief      async version of ShellyFleet.send
+
+        @return     async generator of FleetResult in the order they finish
+        """
+        return self.map(lambda device: device.send(command), deadline, hosts)
+
+    async def apply_config(self, desired, **kwargs):
+        """
+        @brief      async version of ShellyFleet.apply_config
+        """
+        summary = RolloutSummary(kwargs.get("max_failures", 0))
+        apply = applier(desired, kwargs.get("dry_run", False))
+        planned = stages(list(self.devices), kwargs.get("canary", 1), kwargs.get("batch", None))
+
+        for index, hosts in enumerate(planned):
+            if summary.halted:
+                summary.skipped = [host for stage in planned[index:] for host in stage]
+                break
+
+            summary.stages += 1
+            async for result in self.map(apply, kwargs.get("deadline", None), hosts):
+                summary.add(result)
+
+        return summary
+
+    async def close(self):
+        for device in self.devices.values():
+            if device is not None:
+                await device.close()
@@ -0,0 +1,217 @@
+import hashlib
+import os
+from threading import Lock
+
+HASHES = {
+    "MD5": hashlib.md5,
+    "SHA-256": hashlib.sha256,
+}
+
+
+class DigestState:
+    """
+    digest challenge of a single device, reused for as long as the device accepts it
+    """
+
+    def __init__(self, username, password):
+        """
+        @param      username    username to authenticate as, Gen2 devices only accept "admin"
+        @param      password    password of the device
+        """
+
+        self.username = username
+        self.password = password
+
+        self.realm = None
+        self.nonce = None
+        self.opaque = None
+        self.algorithm = "MD5"
+        self.qop = None
+        self.nonce_count = 0
+
+        # amount of challenges the device had to send
+        self.challenges = 0
+        # amount of requests that were accepted with a cached nonce
+        self.avoided = 0
+
+        self.__lock__ = Lock()
+
+    def __digest__(self, data):
+        return HASHES.get(self.algorithm.upper(), hashlib.md5)(data.encode("utf-8")).hexdigest()
+
+    def challenge(self, header):
+        """
+        @brief      take over a new challenge from a WWW-Authenticate header
+
+        @param      header  value of the WWW-Authenticate header
+
+        @return     True if the header contained a digest challenge
+        """
+        scheme, _, params = header.partition(" ")
+        if scheme.lower() != "digest":
+            return False
+
+        # only needed once a device sends a challenge
+        from requests.utils import parse_dict_header
+        self.take(parse_dict_header(params))
+        return True
+
+    def take(self, params):
+        """
+        @brief      take over a new challenge
+
+        @param      params  dict of challenge parameters (realm, nonce, ...)
+        """
+        with self.__lock__:
+            self.realm = params.get("realm")
+            self.nonce = params.get("nonce")
+            self.opaque = params.get("opaque")
+            self.algorithm = params.get("algorithm", "MD5")
+            self.qop = params.get("qop")
+            self.nonce_count = 0
+            self.challenges += 1
+
+    def response(self, method, uri):
+        """
+        @brief      compute the digest response for the cached challenge
+
+        @param      method  request method
+        @param      uri     request uri
+
+        @return     dict of digest fields or None if there is no challenge yet
+        """
+        with self.__lock__:
+            if self.nonce is None:
+                return None
+
+            self.nonce_count += 1
+            nonce = self.nonce
+            nonce_count = "{:08x}".format(self.nonce_count)
+
+        cnonce = os.urandom(8).hex()
+
+        ha1 = self.__digest__("{}:{}:{}".format(self.username, self.realm, self.password))
+        ha2 = self.__digest__("{}:{}".format(method, uri))
+
+        fields = {
+            "username": self.username,
+            "realm": self.realm,
+            "nonce": nonce,
+            "uri": uri,
+            "algorithm": self.algorithm,
+        }
+
+        if self.qop:
+            fields["qop"] = "auth"
+            fields["nc"] = nonce_count
+            fields["cnonce"] = cnonce
+            fields["response"] = self.__digest__("{}:{}:{}:{}:auth:{}".format(ha1, nonce, nonce_count, cnonce, ha2))
+        else:
+            fields["response"] = self.__digest__("{}:{}:{}".format(ha1, nonce, ha2))
+
+        if self.opaque:
+            fields["opaque"] = self.opaque
+
+        return fields
+
+    def header(self, method, uri):
+        """
+        @brief      build an Authorization header for the cached challenge
+
+        @return     header value or None if there is no challenge yet
+        """
+        fields = self.response(method, uri)
+        if fields is None:
+            return None
+
+        unquoted = ("algorithm", "qop", "nc")
+        return "Digest " + ", ".join(
+            "{}={}".format(key, value) if key in unquoted else '{}="{}"'.format(key, value)
+            for key, value in fields.items()
+        )
+
+    def rpc_auth(self):
+        """
+        @brief      build the auth object for JSON-RPC frames
+
+        frames sent over a WebSocket carry their credentials in the "auth" member,
+        Shelly computes these with a fixed nonce count and a dummy method and uri
+
+        @return     dict or None if there is no challenge yet
+        """
+        with self.__lock__:
+            if self.nonce is None:
+                return None
+            nonce = self.nonce
+
+        cnonce = int.from_bytes(os.urandom(4), "big")
+
+        ha1 = self.__digest__("{}:{}:{}".format(self.username, self.realm, self.password))
+        ha2 = self.__digest__("dummy_method:dummy_uri")
+
+        return {
+            "realm": self.realm,
+            "username": self.username,
+            "nonce": nonce,
+            "cnonce": cnonce,
+            "response": self.__digest__("{}:{}:1:{}:auth:{}".format(ha1, nonce, cnonce, ha2)),
+            "algorithm": self.algorithm,
+        }
+
+    def stats(self):
+        """
+        @brief      counters of the challenge cache
+
+        @return     dict with the amount of challenges received and avoided
+        """
+        return {
+            "challenges": self.challenges,
+            "avoided": self.avoided,
+        }
+
+
+class ShellyDigestAuth:
+    """
+    requests digest authentication that sends the cached challenge preemptively
+
+    only when the device rejects the nonce a new challenge is requested
+    """
+
+    def __init__(self, username, password):
+        self.state = DigestState(username, password)
+
+    def __call__(self, request):
+        header = self.state.header(request.method, request.path_url)
+        if header:
+            request.headers["Authorization"] = header
+
+        request.register_hook("response", self.__handle_response__(header is not None))
+        return request
+
+    def __handle_response__(self, preemptive):
+        def hook(response, **kwargs):
+            if response.status_code != 401:
+                if preemptive:
+                    self.state.avoided += 1
+                return response
+
+            if not self.state.challenge(response.headers.get("www-authenticate", "")):
+                return response
+
+            # drain the body so the connection can be reused
+            response.content
+            response.close()
+
+            request = response.request.copy()
+            request.deregister_hook("response", hook)
+            request.headers["Authorization"] = self.state.header(request.method, request.path_url)
+
+            retry = response.connection.send(request, **kwargs)
+            retry.history.append(response)
+            retry.request = request
+            return retry
+
+        return hook
+
+    def stats(self):
+        return self.state.stats()
@@ -5,8 +5,36 @@ if version_info.major == 3:
 else:
     JSONDecodeError = ValueError
 
+from time import perf_counter
+
+from .cache import ShellyCache
+from .coalesce import CommandCoalescer
+from .codec import decode, get_decoder
+from .command import Command
+from .config import patch
+from .error import BadLogin, NotFound
+from .health import DeviceHealth
+from .scheduler import CONTROL, STATUS, RequestScheduler
+from .metrics import GLOBAL_HOOKS, RequestEvent
+from .transport import ShellySession
+
+# credentials of devices without login, shared instead of a tuple per device
+_NO_CREDENTIALS = ("", "")
+
+# commands prepare() validates like the methods of the same name
+PREPARED = ("relay", "roller", "light", "settings")
+
+
 class ShellyBase:
 
+    # no per device __dict__, large fleets keep thousands of these around
+    __slots__ = (
+        "__name__", "__type__", "__generation__", "__mac__", "__debugging__", "__PROTOCOL__",
+        "__ip__", "__port__", "__timeout__", "__credentials__", "__session__", "__cache__",
+        "__decoder__", "__health__", "__scheduler__", "__coalescer__", "__hooks__", "info",
+        "__weakref__",
+    )
+
     def __init__(self, ip, port = "80", *args, **kwargs):
         """
         @param      ip      the target IP of the shelly device. Can be a string, list of strings or list of integers
@@ -15,11 +43,22 @@ class ShellyBase:
         @param      timeout specify the amount of time until requests are aborted.
         @param      debug   enable debug printing
         @param      init    calls the update method on init
+        @param      session     ShellySession to share between devices, one is created per device otherwise
+        @param      pool_size   maximum number of kept-alive connections to the device
+        @param      pool_idle   drop kept-alive connections after being idle for this many seconds
+        @param      retries     amount of retries for requests that could not connect
+        @param      cache       True, a dict of time to live per page or a ShellyCache to cache read responses
+        @param      info    /shelly response of the device if it is already known
+        @param      health  True, a dict of DeviceHealth parameters or a DeviceHealth for adaptive timeouts and a circuit breaker
+        @param      decoder "json", "orjson", "ujson" or a function decoding response bytes, see codec.set_decoder for all devices
+        @param      coalesce    seconds commands to the same channel are merged for, relay, roller and light then return a future
+        @param      scheduler   True, the maximum amount of requests in flight or a RequestScheduler to queue requests by priority
         """
 
         self.__name__ = "Unknown"
         self.__type__ = "Unknown"
         self.__generation__ = 0
+        self.__mac__ = None
 
         self.__debugging__ = kwargs.get("debug", None)
 
@@ -35,19 +74,95 @@ class ShellyBase:
 
         self.__timeout__ = kwargs.get("timeout", 5)
 
-        self.__credentials__ = (
-            login.get("username", ""), login.get("password", "")
-        )
+        self.__credentials__ = _NO_CREDENTIALS
+        if login:
+            self.__credentials__ = (
+                login.get("username", ""), login.get("password", "")
+            )
+
+        self.__session__ = kwargs.get("session", None)
+        if self.__session__ is None:
+            self.__session__ = self.__new_session__(kwargs)
+
+        self.__cache__ = kwargs.get("cache", None)
+        if self.__cache__ is True:
+            self.__cache__ = ShellyCache()
+        elif isinstance(self.__cache__, dict):
+            self.__cache__ = ShellyCache(ttl=self.__cache__)
+        elif self.__cache__ is False:
+            self.__cache__ = None
 
-        if kwargs.get("init"):
+        self.__decoder__ = kwargs.get("decoder", None)
+        if isinstance(self.__decoder__, str):
+            self.__decoder__ = get_decoder(self.__decoder__)
+
+        self.__health__ = kwargs.get("health", None)
+        if self.__health__ is True:
+            self.__health__ = DeviceHealth(max_timeout=self.__timeout__)
+        elif isinstance(self.__health__, dict):
+            self.__health__ = DeviceHealth(**dict({"max_timeout": self.__timeout__}, **self.__health__))
+        elif self.__health__ is False:
+            self.__health__ = None
+
+        self.__scheduler__ = kwargs.get("scheduler", None)
+        if self.__scheduler__ is True:
+            self.__scheduler__ = RequestScheduler()
+        elif self.__scheduler__ is False:
+            self.__scheduler__ = None
+        elif isinstance(self.__scheduler__, int):
+            self.__scheduler__ = RequestScheduler(max_inflight=self.__scheduler__)
+
+        self.__coalescer__ = None
+        if kwargs.get("coalesce"):
+            self.__coalescer__ = self.__new_coalescer__(kwargs["coalesce"])
+
+        # tuple of (before, after) request hooks of this device, shared while empty
+        self.__hooks__ = ()
+
+        # /shelly response, seeds the device information without a request
+        self.info = kwargs.get("info", None)
+        if self.info:
+            self.__parse_info__(self.info)
+
+        if kwargs.get("init") and self.__needs_update__():
             self.update()
 
+    @property
+    def _instance(self):
+        """the device itself, Shelly used to be a proxy around it"""
+        return self
+
     def __repr__(self):
         return "<{} {} Gen {} ({})>".format(self.__name__, self.__type__, self.__generation__, self.__ip__)
 
     def __str__(self):
         return str(self.__name__)
 
+    def __new_session__(self, kwargs):
+        """create the session used when none is shared with the device"""
+        return ShellySession(
+            pool_size=kwargs.get("pool_size", 2),
+            pool_hosts=1,
+            idle_timeout=kwargs.get("pool_idle", 30),
+            retries=kwargs.get("retries", 0)
+        )
+
+    def __new_coalescer__(self, window):
+        """create the coalescer used for commands when coalescing is enabled"""
+        return CommandCoalescer(self, window)
+
+    @staticmethod
+    def __check_status__(status_code):
+        """raise the matching exception for a HTTP error status"""
+        if status_code == 401:
+            raise BadLogin()
+        elif status_code == 404:
+            raise NotFound("Not Found")
+
+    def __decode__(self, content):
+        """decode a response body, raising BadResponse if it is not JSON"""
+        return decode(content, self.__decoder__)
+
     @staticmethod
     def __clamp__(val):
         """clamp any number to 8 bit"""
@@ -80,10 +195,349 @@ class ShellyBase:
             val = 3000
         return val
 
+    def close(self):
+        """
+        @brief      send queued commands and close the connections kept alive to the device
+        """
+        if self.__coalescer__ is not None:
+            self.__coalescer__.flush()
+        self.__session__.close()
+
+    def __parse_info__(self, info):
+        """take over device information from a /shelly response"""
+        pass
+
     def update(self):
         raise NotImplementedError("Base Class")
 
+    def __needs_update__(self):
+        """whether init has to call update, explicit calls of update always ask the device"""
+        return True
+
     def post(self, page, values = None):
+        """
+        @brief      send a request to the device
+
+        @param      page    page or RPC method to be accesed. Use the Shelly HTTP API Reference to see whats possible
+        @param      values  dict of parameters
+
+        @return     returns json response
+        """
+        if not self.__hooks__ and not GLOBAL_HOOKS:
+            return self.__cached_send__(page, values, None)
+
+        event = self.__event_start__(page)
+        try:
+            response = self.__cached_send__(page, values, event)
+        except Exception as e:
+            self.__event_end__(event, e)
+            raise
+
+        self.__event_end__(event, None)
+        return response
+
+    def __cached_send__(self, page, values, event):
+        if self.__cache__ is None:
+            return self.__scheduled_send__(page, values, event)
+
+        found, response = self.__cache_get__(page, values)
+        if found:
+            if event is not None:
+                event.cached = True
+            return response
+
+        response = self.__scheduled_send__(page, values, event)
+        self.__cache_put__(page, values, response)
+        return response
+
+    def __scheduled_send__(self, page, values, event):
+        """send a request once the scheduler grants it a slot"""
+        scheduler = self.__scheduler__
+        if scheduler is None:
+            return self.__guarded_send__(page, values, event)
+
+        key = None
+        if self.__is_read__(page, values):
+            key = scheduler.key(page, values)
+
+        return scheduler.run(self.__priority__(page, values),
+                             lambda: self.__guarded_send__(page, values, event),
+                             key)
+
+    def __priority__(self, page, values):
+        """priority class of a request, commands go before status polls and those before settings"""
+        if not self.__is_read__(page, values):
+            return CONTROL
+        return STATUS
+
+    def __guarded_send__(self, page, values, event):
+        """send a request through the circuit breaker"""
+        if self.__health__ is None:
+            return self.__send__(page, values, event)
+
+        return self.__guarded__(lambda: self.__send__(page, values, event))
+
+    def __guarded__(self, send):
+        """call a function sending a request through the circuit breaker"""
+        health = self.__health__
+        if health is None:
+            return send()
+
+        health.acquire()
+        start = perf_counter()
+        try:
+            response = send()
+        except Exception as e:
+            health.record(perf_counter() - start, e)
+            raise
+        except BaseException:
+            health.release()
+            raise
+
+        health.success(perf_counter() - start)
+        return response
+
+    def __send__(self, page, values = None, event = None):
+        """send a request, filling in the transport details of event if given"""
+        raise NotImplementedError("Base Class")
+
+    def __request_timeout__(self):
+        """timeout of the next request, adapted to the device if its health is tracked"""
+        if self.__health__ is None:
+            return self.__timeout__
+        return self.__health__.timeout()
+
+    def health(self):
+        """
+        @brief      round trip time and circuit breaker state
+
+        @return     dict of state, timeout, round trip time and counters or None if health is not tracked
+        """
+        if self.__health__ is None:
+            return None
+        return self.__health__.stats()
+
+    def available(self):
+        """
+        @brief      whether requests are sent to the device right now, False while its circuit is open
+        """
+        return self.__health__ is None or self.__health__.available()
+
+    def __command__(self, page, values):
+        """send a command, through the coalescer if coalescing is enabled"""
+        if self.__coalescer__ is None or self.__is_read__(page, values):
+            return self.post(page, values)
+
+        return self.__coalescer__.submit(self.__channel__(page, values), page, values)
+
+    def prepare(self, *args, **kwargs):
+        """
+        @brief      build a request once to send it any number of times
+
+        relay, roller, light and settings are validated and clamped like
+        the methods of the same name, keywords of settings are the values to set,
+        anything else is a page or RPC method sent with a dict of values
+        given as second argument or as keywords
+
+        @param      name    "relay", "roller", "light", "settings" or a page or RPC method,
+                            only taken positionally so name= stays free for settings
+
+        @return     Command for devices of the generation of this one
+        """
+        if not args:
+            raise TypeError("prepare() missing the name of the command")
+
+        name, args = args[0], args[1:]
+
+        builder = getattr(self, "__{}_request__".format(name), None) if name in PREPARED else None
+        if builder is not None:
+            page, values = builder(*args, **kwargs)
+        else:
+            page, values = name, (args[0] if args else kwargs)
+
+        return Command(self.__generation__, page, values)
+
+    def send(self, command):
+        """
+        @brief      send a prepared command, see prepare
+
+        @param      command Command or CommandSet
+
+        @return     returns json response
+        """
+        if not isinstance(command, Command):
+            command = command.of(self)
+
+        if command.generation != self.__generation__:
+            raise ValueError("command is for Gen {} devices".format(command.generation))
+
+        return self.__command__(command.page, command)
+
+    def __channel__(self, page, values):
+        """key of the channel a command is for, commands are only merged within a channel"""
+        return page
+
+    def __coalesce__(self, page, values, later_page, later_values):
+        """
+        merge a command into an earlier one of the same channel
+
+        the same page or method merges its parameters, later ones win,
+        anything else replaces the earlier command
+
+        @return     tuple of the page and values to send
+        """
+        if page != later_page:
+            return later_page, later_values
+
+        merged = dict(values or {})
+        merged.update(later_values or {})
+        return page, merged
+
+    def flush(self):
+        """
+        @brief      send commands waiting to be merged right away and wait for them
+        """
+        if self.__coalescer__ is not None:
+            self.__coalescer__.flush()
+
+    def add_hook(self, before = None, after = None):
+        """
+        @brief      register hooks for the requests of this device
+
+        @param      before  called with the RequestEvent before a request is sent
+        @param      after   called with the completed RequestEvent
+
+        @return     handle for remove_hook
+        """
+        hook = (before, after)
+        self.__hooks__ += (hook,)
+        return hook
+
+    def remove_hook(self, hook):
+        hooks = list(self.__hooks__)
+        hooks.remove(hook)
+        self.__hooks__ = tuple(hooks)
+
+    def __event_start__(self, page):
+        event = RequestEvent(self.__ip__, self.__generation__, page)
+
+        for before, _ in (*GLOBAL_HOOKS, *self.__hooks__):
+            if before is not None:
+                before(event)
+
+        return event
+
+    def __event_end__(self, event, error):
+        event.duration = perf_counter() - event.start
+        if error is not None:
+            event.error = type(error).__name__
+
+        for _, after in (*GLOBAL_HOOKS, *self.__hooks__):
+            if after is not None:
+                after(event)
+
+    def __cache_get__(self, page, values):
+        if self.__cache__ is None or not self.__is_read__(page, values):
+            return False, None
+
+        return self.__cache__.get(page, values)
+
+    def __cache_put__(self, page, values, response):
+        if self.__cache__ is None:
+            return
+
+        if self.__is_read__(page, values):
+            self.__cache__.put(page, values, response)
+        else:
+            self.__invalidate__(page, values, response)
+
+    def __is_read__(self, page, values):
+        """whether a request only reads from the device and may be cached"""
+        return False
+
+    def __invalidate__(self, page, values, response):
+        """update or evict cached responses affected by a write"""
+        self.__cache__.clear()
+
+    def scheduler_stats(self):
+        """
+        @brief      counters of the request scheduler
+
+        @return     dict of sent, deduplicated, waiting and queued requests or None if requests are not scheduled
+        """
+        if self.__scheduler__ is None:
+            return None
+        return self.__scheduler__.stats()
+
+    def cache_stats(self):
+        """
+        @brief      counters of the response cache
+
+        @return     dict of hits, misses, stale entries, evictions and size or None if caching is disabled
+        """
+        if self.__cache__ is None:
+            return None
+        return self.__cache__.stats()
+
+    def __fresh__(self, page, values = None):
+        """read a page past the cache, so decisions are made on the current state"""
+        if self.__cache__ is not None:
+            self.__cache__.evict(lambda cached, _: cached == page)
+        return self.post(page, values)
+
+    def config_plan(self, desired):
+        """
+        @brief      work out which settings differ from the desired ones
+
+        the whole configuration is fetched once, targets it does not
+        contain are fetched on their own
+
+        @param      desired dict of settings page (Gen1, "" for /settings) or component key (Gen2, e.g. "switch:0")
+                            to a dict of desired values, only the given values are compared
+
+        @return     dict of the same form with only the values that have to be sent
+        """
+        current = self.__fresh__(*self.__config_source__(None))
+
+        plan = {}
+        for target, values in desired.items():
+            config = self.__config_of__(current, target)
+            if config is None:
+                config = self.__fresh__(*self.__config_source__(target))
+
+            changed = patch(config, values)
+            if changed:
+                plan[target] = changed
+
+        return plan
+
+    def apply_config(self, desired, dry_run = False):
+        """
+        @brief      send the settings that differ from the desired ones
+
+        @param      desired see config_plan
+        @param      dry_run only work out what would be sent
+
+        @return     dict of what was sent, empty if the device already matched
+        """
+        plan = self.config_plan(desired)
+
+        if not dry_run:
+            for target, values in plan.items():
+                self.post(*self.__config_request__(target, values))
+
+        return plan
+
+    def __config_source__(self, target):
+        """page and values reading the settings of a target, the whole configuration for None"""
+        raise NotImplementedError("Base Class")
+
+    def __config_of__(self, current, target):
+        """settings of a target within the whole configuration, None if they are not part of it"""
+        raise NotImplementedError("Base Class")
+
+    def __config_request__(self, target, values):
+        """page and values writing settings of a target"""
         raise NotImplementedError("Base Class")
 
     def status(self):
@@ -0,0 +1,156 @@
+import json
+from threading import Lock
+from time import monotonic
+
+# configuration barely changes, live readings do
+DEFAULT_TTL = {
+    "shelly": 300,
+    "settings": 300,
+    "Sys.GetConfig": 300,
+    "Shelly.GetConfig": 300,
+    "Shelly.GetDeviceInfo": 300,
+}
+
+
+class ShellyCache:
+    """
+    response cache of a single device, keyed by page and parameters
+    """
+
+    def __init__(self, ttl = None, default = 0.5):
+        """
+        @param      ttl         dict of page or RPC method to time to live in seconds,
+                                "meter" matches every "meter/<index>" and "Switch" every "Switch.*" method
+        @param      default     time to live of every other page
+        """
+
+        self.ttl = dict(DEFAULT_TTL)
+        self.ttl.update(ttl or {})
+        self.default = default
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+        self.__entries__ = {}
+        self.__lock__ = Lock()
+
+    def __len__(self):
+        return len(self.__entries__)
+
+    @staticmethod
+    def __key__(page, values):
+        if not values:
+            return page, None
+        return page, json.dumps(values, sort_keys=True)
+
+    def ttl_for(self, page):
+        """
+        @brief      time to live of a page
+
+        @param      page    page or RPC method
+
+        @return     seconds
+        """
+        ttl = self.ttl.get(page)
+        if ttl is None:
+            ttl = self.ttl.get(page.split("/", 1)[0].split(".", 1)[0], self.default)
+        return ttl
+
+    def get(self, page, values = None):
+        """
+        @brief      look up a cached response
+
+        @return     tuple of (found, response)
+        """
+        key = self.__key__(page, values)
+
+        with self.__lock__:
+            entry = self.__entries__.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            if entry[0] < monotonic():
+                del self.__entries__[key]
+                self.stale += 1
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, page, values, response):
+        """
+        @brief      store a response, pages with a time to live of 0 are not stored
+        """
+        ttl = self.ttl_for(page)
+        if ttl <= 0:
+            return
+
+        with self.__lock__:
+            self.__entries__[self.__key__(page, values)] = (monotonic() + ttl, response)
+
+    def refresh(self, page, values, update, ttl = None):
+        """
+        @brief      replace a cached response that is still valid with an updated one
+
+        @param      update  function taking the cached response and returning the new one
+        @param      ttl     seconds the entry stays valid from now, it never expires earlier than before
+
+        @return     whether the entry was cached
+        """
+        key = self.__key__(page, values)
+        now = monotonic()
+
+        with self.__lock__:
+            entry = self.__entries__.get(key)
+            if entry is None or entry[0] < now:
+                return False
+
+            expires = entry[0] if ttl is None else max(entry[0], now + ttl)
+            self.__entries__[key] = (expires, update(entry[1]))
+
+        return True
+
+    def evict(self, match):
+        """
+        @brief      drop every entry whose page and parameters match
+
+        @param      match   function taking the page and the parameters as a dict
+
+        @return     amount of dropped entries
+        """
+        with self.__lock__:
+            keys = [
+                key for key in self.__entries__
+                if match(key[0], json.loads(key[1]) if key[1] else {})
+            ]
+
+            for key in keys:
+                del self.__entries__[key]
+
+            self.evictions += len(keys)
+
+        return len(keys)
+
+    def clear(self):
+        with self.__lock__:
+            self.evictions += len(self.__entries__)
+            self.__entries__.clear()
+
+    def stats(self):
+        """
+        @brief      cache counters
+
+        @return     dict of hits, misses, stale entries, evictions and the current size
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "size": len(self.__entries__),
+        }
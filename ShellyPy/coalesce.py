@@ -0,0 +1,119 @@
+from concurrent.futures import Future
+from threading import Condition, Thread
+from time import monotonic
+
+
+class CommandCoalescer:
+    """
+    merges commands for the same channel that arrive within a window
+
+    commands are sent one after another by a single thread, a command
+    waiting for the device to finish the previous one keeps merging later calls
+    """
+
+    def __init__(self, device, window):
+        """
+        @param      device  device the commands are sent to
+        @param      window  seconds a command waits for later calls to merge with
+        """
+        self.device = device
+        self.window = window
+
+        # commands that were merged into others instead of being sent
+        self.merged = 0
+        self.sent = 0
+
+        # channel to [page, values, futures, due]
+        self.__pending__ = {}
+        self.__busy__ = False
+        self.__thread__ = None
+        self.__condition__ = Condition()
+
+    def submit(self, channel, page, values):
+        """
+        @brief      queue a command
+
+        @param      channel key of the channel, commands of the same channel are merged
+
+        @return     Future of the response to the merged command
+        """
+        future = Future()
+
+        with self.__condition__:
+            entry = self.__pending__.get(channel)
+            if entry is None:
+                self.__pending__[channel] = [page, values, [future], monotonic() + self.window]
+            else:
+                entry[0], entry[1] = self.device.__coalesce__(entry[0], entry[1], page, values)
+                entry[2].append(future)
+                self.merged += 1
+
+            if self.__thread__ is None:
+                self.__thread__ = Thread(target=self.__run__, name="CommandCoalescer", daemon=True)
+                self.__thread__.start()
+
+            self.__condition__.notify()
+
+        return future
+
+    def __due__(self):
+        """wait for the next due command, None once nothing is left"""
+        with self.__condition__:
+            while True:
+                if not self.__pending__:
+                    self.__thread__ = None
+                    return None
+
+                now = monotonic()
+                channel, entry = min(self.__pending__.items(), key=lambda item: item[1][3])
+
+                if entry[3] <= now:
+                    del self.__pending__[channel]
+                    self.__busy__ = True
+                    return entry
+
+                self.__condition__.wait(entry[3] - now)
+
+    def __run__(self):
+        while True:
+            entry = self.__due__()
+            if entry is None:
+                return
+
+            page, values, futures, _ = entry
+
+            try:
+                response = self.device.post(page, values)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(response)
+
+            with self.__condition__:
+                self.sent += 1
+                self.__busy__ = False
+                self.__condition__.notify_all()
+
+    def flush(self):
+        """
+        @brief      send every queued command right away and wait until they are done
+        """
+        with self.__condition__:
+            for entry in self.__pending__.values():
+                entry[3] = 0
+            self.__condition__.notify_all()
+
+            while self.__pending__ or self.__busy__:
+                self.__condition__.wait()
+
+    def stats(self):
+        """
+        @return     dict of sent and merged commands and the amount still queued
+        """
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "pending": len(self.__pending__),
+        }
@@ -0,0 +1,112 @@
+"""
+JSON decoding of device responses
+
+Shelly devices always answer in UTF-8, so the body is decoded as such
+instead of letting requests guess the encoding first
+"""
+import json
+from importlib import import_module
+
+from .error import BadResponse
+
+# faster decoders, imported on first use so importing ShellyPy does not pay for them
+OPTIONAL = ("orjson", "ujson")
+
+
+def stdlib_loads(content):
+    """decode bytes or text with the json module"""
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        content = bytes(content).decode("utf-8")
+    return json.loads(content)
+
+
+# decoders imported so far
+DECODERS = {"json": stdlib_loads}
+
+
+def get_decoder(name):
+    """
+    @brief      function of a decoder, its module is imported on first use
+
+    @param      name    "json", "orjson" or "ujson"
+
+    @return     function decoding bytes
+    """
+    loads = DECODERS.get(name)
+    if loads is None and name in OPTIONAL:
+        try:
+            loads = DECODERS[name] = import_module(name).loads
+        except ImportError:
+            pass
+
+    if loads is None:
+        raise ValueError("Decoder {} is not available".format(name))
+    return loads
+
+
+def available():
+    """
+    @return     names of the installed decoders, importing every one of them
+    """
+    names = []
+    for name in ("json",) + OPTIONAL:
+        try:
+            get_decoder(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+def __fastest__():
+    for name in OPTIONAL:
+        try:
+            return name, get_decoder(name)
+        except ValueError:
+            pass
+    return "json", stdlib_loads
+
+
+# decoder used by every device that was not given one of its own,
+# picked on the first decode unless set_decoder is called before
+decoder_name = None
+loads = None
+
+
+def set_decoder(decoder):
+    """
+    @brief      replace the decoder used for every device
+
+    @param      decoder     "json", "orjson", "ujson" or a function taking bytes
+    """
+    global decoder_name, loads
+
+    if callable(decoder):
+        decoder_name = getattr(decoder, "__name__", "custom")
+        loads = decoder
+    else:
+        loads = get_decoder(decoder)
+        decoder_name = decoder
+
+
+def decode(content, decoder = None):
+    """
+    @brief      decode a response body
+
+    @param      content     response body as bytes
+    @param      decoder     function to use instead of the global decoder
+
+    @return     decoded JSON
+    """
+    global decoder_name, loads
+
+    if decoder is None:
+        if loads is None:
+            decoder_name, loads = __fastest__()
+        decoder = loads
+
+    try:
+        return decoder(content)
+    except ValueError:
+        # JSON and unicode errors of every decoder derive from ValueError
+        raise BadResponse("Bad JSON")
@@ -0,0 +1,304 @@
+"""
+CoIoT status listener for Gen1 devices
+
+Gen1 devices multicast their state as CoAP packets whenever it changes
+and periodically otherwise, one listener serves every device of a network
+"""
+import json
+import socket
+import struct
+from threading import Thread
+
+from .listener import DeviceListener
+
+COIOT_GROUP = "224.0.1.187"
+COIOT_PORT = 5683
+
+# CoAP code 0.30, used by Shelly for status publications
+STATUS_CODE = 30
+
+OPTION_DEVICE = 3332
+OPTION_VALIDITY = 3412
+OPTION_SERIAL = 3420
+
+# sensor ids, the hundreds digit is the channel starting at 1
+RELAY_SENSOR = 1101
+POWER_SENSOR = 4101
+
+# used when a packet does not say how long it is valid for
+DEFAULT_VALIDITY = 30
+
+
+class CoIoTStatus:
+    """
+    a decoded status publication
+    """
+
+    def __init__(self, model, device_id, serial, validity, values, address = None):
+        self.model = model
+        self.device_id = device_id
+        self.serial = serial
+        # seconds until the next publication at the latest
+        self.validity = validity
+        # dict of sensor id to value
+        self.values = values
+        self.address = address
+
+        # device object the publication belongs to, set by the listener
+        self.device = None
+
+    def __repr__(self):
+        return "<CoIoTStatus {}#{} {}>".format(self.model, self.device_id, self.values)
+
+    def relays(self):
+        """
+        @return     dict of relay index to its state
+        """
+        return self.__channels__(RELAY_SENSOR, bool)
+
+    def powers(self):
+        """
+        @return     dict of meter index to its power in watts
+        """
+        return self.__channels__(POWER_SENSOR, float)
+
+    def __channels__(self, sensor, convert):
+        channels = {}
+        for index in range(16):
+            value = self.values.get(sensor + index * 100)
+            if value is not None:
+                channels[index] = convert(value)
+        return channels
+
+    def pages(self):
+        """
+        @brief      the publication as partial responses of the HTTP api
+
+        @return     dict of page to response dict
+        """
+        pages = {}
+        for index, ison in self.relays().items():
+            pages["relay/{}".format(index)] = {"ison": ison}
+        for index, power in self.powers().items():
+            pages["meter/{}".format(index)] = {"power": power}
+        return pages
+
+
+def _validity(value):
+    """the lowest bit selects between tenths of a second and units of 4 seconds"""
+    if value & 1:
+        return value * 4
+    return value / 10
+
+
+def decode(packet, address = None):
+    """
+    @brief      decode a CoIoT status packet
+
+    @param      packet  bytes of the UDP datagram
+    @param      address IP of the sender
+
+    @return     CoIoTStatus, None for packets that are not status publications
+    """
+    if len(packet) < 4 or packet[0] >> 6 != 1:
+        return None
+
+    token_length = packet[0] & 0x0F
+    if packet[1] != STATUS_CODE:
+        return None
+
+    options = {}
+    number = 0
+    offset = 4 + token_length
+
+    while offset < len(packet) and packet[offset] != 0xFF:
+        delta = packet[offset] >> 4
+        length = packet[offset] & 0x0F
+        offset += 1
+
+        # 13 and 14 announce an extended value in the following bytes
+        if delta == 13:
+            delta = packet[offset] + 13
+            offset += 1
+        elif delta == 14:
+            delta = struct.unpack_from("!H", packet, offset)[0] + 269
+            offset += 2
+
+        if length == 13:
+            length = packet[offset] + 13
+            offset += 1
+        elif length == 14:
+            length = struct.unpack_from("!H", packet, offset)[0] + 269
+            offset += 2
+
+        number += delta
+        options[number] = packet[offset:offset + length]
+        offset += length
+
+    device = options.get(OPTION_DEVICE)
+    if device is None or offset >= len(packet):
+        return None
+
+    model, device_id = (device.decode("utf-8", "replace").split("#") + [""])[:2]
+
+    validity = DEFAULT_VALIDITY
+    if OPTION_VALIDITY in options:
+        validity = _validity(int.from_bytes(options[OPTION_VALIDITY], "big"))
+
+    serial = int.from_bytes(options.get(OPTION_SERIAL, b""), "big") or None
+
+    try:
+        payload = json.loads(packet[offset + 1:])
+    except ValueError:
+        return None
+
+    if not isinstance(payload, dict) or not isinstance(payload.get("G", []), list):
+        return None
+
+    # entries are [channel, sensor id, value]
+    values = {}
+    for entry in payload.get("G", []):
+        if isinstance(entry, list) and len(entry) == 3 and isinstance(entry[1], int):
+            values[entry[1]] = entry[2]
+
+    return CoIoTStatus(model, device_id, serial, validity, values, address)
+
+
+class CoIoTListener(DeviceListener):
+    """
+    receives the status publications of every Gen1 device on the network
+
+    publications are matched to the added devices by their MAC or IP
+    """
+
+    def __init__(self, devices = None, interface = "0.0.0.0", port = COIOT_PORT, group = COIOT_GROUP, refresh_cache = False):
+        """
+        @param      devices         list of devices to match publications to
+        @param      interface       IP of the interface to listen on
+        @param      port            UDP port to listen on
+        @param      group           multicast group to join, None to only receive unicast
+        @param      refresh_cache   update the cached relay, meter and status responses of matched devices
+        """
+        self.interface = interface
+        self.port = port
+        self.group = group
+
+        self.packets = 0
+
+        self.__socket__ = None
+        self.__thread__ = None
+        self.__running__ = False
+
+        super().__init__(devices, refresh_cache)
+
+    def __lookup__(self, device_id):
+        device = self.__ids__.get(device_id)
+        if device is None and device_id:
+            # older firmware publishes only the end of the MAC
+            for known, candidate in self.__ids__.items():
+                if known.endswith(device_id):
+                    return candidate
+        return device
+
+    def feed(self, packet, address = None):
+        """
+        @brief      handle a packet as if it was received, used to replay captured packets
+
+        @param      packet  bytes of the UDP datagram
+        @param      address IP of the sender
+
+        @return     CoIoTStatus or None if the packet was dropped
+        """
+        self.packets += 1
+
+        try:
+            status = decode(packet, address)
+        except (IndexError, struct.error):
+            status = None
+
+        return self.__receive__(status)
+
+    @staticmethod
+    def __refresh__(status):
+        """merge a publication into the cached responses of its device"""
+        cache = status.device.__cache__
+        relays = status.relays()
+        powers = status.powers()
+
+        for page, partial in status.pages().items():
+            cache.refresh(page, None, lambda response: dict(response, **partial), status.validity)
+
+        def update(response):
+            response = dict(response)
+
+            if relays and "relays" in response:
+                response["relays"] = [
+                    dict(relay, ison=relays[index]) if index in relays else relay
+                    for index, relay in enumerate(response["relays"])
+                ]
+
+            if powers and "meters" in response:
+                response["meters"] = [
+                    dict(meter, power=powers[index]) if index in powers else meter
+                    for index, meter in enumerate(response["meters"])
+                ]
+
+            return response
+
+        cache.refresh("status", None, update, status.validity)
+
+    def __bind__(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        sock.bind(("", self.port))
+
+        if self.group:
+            membership = socket.inet_aton(self.group) + socket.inet_aton(self.interface)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+        # wake up regularly to notice stop()
+        sock.settimeout(0.5)
+        return sock
+
+    def start(self):
+        """
+        @brief      start listening in a background thread
+
+        @return     the listener itself
+        """
+        if self.__running__:
+            return self
+
+        self.__socket__ = self.__bind__()
+        # port 0 picks a free port
+        self.port = self.__socket__.getsockname()[1]
+
+        self.__running__ = True
+        self.__thread__ = Thread(target=self.__run__, name="CoIoTListener", daemon=True)
+        self.__thread__.start()
+        return self
+
+    def __run__(self):
+        while self.__running__:
+            try:
+                packet, (address, _) = self.__socket__.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            self.__dispatch__(packet, address)
+
+    def stop(self):
+        self.__running__ = False
+
+        if self.__thread__ is not None:
+            self.__thread__.join()
+            self.__thread__ = None
+
+        if self.__socket__ is not None:
+            self.__socket__.close()
+            self.__socket__ = None
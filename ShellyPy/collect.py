@@ -0,0 +1,420 @@
+"""
+meter collector spreading many devices over worker processes
+
+every worker polls its shard of the inventory with a MeterPoller and sends
+the readings of each tick back as one packed batch, hosts of a worker that
+died are handed to the remaining ones
+
+usage: python -m ShellyPy.collect inventory.txt --processes 4
+"""
+import argparse
+import json
+import struct
+import sys
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from time import monotonic
+from zlib import crc32
+
+from .poller import MeterPoller, Reading
+from .wrapper import Shelly
+
+# tag, errors, missed samples and unreachable hosts of the worker so far
+HEADER = struct.Struct("<cIII")
+# host index, channel, timestamp, power, voltage, total
+RECORD = struct.Struct("<IHdddd")
+
+# seconds between attempts to reach hosts that did not answer
+RETRY_INTERVAL = 60
+
+
+def parse_inventory(lines):
+    """
+    @brief      read an inventory, one "ip[:port] [generation]" per line, # starts a comment
+
+    @return     list of (ip, port, generation) tuples, generation is None if unknown
+    """
+    entries = []
+
+    for line in lines:
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+
+        ip, _, port = fields[0].partition(":")
+        gen = int(fields[1]) if len(fields) > 1 else None
+        entries.append((ip, port or "80", gen))
+
+    return entries
+
+
+def host_key(entry):
+    """key of an inventory entry, the same as poller.host_of of its device"""
+    return "{}:{}".format(entry[0], entry[1])
+
+
+def shard_of(key, shards):
+    """shard of a host, stable across processes and runs unlike hash()"""
+    return crc32(key.encode()) % shards
+
+
+def pack(readings, index, errors, missed, unreachable):
+    """pack the readings of a tick into a batch"""
+    payload = bytearray(HEADER.size + RECORD.size * len(readings))
+    HEADER.pack_into(payload, 0, b"R", errors, missed, unreachable)
+
+    offset = HEADER.size
+    for reading in readings:
+        RECORD.pack_into(payload, offset, index[reading.host], reading.channel,
+                         reading.timestamp, reading.power, reading.voltage, reading.total)
+        offset += RECORD.size
+
+    return payload
+
+
+def unpack(payload, hosts):
+    """
+    @brief      read a batch sent by pack
+
+    @param      hosts   host keys of the worker in the order of their index
+
+    @return     tuple of errors, missed, unreachable and the list of Readings
+    """
+    _, errors, missed, unreachable = HEADER.unpack_from(payload)
+    readings = [
+        Reading(hosts[record[0]], *record[1:])
+        for record in RECORD.iter_unpack(memoryview(payload)[HEADER.size:])
+    ]
+    return errors, missed, unreachable, readings
+
+
+def _connect(entries, devices, options):
+    """create the devices of entries that are not connected yet"""
+    for entry in entries:
+        key = host_key(entry)
+        if key in devices:
+            continue
+
+        try:
+            devices[key] = Shelly(entry[0], entry[1], gen=entry[2], **options.get("device", {}))
+        except Exception:
+            # tried again after RETRY_INTERVAL
+            pass
+
+    return [host_key(entry) for entry in entries if host_key(entry) in devices]
+
+
+def _worker(entries, conn, options):
+    """process polling one shard, readings go back over conn as packed batches"""
+    entries = [tuple(entry) for entry in entries]
+    devices = {}
+    errors = 0
+    missed = 0
+
+    while True:
+        keys = _connect(entries, devices, options)
+        unreachable = len(entries) - len(keys)
+        retry = monotonic() + RETRY_INTERVAL
+
+        poller = MeterPoller(
+            [devices[key] for key in keys], options["interval"], capacity=1,
+            source=options["source"], channels=options["channels"], workers=options["workers"],
+        )
+        # readings carry host_of(device), which is the host key of its entry
+        index = {key: position for position, key in enumerate(keys)}
+
+        try:
+            conn.send_bytes(b"H" + json.dumps(keys).encode())
+
+            for readings in poller.run():
+                conn.send_bytes(pack(
+                    readings, index,
+                    errors + sum(poller.errors.values()),
+                    missed + sum(poller.missed.values()),
+                    unreachable,
+                ))
+
+                if conn.poll():
+                    message = conn.recv_bytes()
+                    if message[:1] == b"Q":
+                        return
+                    # hosts of a worker that died
+                    entries += [tuple(entry) for entry in json.loads(message[1:])]
+                    break
+
+                if unreachable and monotonic() > retry:
+                    break
+        except (EOFError, OSError):
+            # the collector is gone
+            return
+
+        errors += sum(poller.errors.values())
+        missed += sum(poller.missed.values())
+
+
+class Shard:
+    """
+    a worker process and what the collector knows about it
+    """
+
+    def __init__(self, index, entries):
+        self.index = index
+        self.entries = list(entries)
+        self.conn = None
+        self.process = None
+
+        # host keys in the order the worker indexes them
+        self.hosts = []
+        self.alive = False
+        # whether the worker died instead of being stopped
+        self.lost = False
+
+        self.readings = 0
+        self.batches = 0
+        self.bytes = 0
+        self.errors = 0
+        self.missed = 0
+        self.unreachable = 0
+        self.started = None
+
+    def __repr__(self):
+        return "<Shard {} {} hosts {}>".format(self.index, len(self.entries), self.state)
+
+    @property
+    def state(self):
+        if self.lost:
+            return "lost"
+        return "alive" if self.alive else "stopped"
+
+    def start(self, options):
+        self.conn, child = Pipe()
+        self.process = Process(target=_worker, args=(self.entries, child, options),
+                               name="ShellyCollector-{}".format(self.index), daemon=True)
+        self.process.start()
+        # the worker holds the only other end, so its death shows up as EOF
+        child.close()
+
+        self.alive = True
+        self.started = monotonic()
+
+    def receive(self, payload):
+        """handle a message of the worker, returns the Readings it carried"""
+        self.bytes += len(payload)
+
+        if payload[:1] == b"H":
+            self.hosts = json.loads(payload[1:])
+            return []
+
+        self.errors, self.missed, self.unreachable, readings = unpack(payload, self.hosts)
+        self.batches += 1
+        self.readings += len(readings)
+        return readings
+
+    def stats(self):
+        elapsed = monotonic() - self.started if self.started else 0
+        return {
+            "hosts": len(self.entries),
+            "state": self.state,
+            "readings": self.readings,
+            "per_second": self.readings / elapsed if elapsed else 0.0,
+            "batches": self.batches,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "missed": self.missed,
+            "unreachable": self.unreachable,
+        }
+
+
+class Collector:
+    """
+    polls an inventory of devices from several worker processes
+    """
+
+    def __init__(self, entries, processes = 2, **kwargs):
+        """
+        @param      entries     list of (ip, port, generation) tuples, see parse_inventory
+        @param      processes   amount of worker processes
+        @param      interval    seconds between samples
+        @param      source      "meter" or "emeter"
+        @param      channels    channel indices to sample on every device
+        @param      workers     concurrent requests per worker process
+        @param      timeout     request timeout of the devices
+        @param      login       dict of login credentials used for every device
+        """
+        self.options = {
+            "interval": kwargs.get("interval", 1.0),
+            "source": kwargs.get("source", "meter"),
+            "channels": tuple(kwargs.get("channels", (0,))),
+            "workers": kwargs.get("workers", 32),
+            "device": {"timeout": kwargs.get("timeout", 2)},
+        }
+        if kwargs.get("login"):
+            self.options["device"]["login"] = kwargs["login"]
+
+        processes = max(1, min(processes, len(entries) or 1))
+        groups = [[] for _ in range(processes)]
+        for entry in entries:
+            groups[shard_of(host_key(entry), processes)].append(entry)
+
+        self.shards = [Shard(index, group) for index, group in enumerate(groups)]
+        # hosts handed to other workers after theirs died
+        self.rebalanced = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        for shard in self.shards:
+            if shard.process is None:
+                shard.start(self.options)
+        return self
+
+    def __lost__(self, shard):
+        """hand the hosts of a dead worker to the remaining ones"""
+        shard.alive = False
+        shard.lost = True
+        shard.conn.close()
+        shard.process.join(1)
+
+        alive = [candidate for candidate in self.shards if candidate.alive]
+        if not alive:
+            return
+
+        groups = {}
+        for entry in shard.entries:
+            target = alive[shard_of(host_key(entry), len(alive))]
+            groups.setdefault(target.index, []).append(entry)
+
+        for index, entries in groups.items():
+            target = self.shards[index]
+            try:
+                target.conn.send_bytes(b"A" + json.dumps(entries).encode())
+            except OSError:
+                continue
+            target.entries += entries
+            self.rebalanced += len(entries)
+
+        shard.entries = []
+
+    def run(self, duration = None):
+        """
+        @brief      receive readings from every worker
+
+        @param      duration    seconds to run for, None runs until every worker died
+
+        @return     generator of a list of Readings per received batch
+        """
+        self.start()
+        end = None if duration is None else monotonic() + duration
+
+        while True:
+            conns = {shard.conn: shard for shard in self.shards if shard.alive}
+            if not conns:
+                return
+
+            timeout = None if end is None else end - monotonic()
+            if timeout is not None and timeout <= 0:
+                return
+
+            for conn in wait(list(conns), timeout):
+                shard = conns[conn]
+                try:
+                    payload = conn.recv_bytes()
+                except (EOFError, OSError):
+                    self.__lost__(shard)
+                    continue
+
+                readings = shard.receive(payload)
+                if readings:
+                    yield readings
+
+    def stats(self):
+        """
+        @return     dict of shard index to its hosts, readings per second and counters
+        """
+        return {shard.index: shard.stats() for shard in self.shards}
+
+    def report(self):
+        """
+        @return     throughput of every shard as a table
+        """
+        lines = ["{:>5} {:>6} {:>10} {:>10} {:>8} {:>8} {:>8} {:>11}  {}".format(
+            "shard", "hosts", "readings", "per second", "kbytes", "errors", "missed", "unreachable", "state")]
+
+        for index, stats in self.stats().items():
+            lines.append("{:>5} {:>6} {:>10} {:>10.1f} {:>8.1f} {:>8} {:>8} {:>11}  {}".format(
+                index, stats["hosts"], stats["readings"], stats["per_second"], stats["bytes"] / 1024,
+                stats["errors"], stats["missed"], stats["unreachable"], stats["state"]))
+
+        return "\n".join(lines)
+
+    def stop(self):
+        for shard in self.shards:
+            if shard.alive:
+                try:
+                    shard.conn.send_bytes(b"Q")
+                except OSError:
+                    pass
+
+        for shard in self.shards:
+            if shard.process is not None:
+                shard.process.join(self.options["interval"] + 5)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+                    shard.process.join()
+
+            if shard.conn is not None:
+                shard.conn.close()
+            shard.alive = False
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="shellypy-collect", description="poll the meters of many devices from several processes")
+    parser.add_argument("inventory", help="file with one ip[:port] [generation] per line, - for stdin")
+    parser.add_argument("-p", "--processes", type=int, default=2, help="worker processes")
+    parser.add_argument("-i", "--interval", type=float, default=1.0, help="seconds between samples")
+    parser.add_argument("-s", "--source", choices=("meter", "emeter"), default="meter")
+    parser.add_argument("-c", "--channels", default="0", help="comma separated channel indices")
+    parser.add_argument("-w", "--workers", type=int, default=32, help="concurrent requests per process")
+    parser.add_argument("-t", "--timeout", type=float, default=2, help="request timeout")
+    parser.add_argument("-d", "--duration", type=float, default=None, help="seconds to run for")
+    parser.add_argument("-r", "--report", type=float, default=10, help="seconds between throughput reports")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print throughput reports")
+    args = parser.parse_args(argv)
+
+    if args.inventory == "-":
+        entries = parse_inventory(sys.stdin)
+    else:
+        with open(args.inventory) as f:
+            entries = parse_inventory(f)
+
+    collector = Collector(
+        entries, args.processes, interval=args.interval, source=args.source,
+        channels=[int(channel) for channel in args.channels.split(",")],
+        workers=args.workers, timeout=args.timeout,
+    )
+
+    next_report = monotonic() + args.report
+    try:
+        with collector:
+            for readings in collector.run(args.duration):
+                if not args.quiet:
+                    for reading in readings:
+                        print("\t".join(str(value) for value in reading))
+
+                if monotonic() >= next_report:
+                    print(collector.report(), file=sys.stderr)
+                    next_report = monotonic() + args.report
+    except KeyboardInterrupt:
+        pass
+
+    print(collector.report(), file=sys.stderr)
+    if collector.rebalanced:
+        print("{} hosts were handed to other workers".format(collector.rebalanced), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+requests built once and sent any number of times
+"""
+import json
+from urllib.parse import quote, urlencode
+
+
+def encode(values):
+    """
+    @brief      query string of Gen1 values
+
+    values are percent encoded, so & = + and spaces survive,
+    brackets, colons and slashes are kept for list keys and URLs
+
+    @return     encoded query without the leading ?
+    """
+    if not values:
+        return ""
+    return urlencode(values, safe="[]:/", quote_via=quote)
+
+
+class Command(dict):
+    """
+    a request validated and encoded once, see ShellyBase.prepare
+
+    the dict holds the values of the request, changing them
+    afterwards does not change what is sent
+    """
+
+    __slots__ = ("page", "generation", "query", "prefix")
+
+    def __init__(self, generation, page, values = None):
+        """
+        @param      generation  generation of the devices the command is for
+        @param      page        page (Gen1) or RPC method (Gen2)
+        @param      values      dict of parameters
+        """
+        super().__init__(values or {})
+
+        self.page = page
+        self.generation = generation
+        self.query = None
+        self.prefix = None
+
+        if generation == 1:
+            # everything after http://ip:port/
+            self.query = "{}?{}".format(page, encode(self))
+        else:
+            # the JSON-RPC request up to its id, which differs for every send
+            request = {"jsonrpc": "2.0", "method": page}
+            if self:
+                request["params"] = dict(self)
+            self.prefix = json.dumps(request, separators=(",", ":"))[:-1].encode("utf-8") + b',"id":'
+
+    def __repr__(self):
+        return "<Command Gen {} {} {}>".format(self.generation, self.page, dict.__repr__(self))
+
+    def __reduce__(self):
+        return Command, (self.generation, self.page, dict(self))
+
+    def payload(self, payload_id):
+        """
+        @brief      serialized JSON-RPC request with the given id, Gen2 only
+        """
+        return b"%s%d}" % (self.prefix, payload_id)
+
+
+class CommandSet:
+    """
+    a command prepared once per generation, for devices of mixed generations
+
+    the command for a generation is built from the first device of it it is sent to
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        @param      name    see ShellyBase.prepare, only taken positionally
+        """
+        if not args:
+            raise TypeError("CommandSet() missing the name of the command")
+
+        self.name = args[0]
+        self.args = args[1:]
+        self.kwargs = kwargs
+        self.commands = {}
+
+    def __repr__(self):
+        return "<CommandSet {} {}>".format(self.name, sorted(self.commands))
+
+    def of(self, device):
+        """
+        @brief      the Command for the generation of a device
+        """
+        command = self.commands.get(device.__generation__)
+        if command is None:
+            command = device.prepare(self.name, *self.args, **self.kwargs)
+            self.commands[device.__generation__] = command
+        return command
@@ -0,0 +1,105 @@
+"""
+applying settings to devices, sending only what differs
+"""
+
+_MISSING = object()
+
+
+def patch(current, desired):
+    """
+    @brief      the part of desired settings that differs from the current ones
+
+    dicts are compared key by key, any other value as a whole,
+    values the device does not report are always part of the patch
+
+    @param      current     settings as reported by the device
+    @param      desired     dict of the settings to have, only the given keys are compared
+
+    @return     dict with only the differing values, empty if everything matches
+    """
+    changed = {}
+
+    for key, value in desired.items():
+        old = current.get(key, _MISSING) if isinstance(current, dict) else _MISSING
+
+        if isinstance(value, dict) and isinstance(old, dict):
+            nested = patch(old, value)
+            if nested:
+                changed[key] = nested
+        elif old is _MISSING or old != value or isinstance(old, bool) != isinstance(value, bool):
+            changed[key] = value
+
+    return changed
+
+
+def stages(hosts, canary = 1, batch = None):
+    """
+    @brief      split hosts into rollout stages
+
+    @param      hosts   list of hosts
+    @param      canary  amount of hosts in the first stage
+    @param      batch   amount of hosts in every following stage, all remaining ones if None
+
+    @return     list of lists of hosts
+    """
+    result = []
+
+    if canary:
+        result.append(hosts[:canary])
+        hosts = hosts[canary:]
+
+    size = batch or len(hosts)
+    for start in range(0, len(hosts), size or 1):
+        result.append(hosts[start:start + size])
+
+    return [stage for stage in result if stage]
+
+
+def applier(desired, dry_run = False):
+    """function applying desired settings to a device, desired may be a function of the device"""
+    def apply(device):
+        return device.apply_config(desired(device) if callable(desired) else desired, dry_run)
+    return apply
+
+
+class RolloutSummary:
+    """
+    outcome of applying settings to a fleet
+    """
+
+    def __init__(self, max_failures = 0):
+        # host to FleetResult, the result is what was sent to the device
+        self.results = {}
+        # hosts of stages that were not started
+        self.skipped = []
+        self.stages = 0
+        self.max_failures = max_failures
+
+    def __repr__(self):
+        return "<RolloutSummary {} changed {} unchanged {} failed {} skipped>".format(
+            len(self.changed), len(self.unchanged), len(self.failed), len(self.skipped)
+        )
+
+    def add(self, result):
+        self.results[result.host] = result
+
+    @property
+    def halted(self):
+        """whether too many devices failed to continue with the next stage"""
+        return len(self.failed) > self.max_failures
+
+    @property
+    def changed(self):
+        return [host for host, result in self.results.items() if result.ok and result.result]
+
+    @property
+    def unchanged(self):
+        return [host for host, result in self.results.items() if result.ok and not result.result]
+
+    @property
+    def failed(self):
+        return [host for host, result in self.results.items() if not result.ok]
+
+    @property
+    def ok(self):
+        return not self.failed and not self.skipped
@@ -0,0 +1,184 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from .base import ShellyBase
+from .codec import decode
+from .gen1 import ShellyGen1
+from .gen2 import ShellyGen2
+
+
+class DetectionCache:
+    """
+    /shelly responses keyed by host:port, optionally persisted to a JSON file
+    """
+
+    def __init__(self, path = None):
+        """
+        @param      path    file the cache is loaded from and saved to, None keeps it in memory only
+        """
+        self.path = path
+        self.__entries__ = {}
+        self.__lock__ = Lock()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.__entries__ = json.load(f)
+
+    def __len__(self):
+        return len(self.__entries__)
+
+    def __contains__(self, key):
+        return key in self.__entries__
+
+    @staticmethod
+    def __key__(ip, port):
+        # ports are passed as "80" and 80 alike, both have to find the same entry
+        return "{}:{}".format(ip, int(port))
+
+    def get(self, ip, port = "80"):
+        """
+        @return     cached /shelly response or None
+        """
+        return self.__entries__.get(self.__key__(ip, port))
+
+    def put(self, ip, port, info, save = True):
+        """
+        @brief      store a /shelly response
+
+        @param      save    write the file right away if the cache is persisted
+        """
+        with self.__lock__:
+            self.__entries__[self.__key__(ip, port)] = info
+
+        if save and self.path:
+            self.save()
+
+    def forget(self, ip, port = "80"):
+        with self.__lock__:
+            self.__entries__.pop(self.__key__(ip, port), None)
+
+    def save(self):
+        """
+        @brief      write the cache to its file
+        """
+        with self.__lock__:
+            data = json.dumps(self.__entries__)
+
+        # replace the file at once so a crash never leaves half a cache behind
+        temp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temp, "w") as f:
+            f.write(data)
+        os.replace(temp, self.path)
+
+
+# shared by every Shelly created without a detect_cache of its own
+default_cache = DetectionCache()
+
+
+def device_class(info):
+    """
+    @brief      pick the device class for a /shelly response or a generation
+
+    @param      info    /shelly response or generation number
+
+    @return     ShellyGen1 or ShellyGen2
+    """
+    gen = info if isinstance(info, int) else info.get("gen", 1)
+
+    if gen == 1:
+        return ShellyGen1
+    elif gen >= 2:
+        # Shelly API is the same for Gen2, Gen3 and Gen4
+        return ShellyGen2
+    else:
+        raise ValueError("Generation {} not supported".format(gen))
+
+
+def probe(ip, port = "80", timeout = 5, login = None, session = None):
+    """
+    @brief      request /shelly from a device
+
+    @param      ip          the target IP of the shelly device
+    @param      port        target port
+    @param      timeout     specify the amount of time until the request is aborted
+    @param      login       dict of login credentials. Keys needed are "username" and "password"
+    @param      session     ShellySession to send the request through
+
+    @return     /shelly response as a dict
+    """
+    url = "{}://{}:{}/shelly".format("http", ip, port)
+
+    auth = None
+    if login:
+        auth = (login.get("username", ""), login.get("password", ""))
+
+    if session is None:
+        from requests import get
+        response = get(url, auth=auth, timeout=timeout)
+    else:
+        response = session.get(url, auth=auth, timeout=timeout)
+
+    ShellyBase.__check_status__(response.status_code)
+
+    return decode(response.content)
+
+
+def detect(ip, port = "80", timeout = 5, login = None, cache = default_cache, session = None):
+    """
+    @brief      /shelly response of a device, probing it only if it is not cached
+
+    @param      cache   DetectionCache to use, None to always probe
+
+    @return     /shelly response as a dict
+    """
+    if cache is not None:
+        info = cache.get(ip, port)
+        if info is not None:
+            return info
+
+    info = probe(ip, port, timeout, login, session)
+
+    if cache is not None:
+        cache.put(ip, port, info)
+
+    return info
+
+
+def detect_many(hosts, workers = 32, timeout = 5, login = None, cache = default_cache):
+    """
+    @brief      detect many devices concurrently
+
+    @param      hosts   iterable of IPs or (IP, port) tuples
+    @param      workers maximum amount of concurrent probes
+
+    @return     dict of host to /shelly response, or the exception raised while probing it
+    """
+    def run(host):
+        ip, port = host if isinstance(host, tuple) else (host, "80")
+
+        if cache is not None:
+            info = cache.get(ip, port)
+            if info is not None:
+                return info
+
+        try:
+            info = probe(ip, port, timeout, login)
+        except Exception as e:
+            return e
+
+        if cache is not None:
+            # the file is written once all probes are done
+            cache.put(ip, port, info, save=False)
+
+        return info
+
+    hosts = list(hosts)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(hosts, executor.map(run, hosts)))
+
+    if cache is not None and cache.path:
+        cache.save()
+
+    return results
@@ -0,0 +1,265 @@
+import socket
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ipaddress import ip_address, ip_network
+from time import monotonic
+
+from .detect import device_class, probe
+from .transport import ShellySession
+
+MDNS_GROUP = ("224.0.0.251", 5353)
+
+# service types announced by Shelly devices, Gen1 devices only announce _http
+MDNS_SERVICES = ("_shelly._tcp.local", "_http._tcp.local")
+
+
+class DiscoveredDevice:
+    """
+    a device that answered /shelly
+    """
+
+    def __init__(self, ip, port, info):
+        self.ip = ip
+        self.port = port
+        self.info = info
+
+        self.generation = info.get("gen", 1)
+
+        if self.generation == 1:
+            self.model = info.get("type")
+            self.firmware = info.get("fw")
+            self.auth = info.get("auth", False)
+        else:
+            self.model = info.get("model")
+            self.firmware = info.get("ver")
+            self.auth = info.get("auth_en", False)
+
+        self.mac = info.get("mac")
+
+    def __repr__(self):
+        return "<DiscoveredDevice {} Gen {} ({}:{})>".format(self.model, self.generation, self.ip, self.port)
+
+    def device(self, *args, **kwargs):
+        """
+        @brief      create the device object without probing the device again
+
+        @return     ShellyGen1 or ShellyGen2
+        """
+        kwargs["info"] = self.info
+        return device_class(self.info)(self.ip, self.port, *args, **kwargs)
+
+
+def addresses(targets):
+    """
+    @brief      expand targets into single addresses
+
+    @param      targets     CIDR range, IP or hostname, or a list of them
+
+    @return     generator of address strings
+    """
+    if isinstance(targets, str):
+        targets = [targets]
+
+    for target in targets:
+        try:
+            if "/" not in target:
+                yield str(ip_address(target))
+                continue
+            network = ip_network(target, strict=False)
+        except ValueError:
+            # hostname
+            yield target
+            continue
+
+        if network.num_addresses == 1:
+            yield str(network.network_address)
+        else:
+            for address in network.hosts():
+                yield str(address)
+
+
+def is_shelly(info):
+    """whether a /shelly response came from a Shelly device"""
+    return isinstance(info, dict) and "mac" in info and ("type" in info or "gen" in info)
+
+
+def scan(targets, port = "80", workers = 64, connect_timeout = 0.3, timeout = 2, login = None, mdns = 0):
+    """
+    @brief      probe many addresses concurrently, yielding devices as they answer
+
+    @param      targets         CIDR range, IP or hostname, or a list of them
+    @param      port            port to probe on every address
+    @param      workers         maximum amount of concurrent probes
+    @param      connect_timeout seconds to wait for a connection, most addresses of a range never answer
+    @param      timeout         seconds to wait for the response once connected
+    @param      login           dict of login credentials. Keys needed are "username" and "password"
+    @param      mdns            seconds to listen for mDNS answers, found devices are probed as well
+
+    @return     generator of DiscoveredDevice
+    """
+    hosts = list(addresses(targets))
+
+    if mdns:
+        hosts.extend(address for address in mdns_query(mdns) if address not in hosts)
+
+    session = ShellySession(pool_size=1, pool_hosts=workers)
+
+    def run(host):
+        try:
+            info = probe(host, port, (connect_timeout, timeout), login, session)
+        except Exception:
+            return None
+
+        if not is_shelly(info):
+            return None
+        return DiscoveredDevice(host, port, info)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(run, host) for host in hosts]):
+                if future.result() is not None:
+                    yield future.result()
+    finally:
+        session.close()
+
+
+def discover(targets, cache = None, **kwargs):
+    """
+    @brief      find every Shelly device in a range or list of hosts
+
+    @param      targets     CIDR range, IP or hostname, or a list of them
+    @param      cache       DetectionCache to seed, so Shelly() skips the probe for found devices
+
+    see scan for the remaining parameters
+
+    @return     list of DiscoveredDevice sorted by address
+    """
+    found = list(scan(targets, **kwargs))
+
+    if cache is not None:
+        for device in found:
+            cache.put(device.ip, device.port, device.info, save=False)
+        if cache.path:
+            cache.save()
+
+    def order(device):
+        try:
+            return 0, int(ip_address(device.ip))
+        except ValueError:
+            return 1, device.ip
+
+    return sorted(found, key=order)
+
+
+def _encode_name(name):
+    packet = b""
+    for label in name.split("."):
+        packet += struct.pack("B", len(label)) + label.encode("ascii")
+    return packet + b"\x00"
+
+
+def _read_name(packet, offset):
+    """
+    @return     tuple of the decoded name and the offset after it
+    """
+    labels = []
+    end = None
+
+    # bound the amount of compression pointers against malicious packets
+    for _ in range(64):
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack_from("!H", packet, offset)[0] & 0x3FFF
+            continue
+
+        offset += 1
+        if not length:
+            break
+        labels.append(packet[offset:offset + length].decode("utf-8", "replace"))
+        offset += length
+
+    return ".".join(labels), offset if end is None else end
+
+
+def mdns_parse(packet):
+    """
+    @brief      names and IPv4 addresses in a mDNS response
+
+    @return     tuple of a list of names and a list of addresses
+    """
+    names = []
+    found = []
+
+    questions, answers, authorities, additionals = struct.unpack_from("!4H", packet, 4)
+    offset = 12
+
+    for _ in range(questions):
+        _, offset = _read_name(packet, offset)
+        offset += 4
+
+    for _ in range(answers + authorities + additionals):
+        name, offset = _read_name(packet, offset)
+        kind, _, _, length = struct.unpack_from("!HHIH", packet, offset)
+        offset += 10
+
+        names.append(name)
+        if kind == 1 and length == 4:
+            found.append(socket.inet_ntoa(packet[offset:offset + 4]))
+        elif kind == 12:
+            names.append(_read_name(packet, offset)[0])
+
+        offset += length
+
+    return names, found
+
+
+def mdns_query(duration = 2, services = MDNS_SERVICES):
+    """
+    @brief      ask the network for Shelly services over mDNS
+
+    the query is sent from a random port, so answers come back as unicast
+    and no mDNS responder running on this machine is disturbed
+
+    @param      duration    seconds to collect answers for
+    @param      services    service types to ask for
+
+    @return     list of addresses of the devices that answered
+    """
+    query = struct.pack("!6H", 0, 0, len(services), 0, 0, 0)
+    for service in services:
+        # PTR record, IN class
+        query += _encode_name(service) + struct.pack("!HH", 12, 1)
+
+    found = []
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+        sock.sendto(query, MDNS_GROUP)
+
+        end = monotonic() + duration
+        while True:
+            remaining = end - monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+
+            try:
+                packet, (sender, _) = sock.recvfrom(9000)
+            except socket.timeout:
+                break
+
+            try:
+                names, _ = mdns_parse(packet)
+            except (IndexError, struct.error):
+                continue
+
+            # _http is announced by any web server, keep the Shelly ones
+            if sender not in found and any("shelly" in name.lower() for name in names):
+                found.append(sender)
+    finally:
+        sock.close()
+
+    return found
@@ -16,3 +16,12 @@ class NotFound(Exception):
     Exception for 404 Not Found
     """
     pass
+
+class CircuitOpen(Exception):
+    """
+    Exception for requests to a device that failed too often recently
+    """
+
+    def __init__(self, retry_in = 0):
+        super().__init__("Circuit open, retrying in {:.1f}s".format(retry_in))
+        self.retry_in = retry_in
@@ -0,0 +1,532 @@
+"""
+export of readings as time series
+
+readings are collected into columnar batches and written a batch at a time,
+as InfluxDB line protocol, CSV or fixed size binary records that can be
+memory-mapped. files are rotated by size or age.
+"""
+import csv
+import io
+import mmap
+import os
+import struct
+from array import array
+from time import monotonic, time
+
+NAN = float("nan")
+
+# flattened fields, NaN where a device does not report them
+FIELDS = ("power", "voltage", "total", "output", "temperature")
+
+# component keys of Gen2 devices that carry readings, e.g. "switch:0"
+COMPONENTS = ("switch", "em1", "pm1", "light", "cover")
+
+
+# component key to its channel, None for keys without readings
+_component_keys = {}
+
+
+def _number(value):
+    # exact type checks, bool is a subclass of int
+    kind = type(value)
+    if kind is float:
+        return value
+    if kind is int:
+        return float(value)
+    if kind is bool:
+        return 1.0 if value else 0.0
+    if kind is dict:
+        # Gen2 temperatures
+        return _number(value.get("tC"))
+    return NAN
+
+
+def _first(response, names):
+    for name in names:
+        value = response.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def values_of(response):
+    """
+    @brief      the known fields of a single channel, Gen1 and Gen2 naming alike
+
+    @return     tuple in the order of FIELDS
+    """
+    total = response.get("total")
+    if total is None:
+        energy = response.get("aenergy")
+        if type(energy) is dict:
+            total = energy.get("total")
+
+    return (
+        _number(_first(response, ("power", "apower", "act_power"))),
+        _number(response.get("voltage")),
+        _number(total),
+        _number(_first(response, ("ison", "output"))),
+        _number(_first(response, ("temperature", "tmp"))),
+    )
+
+
+def _component_index(key):
+    """channel of a Gen2 component key that carries readings, None for any other key"""
+    try:
+        return _component_keys[key]
+    except KeyError:
+        pass
+
+    name, _, index = key.partition(":")
+    channel = int(index) if name in COMPONENTS and index.isdigit() else None
+
+    # responses only ever contain a few dozen different keys
+    _component_keys[key] = channel
+    return channel
+
+
+def flatten(response, channel = None):
+    """
+    @brief      split a status, meter, emeter, relay or RPC response into rows
+
+    totals are kept in the unit of the device, watt-minutes on Gen1 and watt-hours on Gen2
+
+    @param      response    response dict
+    @param      channel     channel of a single channel response, its "id" or 0 if None
+
+    @return     list of (channel, values) tuples, values in the order of FIELDS
+    """
+    # Gen1 /status
+    if any(key in response for key in ("relays", "meters", "emeters")):
+        merged = {}
+        for name in ("relays", "meters", "emeters", "lights", "rollers"):
+            for index, part in enumerate(response.get(name) or []):
+                merged.setdefault(index, {}).update(part)
+
+        temperature = response.get("temperature", response.get("tmp"))
+        rows = []
+        for index, part in sorted(merged.items()):
+            if temperature is not None and "temperature" not in part:
+                part["temperature"] = temperature
+            rows.append((index, values_of(part)))
+        return rows
+
+    # Gen2 Shelly.GetStatus
+    rows = []
+    for key, part in response.items():
+        index = _component_index(key)
+        if index is not None and type(part) is dict:
+            rows.append((index, values_of(part)))
+    if rows:
+        return rows
+
+    if channel is None:
+        channel = response.get("id", 0)
+    return [(channel, values_of(response))]
+
+
+class Batch:
+    """
+    readings as columns, one array per field
+    """
+
+    def __init__(self):
+        self.hosts = []
+        self.channels = array("H")
+        self.timestamps = array("d")
+        self.columns = {field: array("d") for field in FIELDS}
+        self.__columns__ = [self.columns[field] for field in FIELDS]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, host, channel, timestamp, values):
+        """
+        @param      values  tuple in the order of FIELDS
+        """
+        self.hosts.append(host)
+        self.channels.append(channel)
+        self.timestamps.append(timestamp)
+
+        power, voltage, total, output, temperature = self.__columns__
+        power.append(values[0])
+        voltage.append(values[1])
+        total.append(values[2])
+        output.append(values[3])
+        temperature.append(values[4])
+
+    def rows(self):
+        """
+        @return     iterator of (host, channel, timestamp, *values) tuples
+        """
+        return zip(self.hosts, self.channels, self.timestamps, *self.__columns__)
+
+    def clear(self):
+        self.hosts = []
+        del self.channels[:]
+        del self.timestamps[:]
+        for column in self.columns.values():
+            del column[:]
+
+
+class Sink:
+    """
+    buffers readings and writes them a batch at a time
+
+    flushing and time based rotation are checked whenever readings are added
+    """
+
+    def __init__(self, path, **kwargs):
+        """
+        @param      path            file to write to, rotated files get a sequence number appended
+        @param      flush_rows      rows buffered until they are written
+        @param      flush_interval  seconds until buffered rows are written
+        @param      rotate_bytes    size after which the file is rotated, None to never rotate by size
+        @param      rotate_interval seconds after which the file is rotated, None to never rotate by age
+        @param      buffering       size of the file buffer
+        """
+        self.path = path
+        self.flush_rows = kwargs.get("flush_rows", 5000)
+        self.flush_interval = kwargs.get("flush_interval", 1.0)
+        self.rotate_bytes = kwargs.get("rotate_bytes", None)
+        self.rotate_interval = kwargs.get("rotate_interval", None)
+        self.buffering = kwargs.get("buffering", 1 << 20)
+
+        self.rows = 0
+        self.bytes = 0
+        self.flushes = 0
+        self.rotations = 0
+
+        self.batch = Batch()
+        self.__file__ = None
+        self.__opened__ = 0
+        self.__flushed__ = monotonic()
+        # rotated files of an earlier run are kept, numbering continues after them
+        self.__sequence__ = _last_sequence(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, host, channel, timestamp, values):
+        """
+        @brief      buffer a single row
+
+        @param      values  tuple in the order of FIELDS
+        """
+        self.batch.append(host, channel, timestamp, values)
+        self.__check__()
+
+    def record(self, host, response, channel = None, timestamp = None):
+        """
+        @brief      buffer the rows of a status, meter, emeter, relay or RPC response
+
+        @param      host        host the response came from
+        @param      response    response dict
+        @param      channel     channel of a single channel response
+        @param      timestamp   time of the response, now if None
+        """
+        timestamp = time() if timestamp is None else timestamp
+        for row_channel, values in flatten(response, channel):
+            self.batch.append(host, row_channel, timestamp, values)
+        self.__check__()
+
+    def consume(self, readings):
+        """
+        @brief      buffer poller or collector readings
+
+        @param      readings    iterable of Readings or of lists of Readings, e.g. MeterPoller.run()
+        """
+        batch = self.batch
+        for item in readings:
+            for reading in (item if isinstance(item, list) else (item,)):
+                batch.append(reading.host, reading.channel, reading.timestamp,
+                             (reading.power, reading.voltage, reading.total, NAN, NAN))
+            self.__check__()
+
+    def __check__(self):
+        if len(self.batch) >= self.flush_rows or monotonic() - self.__flushed__ >= self.flush_interval:
+            self.flush()
+
+    def __open__(self):
+        # a restarted sink appends to the file an earlier run left behind
+        self.__file__ = open(self.path, "ab", buffering=self.buffering)
+        self.__opened__ = monotonic()
+        self.__start__(self.__file__, self.__file__.tell() == 0)
+
+    def __start__(self, file, new):
+        """write what a new file starts with, new is False when appending to an existing one"""
+        pass
+
+    def __rotate__(self):
+        self.__file__.close()
+        self.__file__ = None
+
+        self.__sequence__ += 1
+        os.replace(self.path, "{}.{}".format(self.path, self.__sequence__))
+        self.rotations += 1
+
+    def __due__(self):
+        """whether the current file has to be rotated before writing to it"""
+        if self.rotate_bytes is not None and self.__file__.tell() >= self.rotate_bytes:
+            return True
+        return self.rotate_interval is not None and monotonic() - self.__opened__ >= self.rotate_interval
+
+    def flush(self):
+        """
+        @brief      write the buffered rows, rotating the file first if it is due
+        """
+        self.__flushed__ = monotonic()
+
+        if self.__file__ is not None and len(self.batch) and self.__due__():
+            self.__rotate__()
+
+        if self.__file__ is None:
+            self.__open__()
+
+        if len(self.batch):
+            data = self.__encode__(self.batch)
+            self.__file__.write(data)
+            self.__file__.flush()
+
+            self.rows += len(self.batch)
+            self.bytes += len(data)
+            self.flushes += 1
+            self.batch.clear()
+
+    def __encode__(self, batch):
+        """bytes of a batch in the format of the sink"""
+        raise NotImplementedError("Base Class")
+
+    def close(self):
+        self.flush()
+        if self.__file__ is not None:
+            self.__file__.close()
+            self.__file__ = None
+
+    def stats(self):
+        """
+        @return     dict of written rows, bytes, flushes, rotations and buffered rows
+        """
+        return {
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "flushes": self.flushes,
+            "rotations": self.rotations,
+            "buffered": len(self.batch),
+        }
+
+
+def _last_sequence(path):
+    """highest sequence number of the rotated files of path, 0 if there are none"""
+    directory, name = os.path.split(os.path.abspath(path))
+    prefix = name + "."
+
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return 0
+
+    return max([int(entry[len(prefix):]) for entry in entries
+                if entry.startswith(prefix) and entry[len(prefix):].isdigit()], default=0)
+
+
+def _escape_tag(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+
+class LineProtocolSink(Sink):
+    """
+    InfluxDB line protocol, one line per row with nanosecond timestamps
+    """
+
+    def __init__(self, path, measurement = "shelly", **kwargs):
+        super().__init__(path, **kwargs)
+        self.measurement = _escape_tag(measurement)
+
+    def __encode__(self, batch):
+        lines = []
+        tags = {}
+
+        # NaN is the only value not equal to itself
+        for host, channel, timestamp, power, voltage, total, output, temperature in batch.rows():
+            fields = []
+            if power == power:
+                fields.append("power=%r" % power)
+            if voltage == voltage:
+                fields.append("voltage=%r" % voltage)
+            if total == total:
+                fields.append("total=%r" % total)
+            if output == output:
+                fields.append("output=true" if output else "output=false")
+            if temperature == temperature:
+                fields.append("temperature=%r" % temperature)
+
+            if not fields:
+                continue
+
+            prefix = tags.get((host, channel))
+            if prefix is None:
+                prefix = tags[(host, channel)] = "{},host={},channel={} ".format(self.measurement, _escape_tag(host), channel)
+
+            lines.append("%s%s %d\n" % (prefix, ",".join(fields), timestamp * 1e9))
+
+        return "".join(lines).encode()
+
+
+class CsvSink(Sink):
+    """
+    CSV with a header line, fields a device does not report are left empty
+    """
+
+    def __start__(self, file, new):
+        if new:
+            file.write(",".join(("host", "channel", "timestamp") + FIELDS).encode() + b"\r\n")
+
+    def __encode__(self, batch):
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerows(
+            [value if value == value else "" for value in row]
+            for row in batch.rows()
+        )
+        return text.getvalue().encode()
+
+
+# file header: magic, version and record size
+BINARY_MAGIC = b"SHPYREAD"
+BINARY_HEADER = struct.Struct("<8sII")
+BINARY_VERSION = 1
+
+# timestamp, host id, channel, padding and FIELDS as float64, aligned for memory-mapping
+BINARY_RECORD = struct.Struct("<dIHH5d")
+
+# numpy description of a record, e.g. numpy.memmap(path, dtype=BINARY_DTYPE, offset=BINARY_HEADER.size)
+BINARY_DTYPE = [("timestamp", "<f8"), ("host", "<u4"), ("channel", "<u2"), ("padding", "<u2")] + \
+    [(field, "<f8") for field in FIELDS]
+
+
+class BinarySink(Sink):
+    """
+    append only fixed size records after a short header
+
+    host names are kept in a text file next to the records, path + ".hosts",
+    the host id of a record is the line number in it
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.__hosts__ = {}
+        self.__host_file__ = None
+
+    def __start__(self, file, new):
+        self.__hosts__ = {}
+
+        if not new and file.tell() < BINARY_HEADER.size:
+            # not even the header made it to disk
+            file.truncate(0)
+            new = True
+
+        if new:
+            file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size))
+            self.__host_file__ = open(self.path + ".hosts", "w")
+            return
+
+        # a record cut short by a crash would shift every following one
+        partial = (file.tell() - BINARY_HEADER.size) % BINARY_RECORD.size
+        if partial:
+            file.truncate(file.tell() - partial)
+
+        # host ids of the records already written stay valid
+        if os.path.exists(self.path + ".hosts"):
+            with open(self.path + ".hosts") as f:
+                for host in f.read().splitlines():
+                    self.__hosts__[host] = len(self.__hosts__)
+        self.__host_file__ = open(self.path + ".hosts", "a")
+
+    def __host__(self, host):
+        host_id = self.__hosts__.get(host)
+        if host_id is None:
+            host_id = self.__hosts__[host] = len(self.__hosts__)
+            self.__host_file__.write(host + "\n")
+        return host_id
+
+    def __encode__(self, batch):
+        data = bytearray(BINARY_RECORD.size * len(batch))
+
+        offset = 0
+        for row in batch.rows():
+            BINARY_RECORD.pack_into(data, offset, row[2], self.__host__(row[0]), row[1], 0, *row[3:])
+            offset += BINARY_RECORD.size
+
+        # the host ids have to be known before the records using them
+        self.__host_file__.flush()
+        return data
+
+    def __rotate__(self):
+        self.__host_file__.close()
+        self.__host_file__ = None
+        os.replace(self.path + ".hosts", "{}.{}.hosts".format(self.path, self.__sequence__ + 1))
+        super().__rotate__()
+
+    def close(self):
+        super().close()
+        if self.__host_file__ is not None:
+            self.__host_file__.close()
+            self.__host_file__ = None
+
+
+class BinaryReader:
+    """
+    memory-mapped view of a file written by BinarySink
+    """
+
+    def __init__(self, path):
+        with open(path + ".hosts") as f:
+            self.hosts = f.read().splitlines()
+
+        self.__file__ = open(path, "rb")
+        self.__map__ = mmap.mmap(self.__file__.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, size = BINARY_HEADER.unpack_from(self.__map__)
+        if magic != BINARY_MAGIC or size != BINARY_RECORD.size:
+            self.close()
+            raise ValueError("{} is not a readings file of version {}".format(path, BINARY_VERSION))
+
+        self.__view__ = memoryview(self.__map__)[BINARY_HEADER.size:]
+        # a record that is still being written is left out
+        self.__length__ = len(self.__view__) // BINARY_RECORD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.__length__
+
+    def __row__(self, record):
+        return (self.hosts[record[1]], record[2], record[0]) + record[4:]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.__length__
+        if not 0 <= index < self.__length__:
+            raise IndexError("record out of range")
+        return self.__row__(BINARY_RECORD.unpack_from(self.__view__, index * BINARY_RECORD.size))
+
+    def __iter__(self):
+        """iterate (host, channel, timestamp, *values) tuples"""
+        view = self.__view__[:self.__length__ * BINARY_RECORD.size]
+        for record in BINARY_RECORD.iter_unpack(view):
+            yield self.__row__(record)
+
+    def close(self):
+        if getattr(self, "__view__", None) is not None:
+            self.__view__.release()
+            self.__view__ = None
+        self.__map__.close()
+        self.__file__.close()
@@ -0,0 +1,249 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from threading import Lock
+from time import monotonic
+
+from .command import CommandSet
+from .config import RolloutSummary, applier, stages
+from .scheduler import FleetLimit, RequestScheduler
+from .wrapper import Shelly
+
+
+def _attach_limit(device, limit):
+    """share a fleet wide limit with an already created device, nothing happens without a limit"""
+    if limit is None:
+        return
+
+    if device.__scheduler__ is None:
+        device.__scheduler__ = RequestScheduler(limit=limit)
+    else:
+        device.__scheduler__.attach(limit)
+
+
+class FleetResult:
+    """
+    outcome of a fleet call for a single device
+    """
+
+    def __init__(self, host, device = None, result = None, error = None):
+        self.host = host
+        self.device = device
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "<FleetResult {} ok>".format(self.host)
+        return "<FleetResult {} {}>".format(self.host, type(self.error).__name__)
+
+
+class ShellyFleet:
+    """
+    concurrently addresses many devices at once
+    """
+
+    def __init__(self, hosts, **kwargs):
+        """
+        @param      hosts       iterable of IPs, (IP, port) tuples or already created device objects,
+                                devices are keyed by their (IP, port)
+        @param      workers     maximum amount of devices addressed at the same time
+        @param      max_inflight    schedule the requests of every device by priority,
+                                    with at most this many in flight over the whole fleet
+
+        every other argument is passed on to Shelly when a device is first used
+        """
+
+        self.__workers__ = kwargs.pop("workers", 16)
+        self.__kwargs__ = kwargs
+
+        max_inflight = kwargs.pop("max_inflight", None)
+        self.limit = FleetLimit(max_inflight) if max_inflight else None
+
+        self.__lock__ = Lock()
+        self.__executor__ = ThreadPoolExecutor(max_workers=self.__workers__)
+
+        # devices are created on first use, so detection happens concurrently as well
+        self.devices = {}
+        for host in hosts:
+            if isinstance(host, (str, tuple)):
+                self.devices[host] = None
+            else:
+                _attach_limit(host, self.limit)
+                # the same form as (IP, port) hosts, devices may share an IP
+                self.devices[(host.__ip__, host.__port__)] = host
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.devices)
+
+    @staticmethod
+    def __address__(host):
+        if isinstance(host, tuple):
+            return host
+        return host, "80"
+
+    def __device__(self, host):
+        device = self.devices.get(host)
+        if device is None:
+            kwargs = self.__kwargs__
+            if self.limit is not None:
+                kwargs = dict(kwargs, scheduler=RequestScheduler(limit=self.limit))
+
+            created = Shelly(*self.__address__(host), **kwargs)
+            with self.__lock__:
+                device = self.devices.get(host) or created
+                self.devices[host] = device
+
+            if device is not created and created.__session__ is not device.__session__:
+                # another call created the device first, this one is not used
+                created.close()
+
+        return device
+
+    def __run__(self, host, func):
+        device = None
+        try:
+            device = self.__device__(host)
+            return FleetResult(host, device, result=func(device))
+        except Exception as e:
+            return FleetResult(host, device, error=e)
+
+    def map(self, func, deadline = None, hosts = None):
+        """
+        @brief      call a function with every device concurrently
+
+        @param      func        callable taking a device
+        @param      deadline    seconds until unfinished devices are given up on
+        @param      hosts       only call it for these hosts
+
+        @return     generator of FleetResult in the order they finish
+        """
+        futures = {
+            self.__executor__.submit(self.__run__, host, func): host
+            for host in (self.devices if hosts is None else hosts)
+        }
+
+        end = None if deadline is None else monotonic() + deadline
+
+        return self.__results__(futures, end)
+
+    def __results__(self, futures, end):
+        yielded = set()
+        try:
+            # the deadline runs from the call, not from when results are first consumed
+            timeout = None if end is None else max(end - monotonic(), 0)
+
+            for future in as_completed(futures, timeout=timeout):
+                yielded.add(future)
+                yield future.result()
+        except TimeoutError:
+            for future, host in futures.items():
+                if future in yielded:
+                    continue
+
+                if future.done():
+                    # finished in time but not handed out before the deadline passed
+                    yield future.result()
+                else:
+                    # running requests are abandoned, they end with their own timeout
+                    future.cancel()
+                    yield FleetResult(host, self.devices.get(host), error=TimeoutError("deadline exceeded"))
+
+    def call(self, name, *args, **kwargs):
+        """
+        @brief      call a device method on every device
+
+        @param      name        method name, e.g. "status"
+        @param      deadline    seconds until unfinished devices are given up on
+
+        @return     generator of FleetResult in the order they finish
+        """
+        deadline = kwargs.pop("deadline", None)
+        return self.map(lambda device: getattr(device, name)(*args, **kwargs), deadline)
+
+    def post(self, page, values = None, deadline = None):
+        return self.call("post", page, values, deadline=deadline)
+
+    def status(self, deadline = None):
+        return self.call("status", deadline=deadline)
+
+    def settings(self, subpage = None, deadline = None):
+        return self.call("settings", subpage, deadline=deadline)
+
+    def relay(self, index, *args, **kwargs):
+        return self.call("relay", index, *args, **kwargs)
+
+    def roller(self, index, *args, **kwargs):
+        return self.call("roller", index, *args, **kwargs)
+
+    def light(self, index, *args, **kwargs):
+        return self.call("light", index, *args, **kwargs)
+
+    def prepare(self, *args, **kwargs):
+        """
+        @brief      build a command once for every generation in the fleet, see ShellyBase.prepare
+
+        @return     CommandSet for send
+        """
+        return CommandSet(*args, **kwargs)
+
+    def send(self, command, deadline = None, hosts = None):
+        """
+        @brief      send a prepared command to every device
+
+        @param      command     Command or CommandSet
+        @param      deadline    seconds until unfinished devices are given up on
+        @param      hosts       only send it to these hosts
+
+        @return     generator of FleetResult in the order they finish
+        """
+        return self.map(lambda device: device.send(command), deadline, hosts)
+
+    def apply_config(self, desired, **kwargs):
+        """
+        @brief      apply settings to every device in stages, sending only what differs
+
+        a canary stage goes first, the remaining devices follow in batches,
+        stages after too many failures are skipped
+
+        @param      desired     dict of settings, see ShellyBase.config_plan, or a function taking a device and returning it
+        @param      canary      amount of devices in the first stage
+        @param      batch       amount of devices per following stage, all remaining ones if None
+        @param      max_failures    failed devices tolerated before the remaining stages are skipped
+        @param      dry_run     only work out what would be sent
+        @param      deadline    seconds per stage until unfinished devices are given up on
+
+        @return     RolloutSummary
+        """
+        summary = RolloutSummary(kwargs.get("max_failures", 0))
+        apply = applier(desired, kwargs.get("dry_run", False))
+        planned = stages(list(self.devices), kwargs.get("canary", 1), kwargs.get("batch", None))
+
+        for index, hosts in enumerate(planned):
+            if summary.halted:
+                summary.skipped = [host for stage in planned[index:] for host in stage]
+                break
+
+            summary.stages += 1
+            for result in self.map(apply, kwargs.get("deadline", None), hosts):
+                summary.add(result)
+
+        return summary
+
+    def close(self):
+        """
+        @brief      stop the workers and close every device
+        """
+        self.__executor__.shutdown(wait=False, cancel_futures=True)
+
+        for device in self.devices.values():
+            if device is not None:
+                device.close()
@@ -1,20 +1,22 @@
-from sys import version_info
-
-if version_info.major == 3:
-    from json.decoder import JSONDecodeError
-else:
-    JSONDecodeError = ValueError
+from concurrent.futures import ThreadPoolExecutor
 
+from .base import ShellyBase
+from .command import Command, encode
+from .scheduler import CONTROL, SETTINGS, STATUS
 
-from requests import post
-from requests.auth import HTTPBasicAuth
+# pages that only read when no values are given
+READ_PAGES = ("shelly", "status", "settings", "meter", "emeter", "relay", "roller", "light", "color", "white")
 
-from .error import BadLogin, NotFound, BadResponse
+# pages that respond with the state of the channel
+STATE_PAGES = ("relay", "roller", "light", "color", "white")
 
-from .base import ShellyBase
+# settings subpages and the list holding them in the /settings response
+SETTINGS_LISTS = {"relay": "relays", "roller": "rollers", "light": "lights", "color": "lights", "white": "lights", "emeter": "emeters"}
 
 class ShellyGen1(ShellyBase):
 
+    __slots__ = ("relays", "rollers", "lights", "irs", "meters", "emeters")
+
     def __init__(self, ip, port = "80", *args, **kwargs):
         """
         @param      ip      the target IP of the shelly device. Can be a string, list of strings or list of integers
@@ -32,12 +34,25 @@ class ShellyGen1(ShellyBase):
         """
         @brief update the Shelly attributes
 
-        @param     index  index of the relay
+        settings and status are requested at the same time,
+        the status already contains the reading of every meter and emeter
         """
-        status = self.settings()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            settings = executor.submit(self.settings)
+            status = executor.submit(self.status)
 
+            self.__parse_settings__(settings.result())
+            self.__parse_status__(status.result())
+
+    def __parse_info__(self, info):
+        self.__type__ = info.get("type", self.__type__)
+        self.__mac__ = info.get("mac", self.__mac__)
+
+    def __parse_settings__(self, status):
+        """take over device information from a settings response"""
         self.__type__ = status['device'].get("type", self.__type__)
         self.__name__ = status['device'].get("hostname", self.__name__)
+        self.__mac__ = status['device'].get("mac", self.__mac__)
 
         # Settings are already fetched to get device information might as well put the list of things the device has somewhere
         self.relays = status.get("relays", [])
@@ -47,32 +62,82 @@ class ShellyGen1(ShellyBase):
 
         self.irs = status.get("light_sensor", None)
 
-        self.emeters = status.get("emeter", [])
+    def __parse_status__(self, status):
+        """take over meter readings from a status response"""
+        # one entry per channel, same content as meter/<index> and emeter/<index>
+        self.meters = status.get("meters", [])
+        self.emeters = status.get("emeters", [])
 
-        self.meters = []
-        meter_index = 0
-        # Meters are not returned as part of the settings
-        while True:
-            try:
-                # Request meter information
-                self.meter.append(self.meter(meter_index))
-                meter_index += 1
-            except:
-                break
+    def __send__(self, page, values = None, event = None):
+        """send a request over HTTP"""
+        url = self.__url__(page, values)
 
-    def post(self, page, values = None):
-        """
-        @brief      returns settings
+        # requests sends a (username, password) tuple as basic auth
+        response = self.__session__.post(url, auth=self.__credentials__,
+                                         timeout=self.__request_timeout__())
 
-        @param      page   page to be accesed. Use the Shelly HTTP API Reference to see whats possible
+        if event is not None:
+            event.status = response.status_code
+            event.bytes_out = len(url)
+            event.bytes_in = len(response.content)
 
-        @return     returns json response
-        """
+        self.__check_status__(response.status_code)
+
+        return self.__decode__(response.content)
+
+    def __is_read__(self, page, values):
+        return not values and page.split("/", 1)[0] in READ_PAGES
+
+    def __invalidate__(self, page, values, response):
+        root = page.split("/", 1)[0]
+
+        if root == "settings":
+            self.__cache__.evict(lambda cached, _: cached.startswith("settings"))
+        elif root in STATE_PAGES:
+            self.__cache__.evict(lambda cached, _: cached in ("status", page))
+
+            # relays, rollers and lights answer with their new state
+            if isinstance(response, dict):
+                self.__cache__.put(page, None, response)
+        else:
+            # anything else (reboot, ota, ...) may change everything
+            self.__cache__.clear()
+
+    def __coalesce__(self, page, values, later_page, later_values):
+        page, merged = super().__coalesce__(page, values, later_page, later_values)
 
-        url = "{}://{}:{}/{}?".format(self.__PROTOCOL__, self.__ip__, self.__port__, page)
+        # flip-back timers belong to the command they were given with
+        if "timer" not in later_values:
+            merged.pop("timer", None)
 
-        if values:
-            url += "&".join(["{}={}".format(key, value) for key, value in values.items()])
+        # a new position cancels an earlier open or close and the other way around
+        if "roller_pos" in later_values and "go" not in later_values:
+            merged.pop("go", None)
+        elif later_values.get("go", "to_pos") != "to_pos":
+            merged.pop("roller_pos", None)
+
+        return page, merged
+
+    def __priority__(self, page, values):
+        root = page.split("/", 1)[0]
+
+        if root in ("shelly", "settings"):
+            return SETTINGS
+        elif root in STATE_PAGES and values:
+            return CONTROL
+        elif self.__is_read__(page, values):
+            return STATUS
+        # reboot, ota and the like
+        return SETTINGS
+
+    def __url__(self, page, values = None):
+        """build the url for a page and its query values"""
+        if isinstance(values, Command):
+            target = values.query
+        else:
+            target = "{}?{}".format(page, encode(values))
+
+        url = "{}://{}:{}/{}".format(self.__PROTOCOL__, self.__ip__, self.__port__, target)
 
         if self.__debugging__:
             print("Target Adress: {}\n"
@@ -80,20 +145,7 @@ class ShellyGen1(ShellyBase):
                   "Timeout: {}"
                   "".format(url, any(self.__credentials__), self.__timeout__))
 
-        credentials = HTTPBasicAuth(*self.__credentials__)
-
-        response = post(url, auth=credentials,
-                        timeout=self.__timeout__)
-
-        if response.status_code == 401:
-            raise BadLogin()
-        elif response.status_code == 404:
-            raise NotFound("Not Found")
-
-        try:
-            return response.json()
-        except JSONDecodeError:
-            raise BadResponse("Bad JSON")
+        return url
 
     def status(self):
         """
@@ -111,12 +163,60 @@ class ShellyGen1(ShellyBase):
 
         @return     returns settings as a dict
         """
+        return self.post(*self.__settings_request__(subpage))
+
+    def __settings_request__(self, subpage = None, **values):
+        """build the page and values of a settings call, values are set on the page"""
+        page = "settings/" + subpage if subpage else "settings"
+
+        # the query wants lowercase booleans
+        return page, {
+            key: ("true" if value else "false") if isinstance(value, bool) else value
+            for key, value in values.items()
+        } or None
+
+    def __config_source__(self, target):
+        if target:
+            return "settings/" + target, None
+        return "settings", None
 
-        page = "settings"
-        if subpage:
-            page += "/" + subpage
+    def __config_of__(self, current, target):
+        if not target or target == "settings":
+            return current
 
-        return self.post(page)
+        name, _, index = target.partition("/")
+        try:
+            return current[SETTINGS_LISTS[name]][int(index)]
+        except (KeyError, IndexError, ValueError, TypeError):
+            return None
+
+    def __config_request__(self, target, values):
+        page, values = self.__settings_request__(None if target == "settings" else target, **values)
+        return page, values or {}
+
+    def __webhook_events__(self, config):
+        """output events of every channel in a /settings response"""
+        events = []
+        for index, _ in enumerate(config.get("relays") or []):
+            events += [("out_on", index), ("out_off", index)]
+        for index, _ in enumerate(config.get("rollers") or []):
+            events += [("roller_open", index), ("roller_close", index), ("roller_stop", index)]
+        for index, _ in enumerate(config.get("lights") or []):
+            events += [("out_on", index), ("out_off", index)]
+        return events
+
+    def __webhook_list__(self):
+        # action URLs are replaced, so there is nothing to look up first
+        return None
+
+    def __webhook_requests__(self, url, events, hooks):
+        return [
+            ("settings/actions", {
+                "index": index, "name": event + "_url", "enabled": "true",
+                "urls[]": "{}/{}/{}".format(url, event, index),
+            })
+            for event, index in events
+        ]
 
     def meter(self, index):
         """
@@ -137,6 +237,10 @@ class ShellyGen1(ShellyBase):
         @param      timer  a one-shot flip-back timer in seconds
         """
 
+        return self.__command__(*self.__relay_request__(index, **kwargs))
+
+    def __relay_request__(self, index, **kwargs):
+        """build the page and values of a relay call"""
         values = {}
 
         turn = kwargs.get("turn", None)
@@ -151,7 +255,7 @@ class ShellyGen1(ShellyBase):
         if timer:
             values["timer"] = timer
 
-        return self.post("relay/{}".format(index), values)
+        return "relay/{}".format(index), values
 
     def roller(self, index, *args, **kwargs):
         """
@@ -164,6 +268,10 @@ class ShellyGen1(ShellyBase):
         @param      duration    how long it will take to get to that position
         """
 
+        return self.__command__(*self.__roller_request__(index, **kwargs))
+
+    def __roller_request__(self, index, **kwargs):
+        """build the page and values of a roller call"""
         go = kwargs.get("go", None)
         roller_pos = kwargs.get("roller_pos", None)
         duration = kwargs.get("duration", None)
@@ -179,7 +287,7 @@ class ShellyGen1(ShellyBase):
         if duration is not None:
             values["duration"] = duration
 
-        return self.post("roller/{}".format(index), values)
+        return "roller/{}".format(index), values
 
     def light(self, index, *args, **kwargs):
         """
@@ -197,6 +305,10 @@ class ShellyGen1(ShellyBase):
         @param      temp        Color temperature in K, 3000..6500, only works if mode="white"
         @param      brightness  Brightness, 0..100, only works if mode="white"
         """
+        return self.__command__(*self.__light_request__(index, **kwargs))
+
+    def __light_request__(self, index, **kwargs):
+        """build the page and values of a light call"""
         mode = kwargs.get("mode", None)
         timer = kwargs.get("timer", None)
         turn = kwargs.get("turn", None)
@@ -243,7 +355,7 @@ class ShellyGen1(ShellyBase):
         if brightness is not None:
             values["brightness"] = self.__clamp_percentage__(brightness)
 
-        return self.post("light/{}".format(index), values)
+        return "light/{}".format(index), values
 
     def emeter(self, index, *args, **kwargs):
 
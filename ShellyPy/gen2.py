@@ -1,19 +1,34 @@
-from sys import version_info
-
-if version_info.major == 3:
-    from json.decoder import JSONDecodeError
-else:
-    JSONDecodeError = ValueError
-
-from requests import post
-from requests.auth import HTTPDigestAuth
-
 from .error import BadLogin, NotFound, BadResponse
 
+from .auth import ShellyDigestAuth
 from .base import ShellyBase
+from .command import Command
+from .metrics import GLOBAL_HOOKS
+from .scheduler import CONTROL, SETTINGS, STATUS
+from .snapshot import Snapshot
+
+# RPC namespaces that are not just the capitalized component name
+NAMESPACES = {
+    "wifi": "WiFi", "mqtt": "MQTT", "ble": "BLE", "ws": "WS", "ui": "UI", "ht_ui": "HT_UI",
+    "em": "EM", "em1": "EM1", "emdata": "EMData", "em1data": "EM1Data", "pm1": "PM1",
+    "devicepower": "DevicePower", "bthome": "BTHome",
+}
+
+# content type of requests sent as serialized JSON
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# webhook events announcing a new state, per component
+WEBHOOK_EVENTS = {
+    "switch": ("switch.on", "switch.off"),
+    "light": ("light.on", "light.off"),
+    "cover": ("cover.open", "cover.closed", "cover.stopped"),
+    "input": ("input.toggle_on", "input.toggle_off"),
+}
 
 class ShellyGen2(ShellyBase):
 
+    __slots__ = ("payload_id", "__batching__", "__auth__", "__snapshots__")
+
     def __init__(self, ip, port = "80", *args, **kwargs):
         """
         @param      ip      the target IP of the shelly device. Can be a string, list of strings or list of integers
@@ -25,18 +40,160 @@ class ShellyGen2(ShellyBase):
         """
 
         self.payload_id = 1
+
+        # None until it is known whether the firmware accepts JSON-RPC batches
+        self.__batching__ = None
+
+        # Snapshot per kind of snapshot, see changes
+        self.__snapshots__ = {}
+
+        # Gen2 devices only know the admin user,
+        # the challenge is kept around for every following request
+        login = kwargs.get("login", {})
+        self.__auth__ = ShellyDigestAuth("admin", login.get("password", ""))
+
         super().__init__(ip, port, *args, **kwargs)
         self.__generation__ = 2
 
     def update(self):
-        status = self.settings()
+        self.__parse_settings__(self.settings())
+
+    def __needs_update__(self):
+        # a /shelly response from detection already carries everything init would fetch
+        return not self.info
 
+    def __parse_info__(self, info):
+        self.__name__ = info.get("name") or self.__name__
+        self.__type__ = info.get("mac", self.__type__)
+        self.__mac__ = info.get("mac", self.__mac__)
+
+    def __parse_settings__(self, status):
+        """take over device information from a Sys.GetConfig response"""
         self.__name__ = status["device"].get("name", self.__name__)
         self.__type__ = status["device"].get("mac", self.__type__)
+        self.__mac__ = status["device"].get("mac", self.__mac__)
 
-    def post(self, page, values = None):
+    def __send__(self, page, values = None, event = None):
+        """send a RPC call over HTTP"""
+        payload, payload_id = self.__request__(page, values)
+
+        return self.__result__(self.__rpc__(payload, event), payload_id)
+
+    def __request__(self, page, values):
+        """JSON-RPC request of a call and its id, prepared Commands are already serialized"""
+        if not isinstance(values, Command):
+            payload = self.__payload__(page, values)
+            return payload, payload["id"]
+
+        self.payload_id += 1
+        payload_id = self.payload_id
+        return values.payload(payload_id), payload_id
+
+    def __rpc__(self, payload, event = None):
+        """send a JSON-RPC request object, a list of them or their serialized bytes and return the decoded response"""
         url = "{}://{}:{}/rpc".format(self.__PROTOCOL__, self.__ip__, self.__port__)
 
+        if isinstance(payload, bytes):
+            body = {"data": payload, "headers": JSON_HEADERS}
+        else:
+            body = {"json": payload}
+
+        response = self.__session__.post(url, auth=self.__auth__,
+                                         timeout=self.__request_timeout__(),
+                                         **body)
+
+        if event is not None:
+            event.status = response.status_code
+            event.bytes_out = len(response.request.body or b"")
+            event.bytes_in = len(response.content)
+            event.auth_retries = len(response.history)
+
+        self.__check_status__(response.status_code)
+
+        return self.__decode__(response.content)
+
+    def __batch_rpc__(self, payloads):
+        """send a JSON-RPC batch through the request hooks, the scheduler and the circuit breaker like a single call"""
+        if not self.__hooks__ and not GLOBAL_HOOKS:
+            return self.__scheduled_batch__(payloads, None)
+
+        event = self.__event_start__("batch")
+        try:
+            response = self.__scheduled_batch__(payloads, event)
+        except Exception as e:
+            self.__event_end__(event, e)
+            raise
+
+        self.__event_end__(event, None)
+        return response
+
+    def __scheduled_batch__(self, payloads, event):
+        """send a batch once the scheduler grants it a slot, batches are never shared like reads"""
+        if self.__scheduler__ is None:
+            return self.__guarded__(lambda: self.__rpc__(payloads, event))
+
+        return self.__scheduler__.run(self.__batch_priority__(payloads),
+                                      lambda: self.__guarded__(lambda: self.__rpc__(payloads, event)))
+
+    def __batch_priority__(self, payloads):
+        """a batch is a command if any of its calls writes, a status poll otherwise"""
+        if any(not self.__is_read__(payload["method"], payload.get("params")) for payload in payloads):
+            return CONTROL
+        return STATUS
+
+    def batch(self):
+        """
+        @brief      collect several RPC calls into a single request
+
+        use as a context manager, the calls are sent when the block is left
+
+        @return     ShellyGen2Batch
+        """
+        return ShellyGen2Batch(self)
+
+    def __channel__(self, page, values):
+        # Switch.Set and Switch.Toggle of the same switch share a channel
+        return "{}:{}".format(page.split(".", 1)[0], (values or {}).get("id"))
+
+    def __coalesce__(self, page, values, later_page, later_values):
+        page, merged = super().__coalesce__(page, values, later_page, later_values)
+
+        # flip-back timers belong to the command they were given with
+        if "toggle_after" not in later_values:
+            merged.pop("toggle_after", None)
+
+        return page, merged
+
+    def __priority__(self, page, values):
+        component, _, verb = page.partition(".")
+
+        if "Config" in verb or verb in ("GetDeviceInfo", "ListMethods", "GetComponents"):
+            return SETTINGS
+        elif component.lower() in ("sys", "wifi", "cloud", "mqtt") and verb != "GetStatus":
+            # reboots, updates and scans, namespaces are spelled like in NAMESPACES but devices ignore case
+            return SETTINGS
+        elif not self.__is_read__(page, values):
+            return CONTROL
+        return STATUS
+
+    def __is_read__(self, page, values):
+        verb = page.rpartition(".")[2]
+        return verb.startswith("Get") or verb.startswith("List")
+
+    def __invalidate__(self, page, values, response):
+        component = page.partition(".")[0]
+        index = (values or {}).get("id")
+
+        # Shelly.GetStatus and friends contain every component
+        self.__cache__.evict(
+            lambda cached, params: cached.startswith("Shelly.") or (
+                cached.partition(".")[0] == component and params.get("id") == index
+            )
+        )
+
+    def __payload__(self, page, values = None):
+        """build a JSON-RPC request object"""
+
         # increment payload id globally
         self.payload_id += 1
         # but keep a local copy around so we face no race conditions
@@ -51,26 +208,11 @@ class ShellyGen2(ShellyBase):
         if values:
             payload["params"] = values
 
-        credentials = None
-        try:
-            credentials = auth=HTTPDigestAuth('admin', self.__credentials__[1])
-        except IndexError:
-            pass
-
-        response = post(url, auth=credentials,
-                        json=payload,
-                        timeout=self.__timeout__)
-
-        if response.status_code == 401:
-            raise BadLogin()
-        elif response.status_code == 404:
-            raise NotFound("Not Found")
-
-        try:
-            response_data = response.json()
-        except JSONDecodeError:
-            raise BadResponse("Bad JSON")
+        return payload
 
+    @staticmethod
+    def __result__(response_data, payload_id):
+        """extract the result of a JSON-RPC response, raising on errors"""
         if "error" in response_data:
             error_code = response_data["error"].get("code", None)
             error_message = response_data["error"].get("message", "")
@@ -91,13 +233,159 @@ class ShellyGen2(ShellyBase):
         return self.post("Sys.GetStatus")
 
     def settings(self, subpage = None):
-        return self.post("Sys.GetConfig")
+        """
+        @brief      returns settings
+
+        @param      subpage component key, e.g. "switch:0" or "wifi", the system settings if None
+
+        @return     settings of the component as a dict
+        """
+        return self.post(*self.__settings_request__(subpage))
+
+    @staticmethod
+    def __component_key__(target):
+        """component key of a target, "switch/0" is accepted for "switch:0" as well"""
+        return target.replace("/", ":").lower()
+
+    def __component_method__(self, target, verb):
+        """RPC method and parameters of a component, e.g. ("Switch.GetConfig", {"id": 0})"""
+        name, _, index = self.__component_key__(target).partition(":")
+        method = "{}.{}".format(NAMESPACES.get(name, name.capitalize()), verb)
+        return method, ({"id": int(index)} if index else {})
+
+    def __settings_request__(self, subpage = None, **values):
+        """build the method and parameters of a settings call, values are set with SetConfig"""
+        if values:
+            return self.__config_request__(subpage or "sys", values)
+
+        if subpage is None:
+            return "Sys.GetConfig", None
+
+        method, params = self.__component_method__(subpage, "GetConfig")
+        return method, params or None
+
+    def __config_source__(self, target):
+        if target is None:
+            return "Shelly.GetConfig", None
+        return self.__settings_request__(target)
+
+    def __config_of__(self, current, target):
+        return current.get(self.__component_key__(target))
+
+    def __config_request__(self, target, values):
+        method, params = self.__component_method__(target, "SetConfig")
+        params["config"] = values
+        return method, params
+
+    def __webhook_events__(self, config):
+        """state events of every component in a Shelly.GetConfig response"""
+        events = []
+        for key in config:
+            name, _, index = key.partition(":")
+            if name in WEBHOOK_EVENTS and index.isdigit():
+                events += [(event, int(index)) for event in WEBHOOK_EVENTS[name]]
+        return events
+
+    def __webhook_list__(self):
+        return "Webhook.List", None
+
+    def __webhook_requests__(self, url, events, hooks):
+        existing = set()
+        for hook in (hooks or {}).get("hooks", []):
+            for target in hook.get("urls", []):
+                existing.add((hook.get("event"), hook.get("cid"), target))
+
+        requests = []
+        for event, index in events:
+            target = "{}/{}/{}".format(url, event, index)
+            if (event, index, target) not in existing:
+                requests.append(("Webhook.Create", {
+                    "cid": index, "event": event, "enable": True, "urls": [target], "name": "shellypy",
+                }))
+        return requests
+
+    def full_status(self):
+        """
+        @brief      status of every component in a single call
+
+        @return     dict of component key, e.g. "switch:0", to its status
+        """
+        return self.post("Shelly.GetStatus")
+
+    def components(self, include = ("status", "config"), keys = None):
+        """
+        @brief      every component of the device, requested page by page
+
+        @param      include what to return per component, "status" and/or "config"
+        @param      keys    list of component keys to limit the result to
+
+        @return     generator of dicts with the "key" of a component and the included parts
+        """
+        offset = 0
+        while offset is not None:
+            page = self.post("Shelly.GetComponents", self.__components_request__(offset, include, keys))
+            for component in page.get("components", []):
+                yield component
+            offset = self.__next_offset__(page, offset)
+
+    @staticmethod
+    def __components_request__(offset, include, keys):
+        values = {"offset": offset, "include": list(include)}
+        if keys is not None:
+            values["keys"] = list(keys)
+        return values
+
+    @staticmethod
+    def __next_offset__(page, offset):
+        """offset of the next Shelly.GetComponents page, None after the last one"""
+        amount = len(page.get("components", []))
+        if not amount or offset + amount >= page.get("total", 0):
+            return None
+        return offset + amount
+
+    @staticmethod
+    def __assemble__(components):
+        """turn Shelly.GetComponents entries into a dict keyed by component"""
+        return {
+            component["key"]: {name: part for name, part in component.items() if name != "key"}
+            for component in components
+        }
+
+    def snapshot(self, components = False):
+        """
+        @brief      the whole device as a single document
+
+        @param      components  use Shelly.GetComponents to include the configuration as well
+
+        @return     dict of component key to its status, or to its status and config
+        """
+        if components:
+            return self.__assemble__(self.components())
+        return self.full_status()
+
+    def changes(self, components = False):
+        """
+        @brief      take a new snapshot and compare it to the previous one
+
+        @param      components  see snapshot
+
+        @return     Delta of changed and removed paths, the first call reports everything
+        """
+        return self.__snapshot_of__(components).update(self.snapshot(components))
+
+    def __snapshot_of__(self, components):
+        if components not in self.__snapshots__:
+            self.__snapshots__[components] = Snapshot()
+        return self.__snapshots__[components]
 
     def meter(self, index):
         raise NotImplementedError("Unavailable")
 
     def relay(self, index, *args, **kwargs):
+        return self.__command__(*self.__relay_request__(index, **kwargs))
 
+    def __relay_request__(self, index, **kwargs):
+        """build the RPC method and parameters of a relay call"""
         values = {
             "id": index
         }
@@ -118,9 +406,13 @@ class ShellyGen2(ShellyBase):
         else:
             method = "Switch.GetStatus"
 
-        return self.post(method, values)
+        return method, values
 
     def roller(self, index, *args, **kwargs):
+        return self.__command__(*self.__roller_request__(index, **kwargs))
+
+    def __roller_request__(self, index, **kwargs):
+        """build the RPC method and parameters of a roller call"""
 
         go = kwargs.get("go", None)
         roller_pos = kwargs.get("roller_pos", None)
@@ -147,10 +439,163 @@ class ShellyGen2(ShellyBase):
         if duration is not None:
             values["duration"] = duration
 
-        return self.post(method, values)
+        return method, values
 
     def light(self, index, *args, **kwargs):
         raise NotImplementedError("Unavailable")
         
     def emeter(self, index, *args, **kwargs):
-        raise NotImplementedError("Unavailable")
\ No newline at end of file
+        raise NotImplementedError("Unavailable")
+
+
+class BatchCall:
+    """
+    placeholder for the result of a call inside of a batch
+    """
+
+    def __init__(self, method, values = None):
+        self.method = method
+        self.values = values
+
+        self.payload = None
+        self.__done__ = False
+        self.__result__ = None
+        self.__error__ = None
+
+    def __resolve__(self, result = None, error = None):
+        self.__done__ = True
+        self.__result__ = result
+        self.__error__ = error
+
+    def done(self):
+        return self.__done__
+
+    def result(self):
+        """
+        @brief      result of the call, raises the same exceptions as ShellyGen2.post
+
+        @return     RPC result
+        """
+        if not self.__done__:
+            raise RuntimeError("batch has not been sent yet")
+
+        if self.__error__ is not None:
+            raise self.__error__
+
+        return self.__result__
+
+
+class ShellyGen2Batch:
+    """
+    collects RPC calls and sends them as one JSON-RPC batch
+
+    devices that reject batches get the calls sent one after another
+    over the kept-alive connection instead
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.send()
+
+    def __len__(self):
+        return len(self.calls)
+
+    def post(self, page, values = None):
+        """
+        @brief      queue a RPC call
+
+        @return     BatchCall that holds the result once the batch is sent
+        """
+        call = BatchCall(page, values)
+        self.calls.append(call)
+        return call
+
+    def status(self):
+        return self.post("Sys.GetStatus")
+
+    def settings(self, subpage = None):
+        return self.post(*self.device.__settings_request__(subpage))
+
+    def relay(self, index, *args, **kwargs):
+        return self.post(*self.device.__relay_request__(index, **kwargs))
+
+    def roller(self, index, *args, **kwargs):
+        return self.post(*self.device.__roller_request__(index, **kwargs))
+
+    def __prepare__(self):
+        pending = [call for call in self.calls if not call.done()]
+
+        for call in pending:
+            call.payload = self.device.__payload__(call.method, call.values)
+
+        return pending
+
+    def __dispatch__(self, pending, response_data):
+        """
+        hand out the results of a batch response by payload id
+
+        @return     False if the device did not answer with a batch response
+        """
+        if not isinstance(response_data, list):
+            return False
+
+        responses = {}
+        for response in response_data:
+            if isinstance(response, dict):
+                responses[response.get("id")] = response
+
+        for call in pending:
+            response = responses.get(call.payload["id"])
+
+            try:
+                if response is None:
+                    raise BadResponse("no response for payload id {}".format(call.payload["id"]))
+
+                result = self.device.__result__(response, call.payload["id"])
+            except (BadLogin, NotFound, BadResponse) as e:
+                call.__resolve__(error=e)
+                continue
+
+            # reads are cached and writes evict what they changed, as if posted one by one
+            self.device.__cache_put__(call.method, call.values, result)
+            call.__resolve__(result=result)
+
+        return True
+
+    def send(self):
+        """
+        @brief      send every queued call
+
+        @return     list of BatchCall
+        """
+        pending = self.__prepare__()
+        if not pending:
+            return self.calls
+
+        if self.device.__batching__ is not False:
+            try:
+                response_data = self.device.__batch_rpc__([call.payload for call in pending])
+            except BadLogin as e:
+                for call in pending:
+                    call.__resolve__(error=e)
+                return self.calls
+            except (NotFound, BadResponse):
+                response_data = None
+
+            self.device.__batching__ = self.__dispatch__(pending, response_data)
+
+        if not self.device.__batching__:
+            for call in pending:
+                try:
+                    call.__resolve__(result=self.device.post(call.method, call.values))
+                except (BadLogin, NotFound, BadResponse) as e:
+                    call.__resolve__(error=e)
+
+        return self.calls
\ No newline at end of file
@@ -0,0 +1,195 @@
+from threading import Lock
+from time import monotonic
+
+from .error import BadLogin, BadResponse, CircuitOpen, NotFound
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# the device answered, these do not say anything about its health
+ANSWERED = (BadLogin, BadResponse, NotFound)
+
+
+class DeviceHealth:
+    """
+    round trip time estimate and circuit breaker of a single device
+
+    the timeout follows the measured round trip time like TCP does (RFC 6298),
+    after repeated failures requests fail right away until a cool-down passed,
+    then a single request probes whether the device is back
+    """
+
+    def __init__(self, failures = 3, cooldown = 10, max_cooldown = 300, min_timeout = 1, max_timeout = 5):
+        """
+        @param      failures        consecutive failures that open the circuit
+        @param      cooldown        seconds the circuit stays open before probing the device
+        @param      max_cooldown    upper bound of the cool-down, it doubles with every failed probe
+        @param      min_timeout     lower bound of the adaptive timeout
+        @param      max_timeout     upper bound of the adaptive timeout, used until the first answer
+        """
+        self.failures = failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+        # smoothed round trip time and its variation, None until the first answer
+        self.srtt = None
+        self.rttvar = None
+
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened = 0
+        self.rejected = 0
+
+        self.__backoff__ = 1
+        self.__retry_at__ = 0
+        self.__current_cooldown__ = cooldown
+        self.__probing__ = False
+        self.__lock__ = Lock()
+
+    def __repr__(self):
+        return "<DeviceHealth {} timeout {:.3f}>".format(self.current_state(), self.timeout())
+
+    def timeout(self):
+        """
+        @return     seconds to wait for the next answer
+        """
+        if self.srtt is None:
+            return self.max_timeout
+
+        timeout = (self.srtt + 4 * self.rttvar) * self.__backoff__
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def current_state(self):
+        """
+        @return     CLOSED, OPEN or HALF_OPEN
+        """
+        if self.state == OPEN and monotonic() >= self.__retry_at__:
+            return HALF_OPEN
+        return self.state
+
+    def available(self):
+        """
+        @brief      whether a request would be sent right now, for schedulers to skip broken devices
+        """
+        state = self.current_state()
+        return state == CLOSED or (state == HALF_OPEN and not self.__probing__)
+
+    def retry_in(self):
+        """
+        @return     seconds until the device is probed again, 0 if requests are sent
+        """
+        if self.state == CLOSED:
+            return 0
+        return max(self.__retry_at__ - monotonic(), 0)
+
+    def acquire(self):
+        """
+        @brief      take permission to send a request
+
+        raises CircuitOpen while the circuit is open or another request probes the device
+        """
+        with self.__lock__:
+            if self.state == CLOSED:
+                return
+
+            if monotonic() >= self.__retry_at__ and not self.__probing__:
+                self.state = HALF_OPEN
+                self.__probing__ = True
+                return
+
+            self.rejected += 1
+
+        raise CircuitOpen(self.retry_in())
+
+    def success(self, rtt):
+        """
+        @brief      record an answer
+
+        @param      rtt     seconds the request took
+        """
+        with self.__lock__:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+            self.state = CLOSED
+            self.consecutive = 0
+            self.__backoff__ = 1
+            self.__current_cooldown__ = self.cooldown
+            self.__probing__ = False
+
+    def failure(self):
+        """
+        @brief      record a request the device did not answer
+        """
+        with self.__lock__:
+            self.consecutive += 1
+            # like a TCP retransmission, wait longer for the next try
+            self.__backoff__ = min(self.__backoff__ * 2, 64)
+
+            if self.state == HALF_OPEN:
+                # the probe failed, stay away for longer
+                self.__current_cooldown__ = min(self.__current_cooldown__ * 2, self.max_cooldown)
+                self.__open__()
+            elif self.state == CLOSED and self.consecutive >= self.failures:
+                self.__open__()
+
+            self.__probing__ = False
+
+    def __open__(self):
+        self.state = OPEN
+        self.opened += 1
+        self.__retry_at__ = monotonic() + self.__current_cooldown__
+
+    def release(self):
+        """
+        @brief      give permission back without an outcome, for cancelled requests
+        """
+        with self.__lock__:
+            self.__probing__ = False
+
+    def record(self, rtt, error = None):
+        """
+        @brief      record the outcome of a request
+
+        @param      rtt     seconds the request took
+        @param      error   exception the request raised, if any
+        """
+        if error is None or isinstance(error, ANSWERED):
+            self.success(rtt)
+        elif not isinstance(error, CircuitOpen):
+            self.failure()
+
+    def reset(self):
+        """
+        @brief      close the circuit and forget the round trip time
+        """
+        with self.__lock__:
+            self.srtt = None
+            self.rttvar = None
+            self.state = CLOSED
+            self.consecutive = 0
+            self.__backoff__ = 1
+            self.__current_cooldown__ = self.cooldown
+            self.__probing__ = False
+
+    def stats(self):
+        """
+        @return     dict of state, timeout, round trip time and counters
+        """
+        return {
+            "state": self.current_state(),
+            "timeout": self.timeout(),
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "consecutive_failures": self.consecutive,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "retry_in": self.retry_in(),
+        }
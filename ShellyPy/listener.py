@@ -0,0 +1,164 @@
+"""
+shared part of the listeners devices report their state to
+
+what a device sends is matched to the added devices by its id or IP
+and handed to every subscriber
+"""
+import logging
+from asyncio import Queue, get_running_loop
+from threading import Lock
+
+# what is buffered per stream(), the oldest is dropped first
+QUEUE_SIZE = 256
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DeviceListener:
+    """
+    device registry and subscribers of CoIoTListener and WebhookReceiver
+
+    subclasses decode what they receive in feed, hand it to __receive__
+    and merge it into the cache of its device with __refresh__
+    """
+
+    def __init__(self, devices = None, refresh_cache = False):
+        """
+        @param      devices         list of devices to match what is received to
+        @param      refresh_cache   update the cached state of matched devices
+        """
+        self.refresh_cache = refresh_cache
+
+        # received data that could not be decoded
+        self.dropped = 0
+        # received from devices that were not added
+        self.unknown = 0
+
+        self.__ids__ = {}
+        self.__addresses__ = {}
+        self.__callbacks__ = []
+        self.__lock__ = Lock()
+
+        for device in devices or []:
+            self.add(device)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @staticmethod
+    def __device_id__(device):
+        """id a device reports with unless add() is given one"""
+        return device.__mac__
+
+    def add(self, device, device_id = None):
+        """
+        @brief      match what is received to a device
+
+        @param      device      device object
+        @param      device_id   id the device reports with, the MAC the device reported by default
+        """
+        device_id = device_id or self.__device_id__(device)
+
+        with self.__lock__:
+            if device_id:
+                self.__ids__[device_id.upper()] = device
+            self.__addresses__[device.__ip__] = device
+
+    def remove(self, device):
+        with self.__lock__:
+            self.__ids__ = {key: value for key, value in self.__ids__.items() if value is not device}
+            self.__addresses__.pop(device.__ip__, None)
+
+    def __lookup__(self, device_id):
+        """device added with an id, called with the lock held"""
+        return self.__ids__.get(device_id)
+
+    def __match__(self, received):
+        with self.__lock__:
+            device = self.__lookup__(received.device_id.upper())
+            if device is None:
+                device = self.__addresses__.get(received.address)
+        return device
+
+    @staticmethod
+    def __event__(received):
+        """name subscribers can filter on, None if what is received has none"""
+        return None
+
+    def subscribe(self, callback, event = None):
+        """
+        @brief      call a function for everything that is received
+
+        @param      callback    function taking what was received
+        @param      event       only call it for this event, e.g. "switch.on"
+        """
+        self.__callbacks__.append((callback, event))
+
+    def unsubscribe(self, callback):
+        self.__callbacks__ = [entry for entry in self.__callbacks__ if entry[0] is not callback]
+
+    def __receive__(self, received):
+        """
+        @brief      match what was decoded to its device and hand it to the subscribers
+
+        @param      received    decoded object or None if it could not be decoded
+
+        @return     the decoded object or None if it was dropped
+        """
+        if received is None:
+            self.dropped += 1
+            return None
+
+        received.device = self.__match__(received)
+        if received.device is None:
+            self.unknown += 1
+        elif self.refresh_cache and received.device.__cache__ is not None:
+            self.__refresh__(received)
+
+        event = self.__event__(received)
+        for callback, name in list(self.__callbacks__):
+            if name is None or name == event:
+                try:
+                    callback(received)
+                except Exception:
+                    # a failing callback must not keep the others from being called
+                    _LOGGER.exception("%s callback %r failed", type(self).__name__, callback)
+
+        return received
+
+    def __dispatch__(self, *args):
+        try:
+            self.feed(*args)
+        except Exception:
+            # a bad packet or call must not end the listener
+            _LOGGER.exception("%s could not handle what it received", type(self).__name__)
+
+    async def stream(self, event = None, queue_size = QUEUE_SIZE):
+        """
+        @brief      what is received as an async generator, start() the listener or feed() it
+
+        @param      event       only yield this event
+        @param      queue_size  amount buffered for a slow consumer, the oldest is dropped first
+
+        @return     async generator of what was received
+        """
+        loop = get_running_loop()
+        queue = Queue(queue_size)
+
+        def put(received):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(received)
+
+        def push(received):
+            loop.call_soon_threadsafe(put, received)
+
+        self.subscribe(push, event)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(push)
@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+# hooks called for requests of every device, see add_hook
+GLOBAL_HOOKS = []
+
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, float("inf"))
+
+
+class RequestEvent:
+    """
+    describes a single request to a device
+    """
+
+    __slots__ = (
+        "host", "generation", "page",
+        "start", "duration",
+        "bytes_out", "bytes_in", "status",
+        "auth_retries", "cached", "error",
+    )
+
+    def __init__(self, host, generation, page):
+        self.host = host
+        self.generation = generation
+        self.page = page
+
+        self.start = perf_counter()
+        self.duration = None
+
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.status = None
+        self.auth_retries = 0
+        self.cached = False
+        # exception type name of a failed request
+        self.error = None
+
+    def __repr__(self):
+        return "<RequestEvent {} {} {}>".format(self.host, self.page, self.error or self.status)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def add_hook(before = None, after = None):
+    """
+    @brief      register hooks for the requests of every device
+
+    @param      before  called with the RequestEvent before a request is sent
+    @param      after   called with the completed RequestEvent
+
+    @return     handle for remove_hook
+    """
+    hook = (before, after)
+    GLOBAL_HOOKS.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    GLOBAL_HOOKS.remove(hook)
+
+
+class EndpointStats:
+    """
+    latency histogram and error count of a single endpoint
+    """
+
+    __slots__ = ("count", "errors", "total", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, event):
+        self.count += 1
+        self.total += event.duration
+        self.buckets[bisect_left(BUCKETS, event.duration)] += 1
+        if event.error is not None:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        """
+        @brief      estimate a latency percentile from the histogram
+
+        @return     upper bound of the bucket the percentile falls in
+        """
+        if not self.count:
+            return None
+
+        target = fraction * self.count
+        seen = 0
+        for bound, amount in zip(BUCKETS, self.buckets):
+            seen += amount
+            if seen >= target:
+                return bound
+        return BUCKETS[-1]
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "error_rate": self.errors / self.count if self.count else 0.0,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+        }
+
+
+class MetricsAggregator:
+    """
+    collects latency histograms and error rates per device and endpoint
+
+    register it as an after hook, either globally or on single devices
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.__lock__ = Lock()
+
+    def __call__(self, event):
+        # served from the cache, the device was never asked
+        if event.cached:
+            return
+
+        key = (event.host, event.page)
+        with self.__lock__:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats()
+            stats.add(event)
+
+    def device(self, host):
+        """
+        @return     EndpointStats over every endpoint of a device
+        """
+        combined = EndpointStats()
+        with self.__lock__:
+            for (stats_host, _), stats in self.endpoints.items():
+                if stats_host != host:
+                    continue
+                combined.count += stats.count
+                combined.errors += stats.errors
+                combined.total += stats.total
+                combined.buckets = [a + b for a, b in zip(combined.buckets, stats.buckets)]
+        return combined
+
+    def hosts(self):
+        return sorted({host for host, _ in self.endpoints})
+
+    def slowest(self, amount = 10, fraction = 0.99):
+        """
+        @brief      devices with the highest latency percentile
+
+        @return     list of (host, seconds) tuples
+        """
+        latencies = [(host, self.device(host).percentile(fraction)) for host in self.hosts()]
+        return sorted(latencies, key=lambda item: item[1], reverse=True)[:amount]
+
+    def flakiest(self, amount = 10):
+        """
+        @brief      devices with the highest error rate
+
+        @return     list of (host, error rate) tuples
+        """
+        rates = []
+        for host in self.hosts():
+            stats = self.device(host)
+            rates.append((host, stats.errors / stats.count))
+        return sorted(rates, key=lambda item: item[1], reverse=True)[:amount]
+
+    def stats(self):
+        """
+        @return     dict of host to dict of endpoint to summary
+        """
+        result = {}
+        with self.__lock__:
+            for (host, page), stats in self.endpoints.items():
+                result.setdefault(host, {})[page] = stats.as_dict()
+        return result
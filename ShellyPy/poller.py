@@ -0,0 +1,274 @@
+from array import array
+from asyncio import ensure_future, sleep as async_sleep
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep, time
+
+NAN = float("nan")
+
+FIELDS = ("timestamp", "power", "voltage", "total")
+
+Reading = namedtuple("Reading", ("host", "channel") + FIELDS)
+
+
+class RingBuffer:
+    """
+    fixed capacity buffer backed by an array, the oldest value is overwritten when full
+    """
+
+    def __init__(self, capacity, typecode = "d"):
+        self.capacity = capacity
+        self.__data__ = array(typecode, [0]) * capacity
+        self.__start__ = 0
+        self.__size__ = 0
+
+    def __len__(self):
+        return self.__size__
+
+    def append(self, value):
+        end = (self.__start__ + self.__size__) % self.capacity
+        self.__data__[end] = value
+
+        if self.__size__ < self.capacity:
+            self.__size__ += 1
+        else:
+            self.__start__ = (self.__start__ + 1) % self.capacity
+
+    def __iter__(self):
+        """iterate from the oldest to the newest value"""
+        for i in range(self.__size__):
+            yield self.__data__[(self.__start__ + i) % self.capacity]
+
+    def latest(self):
+        if not self.__size__:
+            raise IndexError("buffer is empty")
+        return self.__data__[(self.__start__ + self.__size__ - 1) % self.capacity]
+
+    def values(self):
+        """
+        @return     array of every value from the oldest to the newest
+        """
+        end = self.__start__ + self.__size__
+        if end <= self.capacity:
+            return self.__data__[self.__start__:end]
+        return self.__data__[self.__start__:] + self.__data__[:end - self.capacity]
+
+    def clear(self):
+        self.__start__ = 0
+        self.__size__ = 0
+
+
+class ReadingBuffer:
+    """
+    one ring buffer per field of the readings of a single channel
+    """
+
+    def __init__(self, capacity):
+        self.columns = {field: RingBuffer(capacity) for field in FIELDS}
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def append(self, reading):
+        for field in FIELDS:
+            self.columns[field].append(getattr(reading, field))
+
+
+def host_of(device):
+    """
+    @brief      key of a device in readings and counters
+
+    devices on the same IP are told apart by their port
+
+    @return     "ip:port" string
+    """
+    return "{}:{}".format(device.__ip__, device.__port__)
+
+
+def extract(device, source, response):
+    """
+    @brief      take power, voltage and total out of a meter response
+
+    @param      device      device the response came from
+    @param      source      "meter" or "emeter"
+    @param      response    response dict
+
+    @return     tuple of power, voltage and total, NaN for what the device does not report
+    """
+    if device.__generation__ == 1:
+        return (
+            response.get("power", NAN),
+            response.get("voltage", NAN),
+            response.get("total", NAN),
+        )
+
+    if source == "emeter":
+        return (
+            response.get("act_power", NAN),
+            response.get("voltage", NAN),
+            NAN,
+        )
+
+    return (
+        response.get("apower", NAN),
+        response.get("voltage", NAN),
+        response.get("aenergy", {}).get("total", NAN),
+    )
+
+
+def request(device, source, channel):
+    """
+    @brief      request a reading, returns a coroutine for async devices
+    """
+    if device.__generation__ == 1:
+        return getattr(device, source)(channel)
+
+    # Gen2 devices report power as part of the switch or EM1 status
+    if source == "emeter":
+        return device.post("EM1.GetStatus", {"id": channel})
+    return device.post("Switch.GetStatus", {"id": channel})
+
+
+class MeterPoller:
+    """
+    samples meters and emeters of many devices at a fixed rate
+    """
+
+    def __init__(self, devices, interval = 1.0, capacity = 3600, source = "meter", channels = (0,), workers = 32):
+        """
+        @param      devices     device or list of devices, async devices for stream()
+        @param      interval    seconds between samples
+        @param      capacity    readings kept per channel, older ones are overwritten
+        @param      source      "meter" or "emeter"
+        @param      channels    channel indices to sample on every device
+        @param      workers     maximum amount of concurrent requests for run()
+        """
+        if not isinstance(devices, (list, tuple)):
+            devices = [devices]
+
+        self.devices = list(devices)
+        self.interval = interval
+        self.source = source
+        self.channels = tuple(channels)
+        self.workers = workers
+
+        # keyed by host_of(device) and channel
+        self.buffers = {
+            (host_of(device), channel): ReadingBuffer(capacity)
+            for device in self.devices
+            for channel in self.channels
+        }
+
+        # ticks the whole poller fell behind on
+        self.missed_ticks = 0
+        # samples skipped per device because the previous one was still running
+        self.missed = {host_of(device): 0 for device in self.devices}
+        self.errors = {host_of(device): 0 for device in self.devices}
+
+    def __tasks__(self):
+        for device in self.devices:
+            host = host_of(device)
+            for channel in self.channels:
+                yield device, host, channel
+
+    def __record__(self, device, host, channel, response):
+        reading = Reading(host, channel, time(), *extract(device, self.source, response))
+        self.buffers[(host, channel)].append(reading)
+        return reading
+
+    def __sample__(self, device, host, channel):
+        try:
+            return self.__record__(device, host, channel, request(device, self.source, channel))
+        except Exception:
+            self.errors[host] += 1
+            return None
+
+    def __schedule__(self, start, tick):
+        """
+        @brief      find the next tick, ticks that already passed are counted as missed
+
+        @return     tuple of the next tick number and the seconds until it
+        """
+        tick += 1
+        delay = start + tick * self.interval - monotonic()
+
+        if delay < 0:
+            behind = int(-delay // self.interval) + 1
+            self.missed_ticks += behind
+            tick += behind
+            delay += behind * self.interval
+
+        return tick, delay
+
+    def run(self, ticks = None):
+        """
+        @brief      poll on a fixed schedule that does not drift with request time
+
+        @param      ticks   amount of ticks to run for, None runs forever
+
+        @return     generator of a list of the Readings finished during each tick
+        """
+        busy = {}
+        completed = deque()
+        start = monotonic()
+        tick = 0
+
+        def done(future):
+            if future.result() is not None:
+                completed.append(future.result())
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while ticks is None or tick < ticks:
+                for device, host, channel in self.__tasks__():
+                    previous = busy.get((host, channel))
+                    if previous is not None and not previous.done():
+                        # slow devices are skipped until their last request finished
+                        self.missed[host] += 1
+                        continue
+
+                    future = executor.submit(self.__sample__, device, host, channel)
+                    future.add_done_callback(done)
+                    busy[(host, channel)] = future
+
+                tick, delay = self.__schedule__(start, tick)
+                sleep(delay)
+
+                yield [completed.popleft() for _ in range(len(completed))]
+
+    async def stream(self, ticks = None):
+        """
+        @brief      async version of run for async devices
+
+        @return     async generator of a list of the Readings finished during each tick
+        """
+        busy = {}
+        completed = deque()
+        start = monotonic()
+        tick = 0
+
+        async def sample(device, host, channel):
+            try:
+                completed.append(self.__record__(device, host, channel, await request(device, self.source, channel)))
+            except Exception:
+                self.errors[host] += 1
+
+        try:
+            while ticks is None or tick < ticks:
+                for device, host, channel in self.__tasks__():
+                    previous = busy.get((host, channel))
+                    if previous is not None and not previous.done():
+                        self.missed[host] += 1
+                        continue
+
+                    busy[(host, channel)] = ensure_future(sample(device, host, channel))
+
+                tick, delay = self.__schedule__(start, tick)
+                await async_sleep(delay)
+
+                yield [completed.popleft() for _ in range(len(completed))]
+        finally:
+            for task in busy.values():
+                task.cancel()
@@ -0,0 +1,279 @@
+import json
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition
+
+# priority classes, lower is sent first
+CONTROL = 0
+STATUS = 1
+SETTINGS = 2
+
+
+class Ticket:
+    """
+    a request waiting for or holding a slot
+    """
+
+    __slots__ = ("priority", "key", "granted", "cancelled", "done", "result", "error", "wake", "followers")
+
+    def __init__(self, priority, key = None, wake = None):
+        self.priority = priority
+        self.key = key
+        self.granted = False
+        self.cancelled = False
+        self.done = False
+        self.result = None
+        self.error = None
+        # called once a slot is granted
+        self.wake = wake
+        # (loop, future) of async requests waiting for the result of this one
+        self.followers = []
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FleetLimit:
+    """
+    caps the requests in flight over many devices
+
+    free slots go to the most urgent priority class first,
+    devices waiting in the same class take turns
+    """
+
+    def __init__(self, max_inflight = None):
+        """
+        @param      max_inflight    maximum amount of requests in flight over every device, None for no limit
+        """
+        self.max_inflight = max_inflight
+        self.inflight = 0
+
+        self.condition = Condition()
+        self.__schedulers__ = []
+        self.__turn__ = 0
+
+    def register(self, scheduler):
+        with self.condition:
+            if scheduler not in self.__schedulers__:
+                self.__schedulers__.append(scheduler)
+
+    def dispatch(self):
+        """grant free slots, the condition has to be held"""
+        while self.max_inflight is None or self.inflight < self.max_inflight:
+            candidates = [
+                (index, scheduler) for index, scheduler in enumerate(self.__schedulers__)
+                if scheduler.__ready__()
+            ]
+            if not candidates:
+                break
+
+            best = min(scheduler.__head__().priority for _, scheduler in candidates)
+            total = len(self.__schedulers__)
+
+            index, scheduler = min(
+                ((index, scheduler) for index, scheduler in candidates if scheduler.__head__().priority == best),
+                key=lambda item: (item[0] - self.__turn__) % total
+            )
+
+            self.__turn__ = (index + 1) % total
+            self.inflight += 1
+            scheduler.__grant__()
+
+        self.condition.notify_all()
+
+
+class RequestScheduler:
+    """
+    queues the requests of a single device by priority
+
+    requests beyond max_inflight wait, control requests are sent before
+    status polls and those before settings, reads that are already
+    queued or in flight are not sent again but share the result
+    """
+
+    def __init__(self, max_inflight = 1, limit = None):
+        """
+        @param      max_inflight    maximum amount of requests in flight to the device
+        @param      limit           FleetLimit shared with the schedulers of other devices
+        """
+        self.max_inflight = max_inflight
+        self.inflight = 0
+
+        self.sent = 0
+        self.deduplicated = 0
+        self.waited = 0
+
+        self.__queue__ = []
+        self.__order__ = count()
+        self.__reads__ = {}
+
+        self.limit = None
+        self.attach(limit or FleetLimit())
+
+    def attach(self, limit):
+        """
+        @brief      share a fleet wide limit with other devices
+        """
+        self.limit = limit
+        limit.register(self)
+
+    @staticmethod
+    def key(page, values):
+        """key of a read, identical reads share it"""
+        if not values:
+            return page, None
+        return page, json.dumps(values, sort_keys=True)
+
+    def __head__(self):
+        while self.__queue__ and self.__queue__[0][2].cancelled:
+            heappop(self.__queue__)
+        return self.__queue__[0][2] if self.__queue__ else None
+
+    def __ready__(self):
+        return self.inflight < self.max_inflight and self.__head__() is not None
+
+    def __grant__(self):
+        ticket = heappop(self.__queue__)[2]
+        ticket.granted = True
+        self.inflight += 1
+        if ticket.wake is not None:
+            ticket.wake()
+
+    def __enqueue__(self, priority, key, wake = None):
+        ticket = Ticket(priority, key, wake)
+        heappush(self.__queue__, (priority, next(self.__order__), ticket))
+
+        if key is not None:
+            self.__reads__[key] = ticket
+
+        self.limit.dispatch()
+        if not ticket.granted:
+            self.waited += 1
+
+        return ticket
+
+    def __finish__(self, ticket):
+        with self.limit.condition:
+            ticket.done = True
+            self.inflight -= 1
+            self.limit.inflight -= 1
+            self.sent += 1
+
+            if ticket.key is not None and self.__reads__.get(ticket.key) is ticket:
+                del self.__reads__[ticket.key]
+
+            for loop, future in ticket.followers:
+                loop.call_soon_threadsafe(_resolve, future)
+
+            self.limit.dispatch()
+
+    def __forget__(self, ticket):
+        """drop a ticket that was given up on"""
+        with self.limit.condition:
+            if ticket.granted:
+                self.inflight -= 1
+                self.limit.inflight -= 1
+            else:
+                ticket.cancelled = True
+
+            # requests sharing it fail instead of waiting forever or getting None
+            ticket.error = ticket.error or RuntimeError("request was cancelled")
+            ticket.done = True
+
+            if ticket.key is not None and self.__reads__.get(ticket.key) is ticket:
+                del self.__reads__[ticket.key]
+
+            for loop, future in ticket.followers:
+                loop.call_soon_threadsafe(_resolve, future)
+
+            self.limit.dispatch()
+
+    def run(self, priority, func, key = None):
+        """
+        @brief      wait for a slot and call func in it
+
+        @param      priority    CONTROL, STATUS or SETTINGS
+        @param      func        function sending the request
+        @param      key         key of a read, see key(), None for writes
+
+        @return     result of func
+        """
+        condition = self.limit.condition
+
+        with condition:
+            leader = self.__reads__.get(key) if key is not None else None
+            if leader is not None:
+                self.deduplicated += 1
+                condition.wait_for(lambda: leader.done)
+                return leader.outcome()
+
+            ticket = self.__enqueue__(priority, key)
+            condition.wait_for(lambda: ticket.granted)
+
+        try:
+            ticket.result = func()
+        except Exception as e:
+            ticket.error = e
+        finally:
+            self.__finish__(ticket)
+
+        return ticket.outcome()
+
+    async def arun(self, priority, func, key = None):
+        """
+        @brief      async version of run
+
+        @param      func        function returning the awaitable sending the request
+        """
+        # asyncio is already loaded when this runs, importing it at the top slows down import ShellyPy
+        from asyncio import get_running_loop
+        loop = get_running_loop()
+        future = loop.create_future()
+
+        with self.limit.condition:
+            leader = self.__reads__.get(key) if key is not None else None
+            if leader is not None:
+                self.deduplicated += 1
+                leader.followers.append((loop, future))
+            else:
+                ticket = self.__enqueue__(priority, key, lambda: loop.call_soon_threadsafe(_resolve, future))
+
+        if leader is not None:
+            await future
+            return leader.outcome()
+
+        try:
+            await future
+        except BaseException:
+            self.__forget__(ticket)
+            raise
+
+        try:
+            ticket.result = await func()
+        except Exception as e:
+            ticket.error = e
+        except BaseException:
+            self.__forget__(ticket)
+            raise
+
+        self.__finish__(ticket)
+        return ticket.outcome()
+
+    def stats(self):
+        """
+        @return     dict of sent, deduplicated and queued requests and the amount that had to wait
+        """
+        return {
+            "sent": self.sent,
+            "deduplicated": self.deduplicated,
+            "waited": self.waited,
+            "queued": len([entry for entry in self.__queue__ if not entry[2].cancelled]),
+            "inflight": self.inflight,
+        }
@@ -0,0 +1,676 @@
+"""
+local Gen1 and Gen2 device simulator for tests and benchmarks
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import socket
+import struct
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from urllib.parse import parse_qsl, urlsplit
+from urllib.request import urlopen
+
+from requests.utils import parse_dict_header
+
+
+# appended to Sec-WebSocket-Key before hashing it into Sec-WebSocket-Accept
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+WS_TEXT = 0x1
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+
+def _ws_frame(opcode, payload = b""):
+    """an unmasked WebSocket frame, as sent by servers"""
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", len(payload))
+    else:
+        header += bytes([127]) + struct.pack("!Q", len(payload))
+    return header + payload
+
+
+def _ws_read(file):
+    """
+    @brief      read a WebSocket frame sent by a client
+
+    @return     tuple of opcode and unmasked payload, None once the connection is closed
+    """
+    head = file.read(2)
+    if len(head) < 2:
+        return None
+
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", file.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", file.read(8))[0]
+
+    mask = file.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+    payload = file.read(length)
+    if len(payload) < length:
+        return None
+
+    return head[0] & 0x0F, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, simulator):
+        self.simulator = simulator
+        self.__active__ = set()
+        self.__lock__ = Lock()
+        super().__init__(address, handler)
+
+    def verify_request(self, request, client_address):
+        # devices only handle a handful of connections, the rest get dropped
+        limit = self.simulator.max_connections
+        with self.__lock__:
+            if limit is not None and len(self.__active__) >= limit:
+                self.simulator.rejected += 1
+                return False
+            self.__active__.add(request)
+            self.simulator.connections += 1
+        return True
+
+    def shutdown_request(self, request):
+        with self.__lock__:
+            self.__active__.discard(request)
+        super().shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        # clients hanging up early, e.g. after their timeout, are expected
+        pass
+
+    def drop_connections(self):
+        """close kept-alive connections, like a device going offline"""
+        with self.__lock__:
+            active = list(self.__active__)
+
+        for request in active:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def __reply__(self, status, data = None, headers = None):
+        body = b"" if data is None else json.dumps(data).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __handle__(self):
+        simulator = self.server.simulator
+
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            return self.__websocket__()
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        simulator.requests += 1
+        simulator.__delay__()
+
+        if simulator.__fail__():
+            # drop the connection without an answer
+            self.close_connection = True
+            return
+
+        url = urlsplit(self.path)
+        page = url.path.strip("/")
+
+        if page == "shelly":
+            return self.__reply__(200, simulator.shelly())
+
+        if not simulator.__authorized__(self.command, self.path, self.headers.get("Authorization")):
+            return self.__reply__(401, headers={"WWW-Authenticate": simulator.__challenge__()})
+
+        if simulator.gen == 1:
+            status, data = simulator.gen1(page, dict(parse_qsl(url.query)))
+        elif page == "rpc":
+            try:
+                status, data = 200, simulator.rpc(json.loads(body or b"{}"))
+            except ValueError:
+                status, data = 400, None
+        else:
+            status, data = 404, None
+
+        self.__reply__(status, data)
+
+    do_GET = __handle__
+    do_POST = __handle__
+
+    def __websocket__(self):
+        """answer JSON-RPC frames over a WebSocket until the client hangs up, Gen2 only"""
+        simulator = self.server.simulator
+
+        if simulator.gen == 1 or urlsplit(self.path).path != "/rpc":
+            return self.__reply__(404)
+
+        accept = hashlib.sha1((self.headers.get("Sec-WebSocket-Key", "") + WEBSOCKET_GUID).encode()).digest()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", base64.b64encode(accept).decode())
+        self.end_headers()
+        self.wfile.flush()
+
+        # replies and notifications are written from different threads
+        self.__write_lock__ = Lock()
+        self.__src__ = None
+        self.close_connection = True
+
+        simulator.__sockets__.append(self)
+        try:
+            while True:
+                frame = _ws_read(self.rfile)
+                if frame is None:
+                    break
+
+                opcode, payload = frame
+                if opcode == WS_CLOSE:
+                    self.__send_frame__(WS_CLOSE, payload[:2])
+                    break
+                elif opcode == WS_PING:
+                    self.__send_frame__(WS_PONG, payload)
+                elif opcode == WS_TEXT:
+                    self.__frame__(payload)
+        except OSError:
+            pass
+        finally:
+            simulator.__sockets__.remove(self)
+
+    def __frame__(self, payload):
+        simulator = self.server.simulator
+
+        try:
+            request = json.loads(payload)
+        except ValueError:
+            return
+
+        # notifications go to the source of the latest frame
+        self.__src__ = request.get("src", self.__src__)
+
+        simulator.requests += 1
+        simulator.__delay__()
+
+        if simulator.__fail__():
+            return
+
+        if simulator.__frame_authorized__(request.get("auth")):
+            response = simulator.rpc(request)
+        else:
+            response = {"id": request.get("id"), "src": simulator.id, "error": {
+                "code": 401, "message": json.dumps(simulator.__frame_challenge__()),
+            }}
+
+        response["dst"] = self.__src__
+        self.__send_frame__(WS_TEXT, json.dumps(response).encode("utf-8"))
+
+    def __send_frame__(self, opcode, payload):
+        with self.__write_lock__:
+            self.wfile.write(_ws_frame(opcode, payload))
+            self.wfile.flush()
+
+    def __notify__(self, method, params):
+        """push a notification frame, once the client sent a frame with its source"""
+        if self.__src__ is None:
+            return
+
+        frame = {"src": self.server.simulator.id, "dst": self.__src__, "method": method, "params": params}
+        try:
+            self.__send_frame__(WS_TEXT, json.dumps(frame).encode("utf-8"))
+        except OSError:
+            pass
+
+
+class ShellySimulator:
+    """
+    HTTP server that answers like a Gen1 or Gen2 device
+
+    Gen2 also answers JSON-RPC frames over a WebSocket on /rpc,
+    with the 401 challenge frame and NotifyStatus pushes of a device
+    """
+
+    def __init__(self, gen = 1, host = "127.0.0.1", port = 0, **kwargs):
+        """
+        @param      gen             generation to simulate, 1 or 2
+        @param      host            address to listen on
+        @param      port            port to listen on, 0 picks a free one
+        @param      login           dict with "username" and "password", Basic auth on Gen1 and Digest auth on Gen2
+        @param      latency         seconds every response is delayed by
+        @param      jitter          random seconds added to or removed from the latency
+        @param      max_connections connections beyond this are dropped right away
+        @param      failure_rate    probability of dropping a request without an answer
+        @param      relays          amount of relays (switches on Gen2)
+        @param      emeters         amount of emeters
+        @param      nonce_lifetime  seconds until a digest nonce goes stale
+        @param      seed            seed of the random generator
+        @param      page_size       components per Shelly.GetComponents page
+        """
+        self.gen = gen
+        self.host = host
+
+        self.login = kwargs.get("login", None)
+        self.latency = kwargs.get("latency", 0)
+        self.jitter = kwargs.get("jitter", 0)
+        self.max_connections = kwargs.get("max_connections", None)
+        self.failure_rate = kwargs.get("failure_rate", 0)
+        self.nonce_lifetime = kwargs.get("nonce_lifetime", 60)
+        self.page_size = kwargs.get("page_size", 5)
+
+        self.random = random.Random(kwargs.get("seed", None))
+
+        self.mac = os.urandom(6).hex().upper()
+        self.model = "SHSW-25" if gen == 1 else "SNSW-102P16EU"
+        self.id = "shellysim-{}".format(self.mac.lower())
+        self.name = kwargs.get("name", self.id)
+
+        self.relays = [
+            {"ison": False, "timer": 0, "power": 10.0 * (index + 1), "total": 0.0, "config": {"name": None, "auto_off": 0}}
+            for index in range(kwargs.get("relays", 1))
+        ]
+        self.emeters = [
+            {"power": 100.0, "voltage": 230.0, "total": 0.0}
+            for index in range(kwargs.get("emeters", 0))
+        ]
+        self.config = {"name": self.name}
+        # registered action URLs and webhooks as (event, channel, url)
+        self.webhooks = []
+        # handlers of open WebSockets
+        self.__sockets__ = []
+
+        self.requests = 0
+        self.connections = 0
+        self.rejected = 0
+        self.challenges = 0
+
+        self.__nonce__ = None
+        self.__nonce_time__ = 0
+        self.__lock__ = Lock()
+
+        self.__server__ = SimulatorServer((host, port), SimulatorHandler, self)
+        self.__thread__ = None
+
+    @property
+    def port(self):
+        return self.__server__.server_address[1]
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.__thread__ = Thread(target=self.__server__.serve_forever, daemon=True)
+        self.__thread__.start()
+        return self
+
+    def stop(self):
+        self.__server__.shutdown()
+        self.__server__.server_close()
+        self.__server__.drop_connections()
+
+    def __delay__(self):
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            sleep(delay)
+
+    def __fail__(self):
+        return self.failure_rate and self.random.random() < self.failure_rate
+
+    def __digest__(self, data):
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def __challenge__(self):
+        self.challenges += 1
+
+        if self.gen == 1:
+            return 'Basic realm="{}"'.format(self.id)
+
+        return 'Digest qop="auth", realm="{}", nonce="{}", algorithm=SHA-256'.format(self.id, self.__current_nonce__())
+
+    def __current_nonce__(self):
+        with self.__lock__:
+            if self.__nonce__ is None or monotonic() - self.__nonce_time__ > self.nonce_lifetime:
+                self.__nonce__ = str(int(time()))
+                self.__nonce_time__ = monotonic()
+            return self.__nonce__
+
+    def __frame_challenge__(self):
+        """challenge sent as the message of a 401 error to frames over a WebSocket"""
+        self.challenges += 1
+        return {"auth_type": "digest", "nonce": int(self.__current_nonce__()), "nc": 1, "realm": self.id, "algorithm": "SHA-256"}
+
+    def __frame_authorized__(self, auth):
+        """check the auth member of a frame, computed with a dummy method and uri"""
+        if not self.login:
+            return True
+
+        if not isinstance(auth, dict):
+            return False
+
+        with self.__lock__:
+            fresh = str(auth.get("nonce")) == self.__nonce__ and monotonic() - self.__nonce_time__ <= self.nonce_lifetime
+
+        if not fresh:
+            return False
+
+        ha1 = self.__digest__("admin:{}:{}".format(self.id, self.login.get("password", "")))
+        ha2 = self.__digest__("dummy_method:dummy_uri")
+        response = self.__digest__("{}:{}:1:{}:auth:{}".format(ha1, auth.get("nonce"), auth.get("cnonce"), ha2))
+
+        return auth.get("response") == response
+
+    def __authorized__(self, method, path, header):
+        if not self.login:
+            return True
+
+        if not header:
+            return False
+
+        scheme, _, value = header.partition(" ")
+
+        if self.gen == 1:
+            if scheme != "Basic":
+                return False
+            expected = "{}:{}".format(self.login.get("username", ""), self.login.get("password", ""))
+            return base64.b64decode(value).decode("utf-8", "replace") == expected
+
+        if scheme != "Digest":
+            return False
+
+        fields = parse_dict_header(value)
+        with self.__lock__:
+            fresh = fields.get("nonce") == self.__nonce__ and monotonic() - self.__nonce_time__ <= self.nonce_lifetime
+
+        if not fresh:
+            return False
+
+        ha1 = self.__digest__("admin:{}:{}".format(self.id, self.login.get("password", "")))
+        ha2 = self.__digest__("{}:{}".format(method, fields.get("uri", "")))
+        response = self.__digest__("{}:{}:{}:{}:auth:{}".format(
+            ha1, fields.get("nonce"), fields.get("nc"), fields.get("cnonce"), ha2))
+
+        return fields.get("response") == response
+
+    def __tick__(self):
+        """advance energy counters and add some noise to the readings"""
+        for relay in self.relays:
+            if relay["ison"]:
+                relay["total"] += relay["power"] / 3600
+
+        for emeter in self.emeters:
+            emeter["power"] = 100.0 + self.random.uniform(-5, 5)
+            emeter["total"] += emeter["power"] / 3600
+
+    def shelly(self):
+        """
+        @return     /shelly response
+        """
+        if self.gen == 1:
+            return {"type": self.model, "mac": self.mac, "auth": bool(self.login), "fw": "20230913-112003/v1.14.0-gcb84623", "num_outputs": len(self.relays)}
+
+        return {
+            "name": self.name, "id": self.id, "mac": self.mac, "model": self.model, "gen": self.gen,
+            "fw_id": "20231107-164738/1.0.8-g8c7bb8d", "ver": "1.0.8", "app": "PlusPlugS", "auth_en": bool(self.login),
+            "auth_domain": self.id if self.login else None,
+        }
+
+    def __gen1_relay__(self, index):
+        relay = self.relays[index]
+        return {"ison": relay["ison"], "has_timer": bool(relay["timer"]), "timer_duration": relay["timer"], "source": "http"}
+
+    def __gen1_meter__(self, index):
+        relay = self.relays[index]
+        power = relay["power"] if relay["ison"] else 0.0
+        return {"power": power, "overpower": 0.0, "is_valid": True, "timestamp": int(time()), "counters": [power, power, power], "total": int(relay["total"] * 60)}
+
+    def __gen1_emeter__(self, index):
+        emeter = self.emeters[index]
+        return {"power": emeter["power"], "reactive": 0.0, "voltage": emeter["voltage"], "is_valid": True, "total": emeter["total"], "total_returned": 0.0}
+
+    def __fire__(self, event, index):
+        """call the action URLs or webhooks registered for an event"""
+        def call(url):
+            try:
+                urlopen(url, timeout=2).close()
+            except OSError:
+                pass
+
+        for name, channel, url in self.webhooks:
+            if (name, channel) == (event, index):
+                Thread(target=call, args=(url,), daemon=True).start()
+
+    def __notify__(self, method, params):
+        """push a notification to every open WebSocket"""
+        for handler in list(self.__sockets__):
+            handler.__notify__(method, params)
+
+    @staticmethod
+    def __setting__(value):
+        """parse a query value the way Gen1 devices store settings"""
+        if value in ("true", "false"):
+            return value == "true"
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    def gen1(self, page, values):
+        """
+        @brief      answer a Gen1 HTTP request
+
+        @return     tuple of status code and response
+        """
+        self.__tick__()
+        parts = page.split("/")
+
+        try:
+            if page == "status":
+                return 200, {
+                    "relays": [self.__gen1_relay__(i) for i in range(len(self.relays))],
+                    "meters": [self.__gen1_meter__(i) for i in range(len(self.relays))],
+                    "emeters": [self.__gen1_emeter__(i) for i in range(len(self.emeters))],
+                    "temperature": 40.0, "uptime": int(monotonic()),
+                }
+
+            if parts[0] == "settings" and parts[1:] == ["actions"]:
+                event = values["name"][:-len("_url")]
+                index = int(values["index"])
+                self.webhooks = [hook for hook in self.webhooks if hook[:2] != (event, index)]
+                if values.get("enabled", "true") == "true" and values.get("urls[]"):
+                    self.webhooks.append((event, index, values["urls[]"]))
+                return 200, {"actions": {values["name"]: [{"index": index, "urls": [values.get("urls[]")]}]}}
+
+            if parts[0] == "settings":
+                values = {key: self.__setting__(value) for key, value in values.items()}
+
+                if len(parts) == 3 and parts[1] == "relay":
+                    config = self.relays[int(parts[2])]["config"]
+                    config.update(values)
+                    return 200, dict(config)
+
+                self.config.update(values)
+                return 200, {
+                    "device": {"type": self.model, "mac": self.mac, "hostname": self.config["name"]},
+                    "name": self.config["name"],
+                    "relays": [dict(relay["config"]) for relay in self.relays],
+                    "emeter": [{"appliance_type": "General"} for _ in self.emeters],
+                }
+
+            if parts[0] == "relay" and len(parts) == 2:
+                relay = self.relays[int(parts[1])]
+                turn = values.get("turn")
+                was_on = relay["ison"]
+                if turn == "toggle":
+                    relay["ison"] = not relay["ison"]
+                elif turn is not None:
+                    relay["ison"] = turn == "on"
+                relay["timer"] = int(values.get("timer", 0))
+                if relay["ison"] != was_on:
+                    self.__fire__("out_on" if relay["ison"] else "out_off", int(parts[1]))
+                return 200, self.__gen1_relay__(int(parts[1]))
+
+            if parts[0] == "meter" and len(parts) == 2:
+                return 200, self.__gen1_meter__(int(parts[1]))
+
+            if parts[0] == "emeter" and len(parts) == 2:
+                return 200, self.__gen1_emeter__(int(parts[1]))
+        except (IndexError, ValueError):
+            pass
+
+        return 404, None
+
+    def __switch__(self, index):
+        relay = self.relays[index]
+        power = relay["power"] if relay["ison"] else 0.0
+        return {
+            "id": index, "source": "HTTP", "output": relay["ison"], "apower": power, "voltage": 230.0,
+            "current": power / 230.0, "aenergy": {"total": relay["total"], "by_minute": [0, 0, 0], "minute_ts": int(time())},
+            "temperature": {"tC": 40.0, "tF": 104.0},
+        }
+
+    def __em1__(self, index):
+        emeter = self.emeters[index]
+        return {"id": index, "current": emeter["power"] / emeter["voltage"], "voltage": emeter["voltage"], "act_power": emeter["power"], "aprt_power": emeter["power"], "pf": 1, "freq": 50}
+
+    def __sys__(self):
+        return {"mac": self.mac, "restart_required": False, "time": None, "uptime": int(monotonic()), "ram_free": 100000, "fs_free": 100000}
+
+    def __method__(self, method, params):
+        """dispatch a single RPC method"""
+        index = params.get("id", 0)
+
+        if method == "Shelly.GetDeviceInfo":
+            return self.shelly()
+        if method == "Shelly.GetStatus":
+            return self.__status__()
+        if method == "Shelly.GetConfig":
+            return self.__config__()
+        if method == "Shelly.GetComponents":
+            return self.__components__(params)
+        if method == "Sys.GetStatus":
+            return self.__sys__()
+        if method == "Sys.GetConfig":
+            return {"device": {"name": self.config["name"], "mac": self.mac, "fw_id": "1.0.8"}}
+        if method == "Sys.SetConfig":
+            self.config.update(params.get("config", {}).get("device", {}))
+            return {"restart_required": False}
+        if method == "Switch.GetStatus":
+            return self.__switch__(index)
+        if method == "Switch.GetConfig":
+            return dict(self.relays[index]["config"], id=index)
+        if method == "Switch.SetConfig":
+            self.relays[index]["config"].update(params.get("config", {}))
+            return {"restart_required": False}
+        if method in ("Switch.Set", "Switch.Toggle"):
+            relay = self.relays[index]
+            was_on = relay["ison"]
+            relay["ison"] = not was_on if method == "Switch.Toggle" else bool(params.get("on"))
+            relay["timer"] = params.get("toggle_after", 0)
+            if relay["ison"] != was_on:
+                self.__fire__("switch.on" if relay["ison"] else "switch.off", index)
+                self.__notify__("NotifyStatus", {"ts": time(), "switch:{}".format(index): {"id": index, "output": relay["ison"]}})
+            return {"was_on": was_on}
+        if method == "Webhook.Create":
+            self.webhooks.append((params["event"], params.get("cid", 0), params["urls"][0]))
+            return {"id": len(self.webhooks), "rev": len(self.webhooks)}
+        if method == "Webhook.List":
+            return {"hooks": [
+                {"id": number + 1, "cid": index, "event": event, "enable": True, "urls": [url]}
+                for number, (event, index, url) in enumerate(self.webhooks)
+            ], "rev": len(self.webhooks)}
+        if method == "EM1.GetStatus":
+            return self.__em1__(index)
+
+        raise KeyError(method)
+
+    def __status__(self):
+        status = {"sys": self.__sys__()}
+        for i in range(len(self.relays)):
+            status["switch:{}".format(i)] = self.__switch__(i)
+        for i in range(len(self.emeters)):
+            status["em1:{}".format(i)] = self.__em1__(i)
+        return status
+
+    def __config__(self):
+        config = {"sys": {"device": {"name": self.config["name"], "mac": self.mac}}}
+        for i, relay in enumerate(self.relays):
+            config["switch:{}".format(i)] = dict(relay["config"], id=i)
+        return config
+
+    def __components__(self, params):
+        """one page of Shelly.GetComponents"""
+        include = params.get("include", [])
+        keys = params.get("keys", None)
+        offset = params.get("offset", 0)
+
+        status = self.__status__()
+        config = self.__config__()
+        names = [key for key in status if keys is None or key in keys]
+
+        components = []
+        for key in names[offset:offset + self.page_size]:
+            component = {"key": key}
+            if "status" in include:
+                component["status"] = status[key]
+            if "config" in include and key in config:
+                component["config"] = config[key]
+            components.append(component)
+
+        return {"components": components, "cfg_rev": 1, "offset": offset, "total": len(names)}
+
+    def __call__(self, request):
+        try:
+            result = self.__method__(request.get("method"), request.get("params") or {})
+        except KeyError:
+            return {"id": request.get("id"), "src": self.id, "error": {"code": 404, "message": "No handler for {}".format(request.get("method"))}}
+        except IndexError:
+            return {"id": request.get("id"), "src": self.id, "error": {"code": -105, "message": "Argument 'id', value {} not found!".format(request.get("params", {}).get("id"))}}
+
+        return {"id": request.get("id"), "src": self.id, "result": result}
+
+    def rpc(self, request):
+        """
+        @brief      answer a JSON-RPC request object or a batch of them
+
+        @return     response object or list of response objects
+        """
+        self.__tick__()
+
+        if isinstance(request, list):
+            return [self(item) for item in request]
+        return self(request)
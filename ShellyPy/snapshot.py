@@ -0,0 +1,130 @@
+from copy import deepcopy
+
+
+class Delta:
+    """
+    difference between two documents
+
+    paths are tuples of dict keys and list indices, e.g. ("switch:0", "aenergy", "total")
+    """
+
+    def __init__(self, changed = None, removed = None):
+        # path to the new value of every added or changed leaf
+        self.changed = changed if changed is not None else {}
+        # paths that no longer exist
+        self.removed = removed if removed is not None else []
+
+    def __bool__(self):
+        return bool(self.changed or self.removed)
+
+    def __len__(self):
+        return len(self.changed) + len(self.removed)
+
+    def __repr__(self):
+        return "<Delta {} changed {} removed>".format(len(self.changed), len(self.removed))
+
+    def apply(self, document):
+        """
+        @brief      apply the changes to a copy of a document
+
+        @return     the updated copy
+        """
+        document = deepcopy(document)
+
+        for path in self.removed:
+            parent = _walk(document, path[:-1])
+            if isinstance(parent, dict):
+                parent.pop(path[-1], None)
+            elif isinstance(parent, list) and path[-1] < len(parent):
+                del parent[path[-1]]
+
+        for path, value in self.changed.items():
+            if not path:
+                return deepcopy(value)
+
+            parent = document
+            for key in path[:-1]:
+                if isinstance(parent, dict):
+                    parent = parent.setdefault(key, {})
+                else:
+                    parent = parent[key]
+
+            if isinstance(parent, list) and path[-1] >= len(parent):
+                parent.extend([None] * (path[-1] - len(parent) + 1))
+            parent[path[-1]] = deepcopy(value)
+
+        return document
+
+
+def _walk(document, path):
+    for key in path:
+        document = document[key]
+    return document
+
+
+def diff(old, new, path = (), delta = None):
+    """
+    @brief      compare two decoded JSON documents
+
+    dicts and lists are compared member by member, any other value is
+    reported as a whole when it differs
+
+    @return     Delta
+    """
+    if delta is None:
+        delta = Delta()
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key in old:
+                diff(old[key], value, path + (key,), delta)
+            else:
+                delta.changed[path + (key,)] = value
+
+        for key in old:
+            if key not in new:
+                delta.removed.append(path + (key,))
+
+    elif isinstance(old, list) and isinstance(new, list):
+        for index, value in enumerate(new):
+            if index < len(old):
+                diff(old[index], value, path + (index,), delta)
+            else:
+                delta.changed[path + (index,)] = value
+
+        # from the end, so applying them in order keeps the indices valid
+        for index in range(len(old) - 1, len(new) - 1, -1):
+            delta.removed.append(path + (index,))
+
+    elif old != new or type(old) is not type(new):
+        delta.changed[path] = new
+
+    return delta
+
+
+class Snapshot:
+    """
+    the last known state of a device, updates return what changed
+    """
+
+    def __init__(self, document = None):
+        self.document = document
+        # amount of updates that changed something
+        self.revision = 0
+
+    def update(self, document):
+        """
+        @brief      replace the document
+
+        @return     Delta to the previous document, everything is changed on the first update
+        """
+        if self.document is None:
+            delta = Delta({(key,): value for key, value in document.items()})
+        else:
+            delta = diff(self.document, document)
+
+        self.document = document
+        if delta:
+            self.revision += 1
+
+        return delta
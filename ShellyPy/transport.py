@@ -0,0 +1,204 @@
+from threading import Condition, Lock, Thread
+from time import monotonic
+from urllib.parse import urlsplit
+from weakref import WeakSet
+
+# seconds between checks for idle hosts while requests are sent
+SWEEP_INTERVAL = 1.0
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _origin(url):
+    """scheme, host and port part of a url, e.g. http://10.0.0.2:80"""
+    end = url.find("/", url.find("//") + 2)
+    return url if end < 0 else url[:end]
+
+
+class _Reaper:
+    """
+    a single thread closing the pools of idle devices of every session
+
+    it only runs while a session has devices with pooled connections
+    """
+
+    def __init__(self):
+        self.__sessions__ = WeakSet()
+        self.__wake__ = Condition()
+        self.__changed__ = False
+        self.__thread__ = None
+
+    def watch(self, session):
+        with self.__wake__:
+            self.__sessions__.add(session)
+            self.__changed__ = True
+            self.__wake__.notify()
+
+            if self.__thread__ is None:
+                self.__thread__ = Thread(target=self.__run__, name="ShellySessionReaper", daemon=True)
+                self.__thread__.start()
+
+    def forget(self, session):
+        with self.__wake__:
+            self.__sessions__.discard(session)
+
+    def __run__(self):
+        while True:
+            with self.__wake__:
+                self.__changed__ = False
+                sessions = list(self.__sessions__)
+
+            # sessions stop being watched once none of their devices has pooled connections
+            delays = [delay for delay in (session.__idle__() for session in sessions) if delay is not None]
+            del sessions
+
+            with self.__wake__:
+                if not self.__sessions__:
+                    self.__thread__ = None
+                    return
+
+                if not self.__changed__:
+                    self.__wake__.wait(min(delays) if delays else None)
+
+
+_REAPER = _Reaper()
+
+
+class ShellySession:
+    """
+    keep-alive connection pool, can be shared by any number of devices
+    """
+
+    def __init__(self, pool_size = 2, pool_hosts = 10, idle_timeout = 30, retries = 0, backoff = 0):
+        """
+        @param      pool_size       maximum number of connections kept alive per device
+        @param      pool_hosts      number of devices a pool is kept around for
+        @param      idle_timeout    drop the kept-alive connections of a device after it was idle for this many seconds, None keeps them forever
+        @param      retries         amount of retries for requests that could not connect
+        @param      backoff         backoff factor between retries
+        """
+
+        # imported here so importing ShellyPy does not pay for requests
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+
+        # read errors are never retried, the device may have already acted on the request
+        retry = Retry(total=retries, read=False, redirect=False, backoff_factor=backoff)
+
+        adapter = HTTPAdapter(pool_connections=pool_hosts,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+
+        self.session = Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.__lock__ = Lock()
+        # origin of every device with pooled connections to when it was last used
+        self.__last_used__ = {}
+        self.__next_sweep__ = 0
+        # whether the reaper closes the pools of idle devices while no requests are sent
+        self.__watched__ = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __expire__(self, url):
+        """mark the device of url as used and close the pools of devices idle for too long"""
+        if self.idle_timeout is None:
+            return
+
+        now = monotonic()
+        expired = ()
+
+        with self.__lock__:
+            self.__last_used__[_origin(url)] = now
+
+            if now >= self.__next_sweep__:
+                self.__next_sweep__ = now + min(self.idle_timeout, SWEEP_INTERVAL)
+                expired = self.__sweep__(now)
+
+            if not self.__watched__:
+                self.__watched__ = True
+                _REAPER.watch(self)
+
+        if expired:
+            self.__close_pools__(expired)
+
+    def __sweep__(self, now):
+        """forget devices idle for longer than idle_timeout, the lock has to be held"""
+        expired = [origin for origin, used in self.__last_used__.items() if now - used > self.idle_timeout]
+        for origin in expired:
+            del self.__last_used__[origin]
+        return expired
+
+    def __idle__(self):
+        """
+        @brief      close the pools of idle devices, called by the reaper
+
+        @return     seconds until the device used longest ago turns idle, None if no device is left
+        """
+        now = monotonic()
+
+        with self.__lock__:
+            expired = self.__sweep__(now)
+
+            if self.__last_used__:
+                delay = min(self.__last_used__.values()) + self.idle_timeout - now + 0.01
+            else:
+                delay = None
+                self.__watched__ = False
+                _REAPER.forget(self)
+
+        if expired:
+            self.__close_pools__(expired)
+
+        return delay
+
+    def __close_pools__(self, origins):
+        """close the connection pools of devices, adapters recreate them on demand"""
+        targets = set()
+        for origin in origins:
+            parts = urlsplit(origin)
+            targets.add((parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS.get(parts.scheme)))
+
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                if (key.key_scheme, key.key_host, key.key_port) in targets:
+                    # disposing a pool closes its connections
+                    pools.pop(key, None)
+
+    def request(self, method, url, **kwargs):
+        """
+        @brief      send a request over a pooled connection
+
+        @param      method  HTTP method
+        @param      url     target url
+
+        @return     requests.Response
+        """
+        self.__expire__(url)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        with self.__lock__:
+            if self.__watched__:
+                self.__watched__ = False
+                _REAPER.forget(self)
+            self.__last_used__ = {}
+
+        self.session.close()
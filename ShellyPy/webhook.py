@@ -0,0 +1,379 @@
+"""
+receiver for Gen1 action URLs and Gen2 webhooks
+
+devices call the receiver whenever their state changes, one receiver
+serves every device of a network instead of polling each of them.
+registered URLs carry the device id, the event and the channel in the path,
+e.g. http://192.168.0.2:8089/A8032ABE54DC/switch.on/0
+"""
+import socket
+from asyncio import start_server, IncompleteReadError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import time
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from .listener import DeviceListener
+
+WEBHOOK_PORT = 8089
+
+# events that switch an output, Gen1 action names and Gen2 webhook events
+OUTPUT_EVENTS = {
+    "out_on": True, "out_off": False,
+    "switch.on": True, "switch.off": False,
+    "light.on": True, "light.off": False,
+}
+
+RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n"
+RESPONSE_CLOSE = b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+class WebhookEvent:
+    """
+    a single call of an action URL or webhook
+    """
+
+    __slots__ = ("address", "device_id", "event", "index", "values", "time", "device")
+
+    def __init__(self, address, device_id, event, index = None, values = None):
+        # IP the call came from
+        self.address = address
+        self.device_id = device_id
+        # Gen1 action name without "_url", e.g. "out_on", or Gen2 event, e.g. "switch.on"
+        self.event = event
+        # channel of the event
+        self.index = index
+        # query parameters, e.g. hum and temp of a H&T
+        self.values = values or {}
+        self.time = time()
+        # matched device or None
+        self.device = None
+
+    def __repr__(self):
+        return "<WebhookEvent {} {} {}>".format(self.device_id or self.address, self.event, self.index)
+
+    @property
+    def generation(self):
+        """generation of the sending device, Gen2 events are namespaced by their component"""
+        return 2 if "." in self.event else 1
+
+    @property
+    def output(self):
+        """new state of the output for output events, None for any other event"""
+        return OUTPUT_EVENTS.get(self.event)
+
+
+def parse(target, address = None):
+    """
+    @brief      turn the path of a call into a WebhookEvent
+
+    @param      target  path and query the device requested
+    @param      address IP of the device
+
+    @return     WebhookEvent or None if the path was not registered by a receiver
+    """
+    url = urlsplit(target)
+    parts = [unquote(part) for part in url.path.strip("/").split("/")]
+
+    if len(parts) not in (2, 3) or not all(parts):
+        return None
+
+    index = None
+    if len(parts) == 3:
+        try:
+            index = int(parts[2])
+        except ValueError:
+            return None
+
+    return WebhookEvent(address, parts[0], parts[1], index, dict(parse_qsl(url.query)))
+
+
+def local_address(target):
+    """IP of the interface the target is reached through"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # nothing is sent, connecting a datagram socket only picks the route
+        sock.connect((target, 9))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def __handle__(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        # answer first, the device does not wait for the subscribers
+        self.wfile.write(RESPONSE)
+        self.wfile.flush()
+
+        self.server.receiver.__dispatch__(self.path, self.client_address[0])
+
+    do_GET = __handle__
+    do_POST = __handle__
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, receiver):
+        self.receiver = receiver
+        super().__init__(address, WebhookHandler)
+
+    def handle_error(self, request, client_address):
+        # devices hanging up early are not worth a traceback
+        pass
+
+
+class WebhookReceiver(DeviceListener):
+    """
+    receives action URLs of Gen1 and webhooks of Gen2 devices
+
+    calls are matched to the added devices by the id in their path or their IP
+    """
+
+    def __init__(self, devices = None, host = "0.0.0.0", port = WEBHOOK_PORT, **kwargs):
+        """
+        @param      devices         list of devices to match calls to
+        @param      host            IP of the interface to listen on
+        @param      port            TCP port to listen on, 0 picks a free one
+        @param      advertise       address devices reach the receiver at, found per device if None
+        @param      refresh_cache   update the cached state of matched devices
+        """
+        self.host = host
+        self.port = port
+        self.advertise = kwargs.get("advertise", None)
+
+        self.calls = 0
+
+        self.__server__ = None
+        self.__thread__ = None
+
+        super().__init__(devices, kwargs.get("refresh_cache", False))
+
+    @staticmethod
+    def __device_id__(device):
+        return (device.__mac__ or device.__ip__).upper()
+
+    @staticmethod
+    def __event__(event):
+        return event.event
+
+    def feed(self, target, address = None):
+        """
+        @brief      handle a call as if it was received, used to replay captured calls
+
+        @param      target  path and query the device requested
+        @param      address IP of the device
+
+        @return     WebhookEvent or None if the call was dropped
+        """
+        self.calls += 1
+        return self.__receive__(parse(target, address))
+
+    @staticmethod
+    def __refresh__(event):
+        """merge an event into the cached responses of its device"""
+        cache = event.device.__cache__
+        output = event.output
+
+        if output is None or event.index is None:
+            # the new state is unknown, so what was cached is gone
+            cache.evict(lambda page, _: not page.startswith("settings") and "Config" not in page)
+            return
+
+        index = event.index
+
+        if event.generation == 1:
+            for page in ("relay/{}".format(index), "light/{}".format(index)):
+                cache.refresh(page, None, lambda response: dict(response, ison=output))
+
+            def update(response):
+                response = dict(response)
+                for name in ("relays", "lights"):
+                    channels = response.get(name)
+                    if channels and index < len(channels):
+                        response[name] = [
+                            dict(channel, ison=output) if position == index else channel
+                            for position, channel in enumerate(channels)
+                        ]
+                return response
+
+            cache.refresh("status", None, update)
+        else:
+            component = event.event.partition(".")[0]
+            key = "{}:{}".format(component, index)
+            method = "{}.GetStatus".format(component.capitalize())
+
+            cache.refresh(method, {"id": index}, lambda response: dict(response, output=output))
+            cache.refresh("Shelly.GetStatus", None, lambda response: dict(
+                response, **{key: dict(response[key], output=output)}
+            ) if key in response else response)
+
+    def url(self, device):
+        """
+        @brief      base URL the device is registered with
+
+        @return     URL without the event and channel
+        """
+        host = self.advertise or local_address(device.__ip__)
+        return "http://{}:{}/{}".format(host, self.port, self.__device_id__(device))
+
+    def __registration__(self, device, events, config, hooks):
+        if events is None:
+            events = device.__webhook_events__(config)
+        return events, device.__webhook_requests__(self.url(device), events, hooks)
+
+    def register(self, device, events = None):
+        """
+        @brief      point the action URLs or webhooks of a device at the receiver
+
+        webhooks that already call the receiver are not created again
+
+        @param      device  device to register with
+        @param      events  list of (event, channel) tuples, every output event of the device if None
+
+        @return     list of (event, channel) tuples that call the receiver
+        """
+        config = device.__fresh__(*device.__config_source__(None)) if events is None else None
+        listing = device.__webhook_list__()
+        hooks = device.post(*listing) if listing else None
+
+        events, requests = self.__registration__(device, events, config, hooks)
+        for page, values in requests:
+            device.post(page, values)
+
+        self.add(device)
+        return events
+
+    def start(self):
+        """
+        @brief      start listening in a background thread
+
+        @return     the receiver itself
+        """
+        if self.__server__ is not None:
+            return self
+
+        self.__server__ = WebhookServer((self.host, self.port), self)
+        # port 0 picks a free port
+        self.port = self.__server__.server_address[1]
+
+        self.__thread__ = Thread(target=self.__server__.serve_forever, name="WebhookReceiver", daemon=True)
+        self.__thread__.start()
+        return self
+
+    def stop(self):
+        if self.__server__ is None:
+            return
+
+        self.__server__.shutdown()
+        self.__server__.server_close()
+        self.__thread__.join()
+
+        self.__server__ = None
+        self.__thread__ = None
+
+
+class AsyncWebhookReceiver(WebhookReceiver):
+    """
+    WebhookReceiver running on the event loop instead of threads
+    """
+
+    def __init__(self, devices = None, host = "0.0.0.0", port = WEBHOOK_PORT, **kwargs):
+        super().__init__(devices, host, port, **kwargs)
+        # open connections, closed on stop so kept-alive clients do not hold it up
+        self.__writers__ = set()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def register(self, device, events = None):
+        """
+        @brief      async version of WebhookReceiver.register, for async devices
+        """
+        config = await device.__fresh__(*device.__config_source__(None)) if events is None else None
+        listing = device.__webhook_list__()
+        hooks = await device.post(*listing) if listing else None
+
+        events, requests = self.__registration__(device, events, config, hooks)
+        for page, values in requests:
+            await device.post(page, values)
+
+        self.add(device)
+        return events
+
+    async def __client__(self, reader, writer):
+        address = writer.get_extra_info("peername")[0]
+        self.__writers__.add(writer)
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                _, target, version = line.decode("latin-1").split(" ", 2)
+                length = 0
+                close = version.strip() == "HTTP/1.0"
+
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+
+                    name, _, value = header.decode("latin-1").partition(":")
+                    name = name.strip().lower()
+                    if name == "content-length":
+                        length = int(value)
+                    elif name == "connection":
+                        close = value.strip().lower() != "keep-alive"
+
+                if length:
+                    await reader.readexactly(length)
+
+                writer.write(RESPONSE_CLOSE if close else RESPONSE)
+                self.__dispatch__(target, address)
+
+                if close:
+                    break
+                await writer.drain()
+        except (ConnectionError, IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.__writers__.discard(writer)
+            writer.close()
+
+    async def start(self):
+        """
+        @brief      start listening on the running event loop
+
+        @return     the receiver itself
+        """
+        if self.__server__ is not None:
+            return self
+
+        self.__server__ = await start_server(self.__client__, self.host, self.port)
+        self.port = self.__server__.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.__server__ is None:
+            return
+
+        self.__server__.close()
+        for writer in list(self.__writers__):
+            writer.close()
+        await self.__server__.wait_closed()
+        self.__server__ = None
@@ -1,19 +1,22 @@
-from sys import version_info
+from .base import ShellyBase
+from .detect import default_cache, detect, device_class
 
-if version_info.major == 3:
-    from json.decoder import JSONDecodeError
-else:
-    JSONDecodeError = ValueError
 
-from requests import get
+class ShellyType(type):
+    """lets isinstance(device, Shelly) hold for every device Shelly creates"""
 
-from .error import BadLogin, BadResponse, NotFound
-from .gen1 import ShellyGen1
-from .gen2 import ShellyGen2
+    def __instancecheck__(cls, instance):
+        return isinstance(instance, ShellyBase)
 
 
-class Shelly:
-    def __init__(self, ip, port="80", *args, **kwargs):
+class Shelly(metaclass=ShellyType):
+    """
+    creates the device class matching the generation of a device
+
+    the returned object is a ShellyGen1 or ShellyGen2, calls go to it directly
+    """
+
+    def __new__(cls, ip, port="80", *args, **kwargs):
         """
         @param      ip      the target IP of the shelly device. Can be a string, list of strings or list of integers
         @param      port        target port, may be useful for non Shelly devices that have the same HTTP Api
@@ -21,40 +24,26 @@ class Shelly:
         @param      timeout specify the amount of time until requests are aborted.
         @param      debug   enable debug printing
         @param      init    calls the update method on init
-        """
-
-        self._instance = self.__detect__(ip, port)(ip, port, *args, **kwargs)
-
-    def __detect__(self, ip, port):
-        url = "{}://{}:{}/shelly".format("http", ip, port)
+        @param      gen     generation of the device, skips detection when given
+        @param      detect_cache    DetectionCache for /shelly responses, None to always probe
 
-        response = get(url, timeout=5)
-
-        if response.status_code == 401:
-            raise BadLogin()
-        elif response.status_code == 404:
-            raise NotFound("Not Found")
-
-        try:
-            response_data = response.json()
-        except JSONDecodeError:
-            raise BadResponse("Bad JSON")
-
-        gen = response_data.get("gen", 1)
+        @return     ShellyGen1 or ShellyGen2
+        """
+        return cls.__detect__(ip, port, kwargs)(ip, port, *args, **kwargs)
 
-        if gen == 1:
-            return ShellyGen1
-        elif gen >= 2:
-            # Shelly API is the same for Gen2, Gen3 and Gen4
-            return ShellyGen2
-        else:
-            raise ValueError("Generation {} not supported".format(gen))
+    @staticmethod
+    def __detect__(ip, port, kwargs):
+        gen = kwargs.get("gen", None)
+        if gen is not None:
+            return device_class(gen)
 
-    def __repr__(self):
-        return self.__getattr__("__repr__")()
+        info = detect(ip, port,
+                      timeout=kwargs.get("timeout", 5),
+                      login=kwargs.get("login", None),
+                      cache=kwargs.get("detect_cache", default_cache),
+                      session=kwargs.get("session", None))
 
-    def __str__(self):
-        return self.__getattr__("__str__")()
+        # handed to the device so it does not have to ask for it again
+        kwargs["info"] = info
 
-    def __getattr__(self, name):
-        return getattr(self._instance, name)
+        return device_class(info)
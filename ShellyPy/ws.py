@@ -0,0 +1,241 @@
+"""
+JSON-RPC over a persistent WebSocket for Gen2+ devices
+
+requires aiohttp
+"""
+import json
+import logging
+import os
+from asyncio import CancelledError, Event, Queue, ensure_future, get_running_loop, sleep, wait_for
+
+import aiohttp
+
+from .aio import AsyncShellyGen2
+from .error import BadResponse
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ShellyGen2WebSocket(AsyncShellyGen2):
+    """
+    sends every RPC over one long lived WebSocket and receives the
+    NotifyStatus, NotifyFullStatus and NotifyEvent frames pushed by the device
+    """
+
+    __slots__ = (
+        "__src__", "__backoff__", "__max_backoff__", "__queue_size__", "__ws__", "__runner__", "__announcer__",
+        "__connected__", "__closed__", "__pending__", "__callbacks__", "__queues__", "reconnects",
+    )
+
+    def __init__(self, ip, port = "80", *args, **kwargs):
+        """
+        @param      src             source name the device sends replies and notifications to
+        @param      backoff         initial delay between reconnection attempts in seconds
+        @param      max_backoff     upper limit of the reconnection delay
+        @param      queue_size      amount of notifications buffered per iterator, the oldest are dropped first
+
+        all other arguments are the same as for AsyncShellyGen2
+        """
+        self.__src__ = kwargs.get("src", "shellypy-" + os.urandom(4).hex())
+        self.__backoff__ = kwargs.get("backoff", 0.5)
+        self.__max_backoff__ = kwargs.get("max_backoff", 30)
+        self.__queue_size__ = kwargs.get("queue_size", 256)
+
+        self.__ws__ = None
+        self.__runner__ = None
+        # kept so the announcement is not garbage collected while it runs
+        self.__announcer__ = None
+        self.__connected__ = None
+        self.__closed__ = False
+
+        self.__pending__ = {}
+        self.__callbacks__ = []
+        self.__queues__ = []
+
+        self.reconnects = 0
+
+        super().__init__(ip, port, *args, **kwargs)
+
+    @property
+    def connected(self):
+        return self.__ws__ is not None and not self.__ws__.closed
+
+    async def connect(self):
+        """
+        @brief      open the WebSocket, reconnection is handled in the background from then on
+        """
+        if self.__runner__ is None:
+            self.__closed__ = False
+            self.__connected__ = Event()
+            self.__runner__ = ensure_future(self.__run__())
+
+        await wait_for(self.__connected__.wait(), self.__timeout__)
+
+    async def __run__(self):
+        url = "ws://{}:{}/rpc".format(self.__ip__, self.__port__)
+        delay = self.__backoff__
+
+        while not self.__closed__:
+            try:
+                self.__ws__ = await self.__get_session__().ws_connect(url, heartbeat=self.__timeout__ * 2)
+            except (aiohttp.ClientError, OSError):
+                await sleep(delay)
+                delay = min(delay * 2, self.__max_backoff__)
+                continue
+
+            delay = self.__backoff__
+            self.__connected__.set()
+
+            # the device only pushes notifications to sources it has heard from
+            self.__announcer__ = ensure_future(self.__announce__())
+
+            try:
+                async for message in self.__ws__:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        self.__receive__(message.data)
+                    elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+            finally:
+                self.__connected__.clear()
+                await self.__ws__.close()
+
+                for future in self.__pending__.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("WebSocket closed"))
+                self.__pending__.clear()
+
+            if not self.__closed__:
+                self.reconnects += 1
+                await sleep(delay)
+
+    async def __announce__(self):
+        try:
+            await self.post("Shelly.GetDeviceInfo")
+        except Exception:
+            pass
+
+    def __receive__(self, data):
+        try:
+            frame = self.__decode__(data)
+        except BadResponse:
+            return
+
+        if "id" in frame and "method" not in frame:
+            future = self.__pending__.pop(frame["id"], None)
+            if future is not None and not future.done():
+                future.set_result(frame)
+            return
+
+        for callback in list(self.__callbacks__):
+            try:
+                callback(frame)
+            except Exception:
+                # a failing callback must not end the receive loop
+                _LOGGER.exception("notification callback %r failed", callback)
+
+        for queue in self.__queues__:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(frame)
+
+    async def __send_frame__(self, payload):
+        if not self.connected:
+            await self.connect()
+
+        frame = dict(payload)
+        frame["src"] = self.__src__
+
+        auth = self.__auth__.state.rpc_auth()
+        if auth:
+            frame["auth"] = auth
+
+        future = get_running_loop().create_future()
+        self.__pending__[frame["id"]] = future
+
+        try:
+            await self.__ws__.send_str(json.dumps(frame))
+            response = await wait_for(future, self.__request_timeout__())
+        finally:
+            self.__pending__.pop(frame["id"], None)
+
+        return auth is not None, response
+
+    async def __rpc__(self, payload, event = None):
+        if isinstance(payload, list):
+            raise BadResponse("batches are not supported over WebSockets")
+
+        digest = self.__auth__.state
+
+        # the second attempt is only made after receiving a new challenge
+        for attempt in range(2):
+            authenticated, response = await self.__send_frame__(payload)
+
+            error = response.get("error", {})
+            if error.get("code") == 401 and not attempt:
+                try:
+                    challenge = json.loads(error.get("message", ""))
+                except ValueError:
+                    return response
+
+                challenge.setdefault("qop", "auth")
+                digest.take(challenge)
+                if event is not None:
+                    event.auth_retries += 1
+                continue
+
+            if authenticated and not attempt and error.get("code") != 401:
+                # only headers sent before any challenge of this request avoided one
+                digest.avoided += 1
+
+            if event is not None:
+                event.status = error.get("code", 200)
+            return response
+
+    def subscribe(self, callback):
+        """
+        @brief      call a function for every notification frame
+
+        @param      callback    function taking the decoded frame
+        """
+        self.__callbacks__.append(callback)
+
+    def unsubscribe(self, callback):
+        self.__callbacks__.remove(callback)
+
+    async def notifications(self):
+        """
+        @brief      iterate over notification frames as they arrive
+
+        @return     async generator of decoded frames
+        """
+        queue = Queue(self.__queue_size__)
+        self.__queues__.append(queue)
+
+        try:
+            if not self.connected:
+                await self.connect()
+
+            while True:
+                yield await queue.get()
+        finally:
+            self.__queues__.remove(queue)
+
+    async def close(self):
+        """
+        @brief      close the WebSocket and stop reconnecting
+        """
+        self.__closed__ = True
+
+        if self.__runner__ is not None:
+            self.__runner__.cancel()
+            try:
+                await self.__runner__
+            except CancelledError:
+                pass
+            self.__runner__ = None
+
+        if self.__announcer__ is not None:
+            self.__announcer__.cancel()
+            self.__announcer__ = None
+
+        await super().close()
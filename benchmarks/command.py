@@ -0,0 +1,51 @@
+"""
+cost of building a request on every call against sending a prepared command
+
+only the request building is timed, nothing is sent
+
+usage: python benchmarks/command.py [iterations]
+"""
+import json
+import sys
+from time import perf_counter
+
+sys.path.insert(0, ".")
+
+import ShellyPy
+
+
+def timed(func, count):
+    start = perf_counter()
+    for _ in range(count):
+        func()
+    return (perf_counter() - start) / count * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    gen1 = ShellyPy.ShellyGen1("127.0.0.1", info={"type": "SHRGBW2"})
+    gen2 = ShellyPy.ShellyGen2("127.0.0.1", info={"name": "bench"})
+
+    scene = {"mode": "color", "turn": True, "red": 255, "green": 120, "blue": 40, "gain": 80}
+    prepared1 = gen1.prepare("light", 0, **scene)
+    prepared2 = gen2.prepare("relay", 0, turn=False, timer=30)
+
+    def build1():
+        gen1.__url__(*gen1.__light_request__(0, **scene))
+
+    def build2():
+        payload, _ = gen2.__request__(*gen2.__relay_request__(0, turn=False, timer=30))
+        json.dumps(payload)
+
+    print("Gen1 light, built:    {:8.0f} ns".format(timed(build1, count)))
+    print("Gen1 light, prepared: {:8.0f} ns".format(timed(lambda: gen1.__url__(prepared1.page, prepared1), count)))
+    print("Gen2 relay, built:    {:8.0f} ns".format(timed(build2, count)))
+    print("Gen2 relay, prepared: {:8.0f} ns".format(timed(lambda: gen2.__request__(prepared2.page, prepared2), count)))
+
+    gen1.close()
+    gen2.close()
+
+
+if __name__ == "__main__":
+    main()
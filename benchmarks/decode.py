@@ -0,0 +1,56 @@
+"""
+decode time of device responses per payload and decoder
+
+the payloads in benchmarks/payloads follow the responses of real devices,
+orjson and ujson are compared when they are installed
+
+usage: python benchmarks/decode.py [iterations]
+"""
+import os
+import sys
+from timeit import timeit
+
+sys.path.insert(0, ".")
+
+from requests.models import Response
+
+from ShellyPy import codec
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def response(content):
+    """a requests response the way a device sends it, without a charset"""
+    result = Response()
+    result._content = content
+    result.status_code = 200
+    result.headers["Content-Type"] = "application/json"
+    return result
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    names = sorted(codec.available())
+    print("{:<28} {:>7} {:>16}".format("payload", "bytes", "Response.json") +
+          "".join("{:>12}".format(name) for name in names))
+
+    for name in sorted(os.listdir(PAYLOADS)):
+        with open(os.path.join(PAYLOADS, name), "rb") as f:
+            content = f.read()
+
+        def per_call(func):
+            return timeit(func, number=iterations) / iterations * 1e6
+
+        cached = response(content)
+        columns = ["{:>13.2f} us".format(per_call(cached.json))]
+
+        for decoder in names:
+            loads = codec.get_decoder(decoder)
+            columns.append("{:>9.2f} us".format(per_call(lambda: codec.decode(cached.content, loads))))
+
+        print("{:<28} {:>7} {}".format(name, len(content), " ".join(columns)))
+
+
+if __name__ == "__main__":
+    main()
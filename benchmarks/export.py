@@ -0,0 +1,72 @@
+"""
+rows per second of the export sinks against writing every reading on its own
+
+the readings are the Gen2 Shelly.GetStatus response from benchmarks/payloads
+
+usage: python benchmarks/export.py [responses]
+"""
+import csv
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, ".")
+
+from ShellyPy.export import BinarySink, CsvSink, LineProtocolSink, flatten
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def per_reading(path, responses):
+    """one dict and one write per reading, the same fields as the sinks"""
+    with open(path, "w", newline="", buffering=1) as f:
+        writer = csv.DictWriter(f, ["host", "channel", "timestamp", "power", "voltage", "total", "output", "temperature"])
+        writer.writeheader()
+        for timestamp, response in enumerate(responses):
+            for key, part in response.items():
+                if key.startswith("switch:"):
+                    writer.writerow({
+                        "host": "192.168.0.5", "channel": part["id"], "timestamp": timestamp,
+                        "power": part.get("apower"), "voltage": part.get("voltage"),
+                        "total": part.get("aenergy", {}).get("total"), "output": float(part.get("output")),
+                        "temperature": part.get("temperature", {}).get("tC"),
+                    })
+                    f.flush()
+
+
+def sink(cls):
+    def run(path, responses):
+        with cls(path) as target:
+            for timestamp, response in enumerate(responses):
+                target.record("192.168.0.5", response, timestamp=timestamp)
+    return run
+
+
+def main():
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with open(os.path.join(PAYLOADS, "gen2_getstatus_pro4pm.json"), "rb") as f:
+        response = json.loads(f.read())["result"]
+    responses = [response] * amount
+    rows = len(flatten(response)) * amount
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, func in (
+            ("csv per reading", per_reading),
+            ("CsvSink", sink(CsvSink)),
+            ("LineProtocolSink", sink(LineProtocolSink)),
+            ("BinarySink", sink(BinarySink)),
+        ):
+            path = os.path.join(directory, name.replace(" ", "_"))
+
+            start = perf_counter()
+            func(path, responses)
+            total = perf_counter() - start
+
+            print("{:<20} {:10.0f} rows/s {:10.1f} bytes/row".format(name, rows / total, os.path.getsize(path) / rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+import time, memory per device and the cost of the old Shelly proxy
+
+usage: python benchmarks/footprint.py [devices]
+"""
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, ".")
+
+import ShellyPy
+
+IMPORT = """
+from time import perf_counter
+start = perf_counter()
+import ShellyPy
+elapsed = perf_counter() - start
+import sys
+print(elapsed, "requests" in sys.modules, "asyncio" in sys.modules)
+"""
+
+
+class Proxy:
+    """what Shelly used to be, every attribute went through __getattr__"""
+
+    def __init__(self, instance):
+        self._instance = instance
+
+    def __getattr__(self, name):
+        return getattr(self._instance, name)
+
+
+def import_time(runs = 5):
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT], cwd=".")
+        elapsed, requests, asyncio = output.split()
+        results.append(float(elapsed))
+    return min(results), requests == b"True", asyncio == b"True"
+
+
+def device_bytes(count):
+    session = ShellyPy.ShellySession()
+    info = {"type": "SHSW-1", "mac": "AABBCCDDEEFF", "auth": False}
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    devices = [ShellyPy.ShellyGen1("10.0.{}.{}".format(i // 250, i % 250), session=session, info=info)
+               for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    del devices
+    session.close()
+    return used / count
+
+
+def lookup(device, count):
+    start = perf_counter()
+    for _ in range(count):
+        device.relay
+    return (perf_counter() - start) / count * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    elapsed, requests, asyncio = import_time()
+    print("import ShellyPy:  {:8.1f} ms (requests loaded: {}, asyncio loaded: {})".format(elapsed * 1000, requests, asyncio))
+
+    print("per device:       {:8.0f} bytes ({} devices, shared session)".format(device_bytes(count), count))
+
+    device = ShellyPy.Shelly("127.0.0.1", gen=1, info={"type": "SHSW-1"})
+    proxy = Proxy(device)
+    print("direct lookup:    {:8.1f} ns".format(lookup(device, 1000000)))
+    print("proxied lookup:   {:8.1f} ns".format(lookup(proxy, 1000000)))
+    device.close()
+
+
+if __name__ == "__main__":
+    main()
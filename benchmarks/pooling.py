@@ -0,0 +1,40 @@
+"""
+requests/sec against the local simulator, with and without connection pooling
+
+usage: python benchmarks/pooling.py [requests]
+"""
+import sys
+from time import perf_counter
+
+import requests
+
+sys.path.insert(0, ".")
+
+import ShellyPy
+from ShellyPy.simulator import ShellySimulator
+
+
+def run(device, count):
+    start = perf_counter()
+    for _ in range(count):
+        device.relay(0)
+    return count / (perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    with ShellySimulator(gen=1) as simulator:
+        # the requests module has the same post signature as a session,
+        # using it directly opens a new connection for every request
+        unpooled = ShellyPy.ShellyGen1(*simulator.address, session=requests)
+        pooled = ShellyPy.ShellyGen1(*simulator.address)
+
+        print("without pooling: {:8.1f} req/s".format(run(unpooled, count)))
+        print("with pooling:    {:8.1f} req/s".format(run(pooled, count)))
+
+        pooled.close()
+
+
+if __name__ == "__main__":
+    main()
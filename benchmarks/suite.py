@@ -0,0 +1,80 @@
+"""
+latency and throughput of ShellyPy against the bundled simulator
+
+usage: python benchmarks/suite.py [iterations] [devices]
+"""
+import sys
+from time import perf_counter
+
+sys.path.insert(0, ".")
+
+import ShellyPy
+from ShellyPy.detect import DetectionCache
+from ShellyPy.simulator import ShellySimulator
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def measure(name, func, iterations):
+    samples = []
+
+    start = perf_counter()
+    for _ in range(iterations):
+        begin = perf_counter()
+        func()
+        samples.append(perf_counter() - begin)
+    total = perf_counter() - start
+
+    print("{:<32} p50 {:8.3f} ms   p99 {:8.3f} ms   {:10.1f} ops/s".format(
+        name,
+        percentile(samples, 0.5) * 1000,
+        percentile(samples, 0.99) * 1000,
+        iterations / total
+    ))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    login = {"username": "admin", "password": "secret"}
+
+    with ShellySimulator(gen=1) as gen1, \
+         ShellySimulator(gen=2) as gen2, \
+         ShellySimulator(gen=2, login=login) as gen2_auth:
+
+        device = ShellyPy.ShellyGen1(*gen1.address)
+        measure("gen1 relay", lambda: device.relay(0, turn=True), iterations)
+        measure("gen1 status", device.status, iterations)
+
+        device = ShellyPy.ShellyGen2(*gen2.address)
+        measure("gen2 relay", lambda: device.relay(0, turn=True), iterations)
+        measure("gen2 status", device.status, iterations)
+
+        device = ShellyPy.ShellyGen2(*gen2_auth.address, login=login)
+        measure("gen2 relay (digest)", lambda: device.relay(0, turn=True), iterations)
+
+        measure("wrapper (probe)", lambda: ShellyPy.Shelly(*gen2.address, detect_cache=None), iterations)
+
+        cache = DetectionCache()
+        measure("wrapper (cached)", lambda: ShellyPy.Shelly(*gen2.address, detect_cache=cache), iterations)
+
+    simulators = [ShellySimulator(gen=1 + index % 2, latency=0.005).start() for index in range(count)]
+
+    with ShellyPy.ShellyFleet([simulator.address for simulator in simulators], workers=count) as fleet:
+        def fan_out():
+            for result in fleet.status():
+                if not result.ok:
+                    raise result.error
+
+        measure("fleet status ({} devices)".format(count), fan_out, max(iterations // 10, 1))
+
+    for simulator in simulators:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,12 @@ setuptools.setup(
     packages=["ShellyPy"],
     license="MIT",
     install_requires=requirements,
+    extras_require={
+        "async": ["aiohttp"],
+    },
+    entry_points={
+        "console_scripts": ["shellypy-collect=ShellyPy.collect:main"],
+    },
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 2",
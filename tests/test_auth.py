@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import pytest
+
+from ShellyPy import ShellyGen2
+from ShellyPy.simulator import ShellySimulator
+
+LOGIN = {"password": "secret"}
+
+
+# challenged first request, preemptive second, stale nonce on the third,
+# nonces are whole seconds so the last wait has to reach a different one
+WAITS = (0, 0, 1.1)
+
+
+def test_sync_counters_after_stale_nonce():
+    with ShellySimulator(gen=2, login=LOGIN, nonce_lifetime=0.5) as simulator:
+        device = ShellyGen2(*simulator.address, login=LOGIN, init=False)
+        for wait in WAITS:
+            time.sleep(wait)
+            device.post("Switch.GetStatus", {"id": 0})
+
+        assert device.__auth__.state.stats() == {"challenges": 2, "avoided": 1}
+
+
+def test_async_counters_match_sync():
+    pytest.importorskip("aiohttp")
+    from ShellyPy.aio import AsyncShellyGen2
+
+    async def run(address):
+        device = AsyncShellyGen2(*address, login=LOGIN, init=False)
+        try:
+            for wait in WAITS:
+                await asyncio.sleep(wait)
+                await device.post("Switch.GetStatus", {"id": 0})
+            return device.__auth__.state.stats()
+        finally:
+            await device.close()
+
+    with ShellySimulator(gen=2, login=LOGIN, nonce_lifetime=0.5) as simulator:
+        assert asyncio.run(run(simulator.address)) == {"challenges": 2, "avoided": 1}
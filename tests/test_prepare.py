@@ -0,0 +1,71 @@
+import pytest
+
+from ShellyPy import CommandSet, ShellyGen1, ShellyGen2
+
+
+def gen1():
+    return ShellyGen1("192.168.0.5", init=False)
+
+
+def gen2():
+    return ShellyGen2("192.168.0.7", init=False)
+
+
+def test_gen1_settings_values_are_query_values():
+    command = gen1().prepare("settings", name="garage")
+
+    assert command.page == "settings"
+    assert command.query == "settings?name=garage"
+
+
+def test_gen1_settings_subpage_lowercases_booleans():
+    command = gen1().prepare("settings", "relay/0", auto_off=600, default_state=True)
+
+    assert command.page == "settings/relay/0"
+    assert dict(command) == {"auto_off": 600, "default_state": "true"}
+
+
+def test_gen1_settings_without_values_reads():
+    assert gen1().prepare("settings").query == "settings?"
+
+
+def test_gen2_settings_values_are_set_config():
+    command = gen2().prepare("settings", "switch:0", auto_off=True)
+
+    assert command.page == "Switch.SetConfig"
+    assert dict(command) == {"id": 0, "config": {"auto_off": True}}
+
+
+def test_gen2_settings_name_goes_to_sys():
+    command = gen2().prepare("settings", name="garage")
+
+    assert command.page == "Sys.SetConfig"
+    assert dict(command) == {"config": {"name": "garage"}}
+
+
+def test_gen2_settings_without_values_reads():
+    command = gen2().prepare("settings", "wifi")
+
+    assert command.page == "WiFi.GetConfig"
+    assert dict(command) == {}
+
+
+def test_internal_builders_are_raw_pages():
+    # only relay, roller, light and settings go through a builder
+    assert gen2().prepare("components").page == "components"
+    assert gen1().prepare("config", {"a": 1}).query == "config?a=1"
+
+
+def test_name_is_required():
+    with pytest.raises(TypeError):
+        gen1().prepare()
+
+    with pytest.raises(TypeError):
+        CommandSet()
+
+
+def test_command_set_settings_per_generation():
+    command = CommandSet("settings", name="garage")
+
+    assert command.of(gen1()).query == "settings?name=garage"
+    assert command.of(gen2()).page == "Sys.SetConfig"